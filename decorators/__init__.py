@@ -14,8 +14,42 @@ from .descriptor import (
 )
 from .misc import (
     once,
+    scoped_once,
+    once_scope,
     deprecated,
 )
+from .concurrency import (
+    pools,
+    offload,
+    parallel_map,
+    hedge,
+)
+from .batching import (
+    batched,
+    write_behind,
+    debounce,
+    throttle,
+)
+from .instrument import (
+    timed,
+)
+from .exporter import (
+    Exporter,
+)
+from .diagnostics import (
+    slow_call,
+    blocking,
+)
+from .tracing import (
+    traced,
+    get_current_span,
+)
+from .limits import (
+    limit,
+    Overloaded,
+    rate_limit,
+    RateLimited,
+)
 
 
 __version__ = "2.0.7"
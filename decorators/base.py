@@ -4,6 +4,7 @@ import functools
 import inspect
 import re
 import logging
+import types
 
 
 from .compat import *
@@ -39,6 +40,26 @@ class Decorator(object):
     """will hold either __new__ or __call__ depending on which of those contains the
     arg to wrap with the decorator as inferred by this class"""
 
+    callback_args = True
+    """set this to False in a child class if the decorator never takes a function
+    as its first argument (eg, @dec(callback)), then a function passed to __new__
+    can only be the wrapped function and will be decorated right away"""
+
+    match_kinds = False
+    """set this to True in a child class to make sure the function returned
+    from decorate_func() is the same kind (eg, coroutine or generator function)
+    as the decorated function, leave it False if the decorator changes the
+    function's kind (eg, collects a generator into a list or runs a coroutine
+    with asyncio.run()), see match_kind()"""
+
+    registry = None
+    """set by decorators.stats.Registry.enable(), when set everything that is
+    decorated is handed to the registry so it can be tracked"""
+
+    profiler = None
+    """set by decorators.profiling.Profiler.install(), when set every decorated
+    function is handed to the profiler so it can be profiled on demand"""
+
     def __new__(cls, *args, **kwargs):
         instance = super(Decorator, cls).__new__(cls)
 
@@ -47,6 +68,11 @@ class Decorator(object):
 
         if instance.is_possible_wrap_call(*args, **kwargs):
             functools.update_wrapper(instance, args[0], updated=())
+            if markcoroutinefunction and instance.is_coroutine_function(args[0]):
+                # this might be a decorator without (...) so make sure this
+                # instance looks like the coroutine function it wraps
+                markcoroutinefunction(instance)
+
             if instance.is_class(args[0]):
                 instance.log("__new__ returning wrapped class")
                 try:
@@ -55,7 +81,10 @@ class Decorator(object):
                     # class decorator, we do this so we don't wrap the class, thus causing
                     # things like isinstance() checks to fail or the class
                     # variables being hidden
-                    instance = instance.decorate_class(args[0])
+                    decorated = instance.decorate_class(args[0])
+                    if instance.registry is not None:
+                        decorated = instance.registry.register(instance, args[0], decorated, args[1:], kwargs)
+                    instance = decorated
 
                 except NotImplementedError:
                     instance.log("Classes are not supported with this decorator")
@@ -69,6 +98,11 @@ class Decorator(object):
                     instance.log("__new__ failed ambiguous class wrap")
                     instance.wrapped_call = "__call__"
 
+            elif not instance.callback_args:
+                instance.log("__new__ returning wrapped function")
+                instance.wrapped_call = "__new__"
+                instance = instance.wrap(args[0])
+
         else:
             instance.log("__new__ arguments are not wrappable, so __call__ is the wrap call")
             instance.wrapped_call = "__call__"
@@ -81,6 +115,30 @@ class Decorator(object):
     def is_function(self, arg):
         return inspect.isroutine(arg)
 
+    def is_coroutine_function(self, arg):
+        return inspect.iscoroutinefunction(self.get_function(arg))
+
+    def is_generator_function(self, arg):
+        return inspect.isgeneratorfunction(self.get_function(arg))
+
+    def is_async_generator_function(self, arg):
+        return inspect.isasyncgenfunction(self.get_function(arg))
+
+    def get_function(self, arg):
+        """decorators used without (...) are instances of this class until they
+        are called, this will return the function they will eventually wrap
+
+        :param arg: callable
+        :returns: callable, the actual function
+        """
+        while (
+            isinstance(arg, Decorator)
+            and arg.wrapped_call != "__call__"
+            and len(arg.decorator_args) == 1
+        ):
+            arg = arg.decorator_args[0]
+        return arg
+
     def is_possible_wrap_call(self, *args, **kwargs):
         ret = False
         if len(args) == 1 and not kwargs:
@@ -105,10 +163,12 @@ class Decorator(object):
         wrapped = self.decorator_args[0]
         self.wrapped_call = "__new__"
 
-        def wrapper(*args, **kwargs):
-            return self.decorate_func(wrapped)(instance, *args, **kwargs)
-        functools.update_wrapper(wrapper, wrapped, updated=())
-        return wrapper
+        # binding the decorated function, instead of creating a wrapper, means
+        # the method is the same kind (eg, coroutine) as the decorated function
+        ret = self.get_wrapped(wrapped)
+        if instance is not None:
+            ret = types.MethodType(ret, instance)
+        return ret
 
     def __call__(self, *args, **kwargs):
         """call is used when there are (...) on the decorator or when there are no (...)
@@ -126,10 +186,9 @@ class Decorator(object):
 
         elif self.wrapped_call == "__new__":
             self.log("__new__ is the wrap call")
-            decorator_args = ()
-            decorator_kwargs = {}
-            wrapped = self.decorator_args[0]
-            invoke = True
+            # we've already figured everything out so we can skip right to
+            # calling the cached decorated value
+            return self.get_wrapped(self.decorator_args[0])(*args, **kwargs)
 
         else:
             if self.is_possible_wrap_call(*args, **kwargs):
@@ -165,7 +224,12 @@ class Decorator(object):
                 self.wrapped_call = "__new__"
 
         try:
-            ret = self.wrap(wrapped, *decorator_args, **decorator_kwargs)
+            if invoke:
+                # cache it so later calls don't decorate wrapped again
+                ret = self.get_wrapped(wrapped)
+
+            else:
+                ret = self.wrap(wrapped, *decorator_args, **decorator_kwargs)
 
         except NotImplementedError as e:
             if ambiguous:
@@ -195,9 +259,31 @@ class Decorator(object):
         return ret
 
     def wrap(self, wrapped, *decorator_args, **decorator_kwargs):
+        if self.registry is not None:
+            ret = self.registry.wrap(self, wrapped, decorator_args, decorator_kwargs)
+
+        else:
+            ret = self.decorate_wrapped(wrapped, *decorator_args, **decorator_kwargs)
+
+        if self.profiler is not None:
+            ret = self.profiler.wrap(self, wrapped, ret)
+
+        return ret
+
+    def decorate_wrapped(self, wrapped, *decorator_args, **decorator_kwargs):
+        """call the right decorate method for wrapped, this is wrap() without the
+        registry"""
         if self.is_function(wrapped):
-            self.log("Calling decorate_func()")
-            ret = self.decorate_func(wrapped, *decorator_args, **decorator_kwargs)
+            if self.is_coroutine_function(wrapped):
+                self.log("Calling decorate_async()")
+                ret = self.decorate_async(wrapped, *decorator_args, **decorator_kwargs)
+
+            else:
+                self.log("Calling decorate_func()")
+                ret = self.decorate_func(wrapped, *decorator_args, **decorator_kwargs)
+
+            if self.match_kinds:
+                ret = self.match_kind(ret, wrapped)
             functools.update_wrapper(ret, wrapped, updated=())
 
         elif self.is_class(wrapped):
@@ -209,6 +295,63 @@ class Decorator(object):
 
         return ret
 
+    def match_kind(self, wrapper, wrapped):
+        """make sure wrapper is the same kind of function (eg, coroutine, generator)
+        as wrapped so things like inspect.iscoroutinefunction() work as expected
+        on the decorated function
+
+        :param wrapper: callable, the value returned from decorate_func()
+        :param wrapped: callable, the function that was decorated
+        :returns: callable, wrapper or a new function of the correct kind that
+            calls wrapper
+        """
+        if not inspect.isfunction(wrapper):
+            return wrapper
+
+        if self.is_coroutine_function(wrapped):
+            if not inspect.iscoroutinefunction(wrapper):
+                self.log("Wrapping decorated function in a coroutine function")
+                async def coroutine_wrapper(*args, **kwargs):
+                    ret = wrapper(*args, **kwargs)
+                    if inspect.isawaitable(ret):
+                        ret = await ret
+                    return ret
+                return coroutine_wrapper
+
+        elif self.is_async_generator_function(wrapped):
+            if not inspect.isasyncgenfunction(wrapper):
+                self.log("Wrapping decorated function in an async generator function")
+                async def async_generator_wrapper(*args, **kwargs):
+                    async for v in wrapper(*args, **kwargs):
+                        yield v
+                return async_generator_wrapper
+
+        elif self.is_generator_function(wrapped):
+            if not inspect.isgeneratorfunction(wrapper):
+                self.log("Wrapping decorated function in a generator function")
+                def generator_wrapper(*args, **kwargs):
+                    return (yield from wrapper(*args, **kwargs))
+                return generator_wrapper
+
+        return wrapper
+
+    def get_wrapped(self, wrapped):
+        """wrap the value that was passed into __new__ with no decorator arguments
+        and cache it, this is used when the decorator had no (...) so wrapped
+        doesn't need to be decorated again on every call
+
+        :param wrapped: callable, the function or class that was passed into __new__
+        :returns: callable, the wrapped value
+        """
+        try:
+            ret = self._wrapped
+
+        except AttributeError:
+            ret = self.wrap(wrapped)
+            self._wrapped = ret
+
+        return ret
+
     def log(self, format_str, *format_args, **log_options):
         """wrapper around the module's logger
 
@@ -252,6 +395,19 @@ class Decorator(object):
         """
         raise NotImplementedError("decorator {} does not support function decoration".format(self.__class__.__name__))
 
+    def decorate_async(self, func, *decorator_args, **decorator_kwargs):
+        """override this in a child class to decorate coroutine functions (eg,
+        async def) with await-aware logic, by default this just calls decorate_func()
+        and, if match_kinds is True and that doesn't return a coroutine function,
+        it will be wrapped in one
+
+        :param func: coroutine function -- the function being decorated
+        :param decorator_args: tuple -- the arguments passed into the decorator (eg, @dec(1, 2))
+        :param decorator_kwargs: dict -- the named args passed into the decorator (eg, @dec(foo=1))
+        :returns: the wrapped func with our decorator func
+        """
+        return self.decorate_func(func, *decorator_args, **decorator_kwargs)
+
     def decorate_class(self, wrapped_class, *decorator_args, **decorator_kwargs):
         """override this in a child class with your own logic, it must return a
         function that returns klass or the like
@@ -322,10 +478,194 @@ class ClassDecorator(Decorator):
 
 
 class FuncDecorator(Decorator):
-    """only decorate functions/methods"""
+    """only decorate functions/methods
+
+    Child classes can either override decorate() or they can implement any of the
+    before(), around(), and after() hooks. Decorators that only use the hooks are
+    fusable, when fusable decorators are stacked they are combined into one
+    wrapper so the call depth stays flat no matter how many are stacked, the
+    return and exception semantics are the same as nested decoration:
+
+        def wrapper(*args, **kwargs):
+            args, kwargs = self.before(args, kwargs)
+            ret = None
+            with self.around():
+                ret = func(*args, **kwargs)
+            return self.after(ret)
+
+    :Example:
+        class double(FuncDecorator):
+            def after(self, ret):
+                return ret * 2
+
+        @double
+        @double
+        def foo(): return 1
+        foo() # 4, but only one wrapper function is called
+    """
     def is_wrappable(self, arg):
         return self.is_function(arg)
 
+    def is_fusable(self):
+        """return True if this decorator implements any of the hooks"""
+        klass = type(self)
+        for k in ["before", "around", "after"]:
+            if getattr(klass, k) is not getattr(FuncDecorator, k):
+                return True
+        return False
+
+    def before(self, args, kwargs):
+        """override this in a child class to run code before the function is called
+
+        the arguments passed into the decorator are available in self.hook_args
+        and self.hook_kwargs
+
+        :param args: tuple, the positional arguments the function will be called with
+        :param kwargs: dict, the keyword arguments the function will be called with
+        :returns: tuple, (args, kwargs) that will be passed to the function
+        """
+        return args, kwargs
+
+    def around(self):
+        """override this in a child class to wrap the function call in a context
+        manager, exceptions raised by the function will be passed to the context
+        manager's __exit__ method
+
+        :returns: context manager|None
+        """
+        return None
+
+    def after(self, ret):
+        """override this in a child class to run code after the function returns
+        successfully
+
+        :param ret: mixed, the value the function returned
+        :returns: mixed, the value the wrapper will return
+        """
+        return ret
+
+    def get_fused(self, func):
+        """find all the fusable decorators already wrapping func
+
+        :param func: callable
+        :returns: tuple, (layers, func) where layers is a list of the decorator
+            instances (outermost first) and func is the actual function they wrap
+        """
+        # a wrapper made with functools.wraps copies the fused attributes of the
+        # function it wraps, so only the fused wrapper itself can be absorbed
+        if getattr(func, "fused_wrapper", None) is func:
+            return list(func.fused_layers), func.fused_func
+
+        if (
+            isinstance(func, FuncDecorator)
+            and func.wrapped_call != "__call__"
+            and func.is_fusable()
+            and func.is_possible_wrap_call(*func.decorator_args, **func.decorator_kwargs)
+        ):
+            # func is a decorator that was used without (...) and hasn't been
+            # called yet, so we can absorb it
+            func.hook_args = ()
+            func.hook_kwargs = {}
+            layers, wrapped = self.get_fused(func.decorator_args[0])
+            return [func] + layers, wrapped
+
+        return [], func
+
+    def fuse(self, func, *decorator_args, **decorator_kwargs):
+        """wrap func so all the hooks of this decorator and any fusable decorators
+        it is stacked on are called from one wrapper
+
+        :param func: callable, the function being decorated
+        :param decorator_args: tuple, these will be set into self.hook_args
+        :param decorator_kwargs: dict, these will be set into self.hook_kwargs
+        :returns: callable, the fused wrapper
+        """
+        self.hook_args = decorator_args
+        self.hook_kwargs = decorator_kwargs
+
+        layers, func = self.get_fused(func)
+        layers.insert(0, self)
+
+        hooks = []
+        for layer in layers:
+            klass = type(layer)
+            hooks.append((
+                None if klass.before is FuncDecorator.before else layer.before,
+                None if klass.around is FuncDecorator.around else layer.around,
+                None if klass.after is FuncDecorator.after else layer.after,
+            ))
+
+        def enter(entered, args, kwargs):
+            for before, around, after in hooks:
+                if before:
+                    args, kwargs = before(args, kwargs)
+
+                cm = around() if around else None
+                if cm is not None:
+                    cm.__enter__()
+
+                entered.append((cm, after))
+            return args, kwargs
+
+        def unwind(entered, ret, exc):
+            # unwind from the innermost layer out, just like nested wrappers would
+            while entered:
+                cm, after = entered.pop()
+                if cm is not None:
+                    try:
+                        if exc is None:
+                            cm.__exit__(None, None, None)
+
+                        elif cm.__exit__(type(exc), exc, exc.__traceback__):
+                            exc = None
+                            ret = None
+
+                    except BaseException as e:
+                        if e is not exc:
+                            e.__context__ = exc
+                        exc = e
+
+                if exc is None and after:
+                    try:
+                        ret = after(ret)
+
+                    except BaseException as e:
+                        exc = e
+
+            if exc is not None:
+                raise exc
+
+            return ret
+
+        if self.is_coroutine_function(func):
+            async def wrapper(*args, **kwargs):
+                entered = []
+                try:
+                    args, kwargs = enter(entered, args, kwargs)
+                    ret = await func(*args, **kwargs)
+
+                except BaseException as e:
+                    return unwind(entered, None, e)
+
+                return unwind(entered, ret, None)
+
+        else:
+            def wrapper(*args, **kwargs):
+                entered = []
+                try:
+                    args, kwargs = enter(entered, args, kwargs)
+                    ret = func(*args, **kwargs)
+
+                except BaseException as e:
+                    return unwind(entered, None, e)
+
+                return unwind(entered, ret, None)
+
+        wrapper.fused_wrapper = wrapper
+        wrapper.fused_layers = tuple(layers)
+        wrapper.fused_func = func
+        return wrapper
+
     def decorate(self, func, *decorator_args, **decorator_kwargs):
         """
         override this in a child class with your own logic, it must return a
@@ -339,5 +679,7 @@ class FuncDecorator(Decorator):
         raise NotImplementedError("Define this method in your child class")
 
     def decorate_func(self, func, *args, **kwargs):
+        if self.is_fusable():
+            return self.fuse(func, *args, **kwargs)
         return self.decorate(func, *args, **kwargs)
 
@@ -0,0 +1,646 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, division, print_function, absolute_import
+import threading
+import inspect
+import atexit
+import logging
+import time
+from collections.abc import Mapping
+
+from .compat import *
+from .base import FuncDecorator
+
+
+logger = logging.getLogger(__name__)
+
+
+class Batch(object):
+    """Holds the keys of all the calls that will be passed to one bulk call"""
+    def __init__(self, loop=None):
+        self.keys = {} # we use a dict as an ordered set so keys are deduped
+        self.loop = loop
+        self.flushed = False
+        self.results = None
+        self.error = None
+
+        if loop:
+            self.future = loop.create_future()
+            self.handle = None
+
+        else:
+            self.done = threading.Event()
+
+    def result(self, key):
+        if self.error is not None:
+            raise self.error
+        return self.results[key]
+
+
+class Batcher(object):
+    """Coalesces single key calls into bulk calls
+
+    Threaded callers block until their batch is full or max_wait seconds have
+    passed since the first key was added, the caller that fills the batch (or
+    the first caller when max_wait has passed) makes the bulk call on behalf of
+    every caller in the batch. Callers in an event loop await their batch which
+    is flushed by the loop
+
+    :param bulk: callable, takes a list of keys and returns either a list of
+        results in the same order or a dict mapping each key to its result,
+        this can be a coroutine function
+    :param max_size: int, the most keys that will be passed to bulk at once
+    :param max_wait: float, the most seconds a batch will wait for more keys
+    """
+    def __init__(self, bulk, max_size=100, max_wait=0.002):
+        self.bulk = bulk
+        self.max_size = max_size
+        self.max_wait = max_wait
+        self.lock = threading.Lock()
+        self.batch = None
+        self.async_batch = None
+
+    def normalize(self, keys, results):
+        """turn the return value of bulk into a dict"""
+        if isinstance(results, Mapping):
+            return results
+
+        results = list(results)
+        if len(results) != len(keys):
+            raise ValueError("Bulk function returned {} results for {} keys".format(
+                len(results),
+                len(keys),
+            ))
+        return dict(zip(keys, results))
+
+    def run(self, batch):
+        keys = list(batch.keys)
+        try:
+            batch.results = self.normalize(keys, self.bulk(keys))
+
+        except Exception as e:
+            batch.error = e
+
+        batch.done.set()
+
+    def call(self, key):
+        """add key to the current batch and block until the batch is done
+
+        :param key: hashable, the key the caller wants the result for
+        :returns: mixed, the result for key
+        """
+        leader = flush = False
+        with self.lock:
+            batch = self.batch
+            if batch is None:
+                batch = self.batch = Batch()
+                leader = True
+
+            batch.keys[key] = None
+            if len(batch.keys) >= self.max_size:
+                self.batch = None
+                flush = True
+
+        if flush:
+            self.run(batch)
+
+        elif leader:
+            if not batch.done.wait(self.max_wait):
+                with self.lock:
+                    if self.batch is batch:
+                        self.batch = None
+                        flush = True
+
+                if flush:
+                    self.run(batch)
+
+        batch.done.wait()
+        return batch.result(key)
+
+    async def run_async(self, batch):
+        keys = list(batch.keys)
+        try:
+            results = self.bulk(keys)
+            if inspect.isawaitable(results):
+                results = await results
+            batch.results = self.normalize(keys, results)
+
+        except Exception as e:
+            batch.error = e
+
+        batch.future.set_result(None)
+
+    def flush_async(self, batch):
+        if not batch.flushed:
+            batch.flushed = True
+            batch.handle.cancel()
+            if self.async_batch is batch:
+                self.async_batch = None
+            batch.loop.create_task(self.run_async(batch))
+
+    async def call_async(self, key):
+        """async version of call(), this must be called from the event loop"""
+        loop = get_running_loop()
+        batch = self.async_batch
+        if batch is None or batch.loop is not loop:
+            batch = self.async_batch = Batch(loop)
+            batch.handle = loop.call_later(self.max_wait, self.flush_async, batch)
+
+        batch.keys[key] = None
+        if len(batch.keys) >= self.max_size:
+            self.flush_async(batch)
+
+        # shielded so one cancelled caller doesn't cancel everyone in the batch
+        await asyncio.shield(batch.future)
+        return batch.result(key)
+
+
+class batched(FuncDecorator):
+    """Coalesce concurrent single key calls into one call of the decorated bulk
+    function (aka, the DataLoader pattern)
+
+    The decorated function takes a list of keys and returns a list of results
+    in the same order, or a dict of key to result. The decorated function is then
+    called with one key and returns the result for that key. This works for
+    threaded callers and asyncio callers, when called from a running event loop
+    an awaitable is returned
+
+    :Example:
+        @batched(max_size=100, max_wait_ms=2)
+        def get_users(user_ids):
+            return db.query("SELECT * FROM user WHERE id IN (...)", user_ids)
+
+        # in many threads or tasks, only one query is ran
+        user = get_users(1)
+
+    :param max_size: int, the most keys that will be passed to the bulk function
+    :param max_wait_ms: float, the most milliseconds a call will wait for other
+        calls to join its batch
+    """
+    callback_args = False
+
+    def decorate(self, func, max_size=100, max_wait_ms=2):
+        batcher = Batcher(func, max_size, max_wait_ms / 1000.0)
+        def wrapped(key):
+            if get_running_loop():
+                return batcher.call_async(key)
+            return batcher.call(key)
+
+        wrapped.batcher = batcher
+        return wrapped
+
+    def decorate_async(self, func, max_size=100, max_wait_ms=2):
+        batcher = Batcher(func, max_size, max_wait_ms / 1000.0)
+        async def wrapped(key):
+            return await batcher.call_async(key)
+
+        wrapped.batcher = batcher
+        return wrapped
+
+
+class WriteBehind(object):
+    """Buffers items and writes them in bulk from a background thread
+
+    The background thread is started the first time an item is added and the
+    buffer is flushed one last time when the interpreter exits
+
+    :param bulk: callable, takes a list of items
+    :param flush_every: int, the buffered items will be written when there are
+        this many of them
+    :param flush_interval: float, the most seconds an item will be buffered
+    :param maxsize: int, the most items that can be buffered, when the buffer
+        is full adding an item blocks until there is room
+    :param timeout: float, the most seconds to block when the buffer is full
+        before queue.Full is raised, None to block until there is room
+    :param on_error: callable, called with (exception, items) when bulk raises
+        an error, by default the error is logged
+    """
+    stop = object()
+    """put into the queue to wake up the background thread when closing"""
+
+    def __init__(self, bulk, flush_every=500, flush_interval=1.0, maxsize=10000, timeout=None, on_error=None):
+        self.bulk = bulk
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.timeout = timeout
+        self.on_error = on_error
+        self.queue = queue.Queue(maxsize)
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.thread = None
+        self.closed = False
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self.run,
+                    name="decorators-write-behind",
+                    daemon=True,
+                )
+                self.thread.start()
+                atexit.register(self.close)
+
+    def put(self, item):
+        """buffer item, this blocks if the buffer is full"""
+        if self.closed:
+            self.write([item])
+
+        else:
+            if self.thread is None:
+                self.start()
+            self.queue.put(item, timeout=self.timeout)
+
+    def get_items(self):
+        """block until there are items and then collect items until there are
+        flush_every of them or flush_interval has passed since the first one
+
+        :returns: tuple, (items, stop)
+        """
+        item = self.queue.get()
+        if item is self.stop:
+            return [], True
+
+        items = [item]
+        deadline = time.monotonic() + self.flush_interval
+        while len(items) < self.flush_every:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+
+            try:
+                item = self.queue.get(timeout=remaining)
+
+            except queue.Empty:
+                break
+
+            if item is self.stop:
+                return items, True
+
+            items.append(item)
+
+        return items, False
+
+    def run(self):
+        stop = False
+        while not stop:
+            items, stop = self.get_items()
+            if items:
+                self.write(items)
+
+    def write(self, items):
+        with self.write_lock:
+            try:
+                self.bulk(items)
+
+            except Exception as e:
+                if self.on_error:
+                    try:
+                        self.on_error(e, items)
+
+                    except Exception as e:
+                        # the background thread has to keep running or the
+                        # buffer would fill up with nothing to empty it
+                        logger.exception(e)
+
+                else:
+                    logger.exception(e)
+
+    def flush(self):
+        """write all the currently buffered items in the current thread"""
+        items = []
+        while True:
+            try:
+                item = self.queue.get_nowait()
+
+            except queue.Empty:
+                break
+
+            if item is not self.stop:
+                items.append(item)
+                if len(items) >= self.flush_every:
+                    self.write(items)
+                    items = []
+
+        if items:
+            self.write(items)
+
+    def close(self, timeout=None):
+        """stop the background thread and write anything left in the buffer"""
+        if self.closed:
+            return
+
+        self.closed = True
+        if self.thread is not None and self.thread.is_alive():
+            try:
+                self.queue.put(self.stop, timeout=timeout)
+
+            except queue.Full:
+                pass
+
+            else:
+                self.thread.join(timeout)
+        self.flush()
+
+
+class write_behind(FuncDecorator):
+    """Buffer fire and forget calls and write them in bulk from a background thread
+
+    Calls return immediately (with None) after their arguments are buffered. The
+    bulk function receives a list of (args, kwargs) tuples, one for each call, if
+    there is no bulk function the decorated function is called for each item
+    from the background thread
+
+    :Example:
+        def insert_many(calls):
+            db.insert_many([args[0] for args, kwargs in calls])
+
+        @write_behind(flush_every=500, flush_interval=1.0, bulk=insert_many)
+        def audit(event):
+            db.insert(event)
+
+        audit({"action": "login"}) # returns immediately
+
+    :param flush_every: int, write the buffer when it has this many calls
+    :param flush_interval: float, the most seconds a call will be buffered
+    :param bulk: callable, receives a list of (args, kwargs) tuples
+    :param maxsize: int, the size of the buffer, calls will block when it is full
+    :param timeout: float, how long a call will block on a full buffer before
+        queue.Full is raised, None to block until there is room
+    :param on_error: callable, called with (exception, calls) when writing fails
+    """
+    callback_args = False
+
+    def decorate(self, func, flush_every=500, flush_interval=1.0, bulk=None, maxsize=10000, timeout=None, on_error=None):
+        if bulk is None:
+            def bulk(calls):
+                for args, kwargs in calls:
+                    func(*args, **kwargs)
+
+        writer = WriteBehind(
+            bulk,
+            flush_every=flush_every,
+            flush_interval=flush_interval,
+            maxsize=maxsize,
+            timeout=timeout,
+            on_error=on_error,
+        )
+        def wrapped(*args, **kwargs):
+            writer.put((args, kwargs))
+
+        wrapped.writer = writer
+        return wrapped
+
+    def decorate_async(self, func, *args, **kwargs):
+        raise ValueError("Coroutine function {} can't be written behind".format(func.__name__))
+
+
+class Coalescer(object):
+    """Runs the latest of many calls once, at a deadline, from a background
+    thread
+
+    The background thread is started when a call is scheduled and exits when
+    there isn't anything left to run. Whatever is pending when the interpreter
+    exits is flushed
+
+    :param func: callable
+    :param interval: float, for throttling, calls will be at least this many
+        seconds apart
+    """
+    def __init__(self, func, interval=0.0):
+        self.func = func
+        self.interval = interval
+        self.condition = threading.Condition(threading.Lock())
+        self.pending = None
+        self.deadline = None
+        self.next_allowed = 0.0
+        self.thread = None
+        self.registered = False
+
+    def schedule(self, args, kwargs, deadline):
+        """make (args, kwargs) the pending call and run it at deadline, this
+        has to be called with the condition held"""
+        self.pending = (args, kwargs)
+        self.deadline = deadline
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name="decorators-coalescer")
+            self.thread.daemon = True
+            self.thread.start()
+            if not self.registered:
+                self.registered = True
+                atexit.register(self.flush)
+
+        else:
+            self.condition.notify()
+
+    def take(self):
+        """remove and return the pending call, this has to be called with the
+        condition held"""
+        pending = self.pending
+        self.pending = None
+        if pending is not None:
+            self.next_allowed = time.monotonic() + self.interval
+        return pending
+
+    def run(self):
+        while True:
+            with self.condition:
+                while True:
+                    if self.pending is None:
+                        self.thread = None
+                        return
+
+                    remaining = self.deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+
+                args, kwargs = self.take()
+
+            try:
+                self.func(*args, **kwargs)
+
+            except Exception as e:
+                logger.exception(e)
+
+    def flush(self):
+        """run the pending call now in this thread
+
+        :returns: mixed, what the call returned, None if nothing was pending
+        """
+        with self.condition:
+            pending = self.take()
+            self.condition.notify()
+
+        if pending is not None:
+            return self.func(*pending[0], **pending[1])
+
+    def cancel(self):
+        """forget the pending call"""
+        with self.condition:
+            self.pending = None
+            self.condition.notify()
+
+
+class AsyncCoalescer(object):
+    """Coalescer for coroutine functions, the pending call is scheduled on the
+    running event loop and ran as a task"""
+    def __init__(self, func, interval=0.0):
+        self.func = func
+        self.interval = interval
+        self.pending = None
+        self.handle = None
+        self.next_allowed = 0.0
+        self.tasks = set()
+
+    def schedule(self, args, kwargs, deadline):
+        self.pending = (args, kwargs)
+        if self.handle is not None:
+            self.handle.cancel()
+
+        loop = get_running_loop()
+        self.handle = loop.call_later(deadline - time.monotonic(), self.fire)
+
+    def take(self):
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
+
+        pending = self.pending
+        self.pending = None
+        if pending is not None:
+            self.next_allowed = time.monotonic() + self.interval
+        return pending
+
+    def fire(self):
+        pending = self.take()
+        if pending is not None:
+            task = asyncio.ensure_future(self.call(*pending))
+            # the loop only keeps weak references to tasks
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def call(self, args, kwargs):
+        try:
+            await self.func(*args, **kwargs)
+
+        except Exception as e:
+            logger.exception(e)
+
+    async def flush(self):
+        """run the pending call now and return what it returned"""
+        pending = self.take()
+        if pending is not None:
+            return await self.func(*pending[0], **pending[1])
+
+    def cancel(self):
+        self.take()
+
+
+class debounce(FuncDecorator):
+    """Run the decorated function once calls have stopped for wait seconds, with
+    the arguments of the latest call
+
+    Calls return None right away. Sync functions are ran from a background
+    thread and coroutine functions are ran as a task on the event loop. Call
+    wrapped.flush() to run the pending call now or wrapped.cancel() to forget it
+
+    :Example:
+        @debounce(wait=0.2)
+        def reindex(doc_id):
+            ...
+
+        for doc_id in range(100):
+            reindex(doc_id) # reindex(99) runs once, 0.2 seconds from now
+
+    :param wait: float, how many seconds without a call before the function runs
+    """
+    callback_args = False
+
+    def decorate(self, func, wait=0.2):
+        coalescer = Coalescer(func)
+        def wrapped(*args, **kwargs):
+            with coalescer.condition:
+                coalescer.schedule(args, kwargs, time.monotonic() + wait)
+
+        wrapped.flush = coalescer.flush
+        wrapped.cancel = coalescer.cancel
+        return wrapped
+
+    def decorate_async(self, func, wait=0.2):
+        coalescer = AsyncCoalescer(func)
+        async def wrapped(*args, **kwargs):
+            coalescer.schedule(args, kwargs, time.monotonic() + wait)
+
+        wrapped.flush = coalescer.flush
+        wrapped.cancel = coalescer.cancel
+        return wrapped
+
+
+class throttle(FuncDecorator):
+    """Run the decorated function at most once every interval seconds
+
+    The first call runs right away and returns what the function returned,
+    calls made during the interval return None and, if trailing is True, the
+    latest of them runs once the interval is over (from a background thread,
+    or as a task for coroutine functions). Call wrapped.flush() to run the
+    pending call now or wrapped.cancel() to forget it
+
+    :Example:
+        @throttle(interval=1.0, trailing=True)
+        def invalidate(key):
+            ...
+
+    :param interval: float, the fewest seconds between calls
+    :param leading: bool, False to not run the first call right away, it will
+        run at the end of the interval instead
+    :param trailing: bool, False to drop the calls made during the interval
+    """
+    callback_args = False
+
+    def get_action(self, coalescer, args, kwargs, leading, trailing):
+        """figure out what a call should do
+
+        :returns: bool, True if the call should run right away, otherwise it
+            was scheduled or dropped
+        """
+        now = time.monotonic()
+        if coalescer.pending is None:
+            if now >= coalescer.next_allowed:
+                if leading:
+                    coalescer.next_allowed = now + coalescer.interval
+                    return True
+
+                if trailing:
+                    coalescer.schedule(args, kwargs, now + coalescer.interval)
+
+            elif trailing:
+                coalescer.schedule(args, kwargs, coalescer.next_allowed)
+
+        elif trailing:
+            # keep the deadline, only the arguments change
+            coalescer.pending = (args, kwargs)
+
+        return False
+
+    def decorate(self, func, interval=1.0, leading=True, trailing=True):
+        coalescer = Coalescer(func, interval)
+        def wrapped(*args, **kwargs):
+            with coalescer.condition:
+                run = self.get_action(coalescer, args, kwargs, leading, trailing)
+
+            if run:
+                return func(*args, **kwargs)
+
+        wrapped.flush = coalescer.flush
+        wrapped.cancel = coalescer.cancel
+        return wrapped
+
+    def decorate_async(self, func, interval=1.0, leading=True, trailing=True):
+        coalescer = AsyncCoalescer(func, interval)
+        async def wrapped(*args, **kwargs):
+            if self.get_action(coalescer, args, kwargs, leading, trailing):
+                return await func(*args, **kwargs)
+
+        wrapped.flush = coalescer.flush
+        wrapped.cancel = coalescer.cancel
+        return wrapped
@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+"""The places caching decorators (eg, once and property) can keep their values
+
+A cache has get(key), which raises KeyError when key isn't cached, set(key,
+value), delete(key), multi_get(keys), and multi_set(items), see Cache. Any object with these
+methods can be passed as the backend of once or property, see
+decorators.remote for a cache that is shared over a socket
+"""
+from __future__ import unicode_literals, division, print_function, absolute_import
+import contextlib
+import os
+import re
+import struct
+import tempfile
+import threading
+import weakref
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    from multiprocessing import shared_memory, resource_tracker
+except ImportError:
+    shared_memory = None
+
+from .compat import *
+
+
+class Cache(object):
+    """The methods a cache backend has, subclasses need to implement get, set,
+    and delete, multi_get defaults to calling get for each key"""
+    def get(self, key):
+        """returns the value of key, raises KeyError if key isn't cached"""
+        raise NotImplementedError()
+
+    def set(self, key, value):
+        raise NotImplementedError()
+
+    def delete(self, key):
+        raise NotImplementedError()
+
+    def multi_get(self, keys):
+        """returns dict, the value of each of keys that is cached"""
+        ret = {}
+        for key in keys:
+            try:
+                ret[key] = self.get(key)
+
+            except KeyError:
+                pass
+
+        return ret
+
+    def multi_set(self, items):
+        """cache every (key, value) in items
+
+        :param items: dict
+        """
+        for key, value in items.items():
+            self.set(key, value)
+
+
+class AttributeCache(Cache):
+    """Caches the values as attributes of an object, this is how once has
+    always cached values for the life of the process
+
+    :param obj: object, the object the values will be set on
+    """
+    def __init__(self, obj):
+        self.obj = obj
+
+    def get(self, key):
+        try:
+            return getattr(self.obj, key)
+
+        except AttributeError:
+            raise KeyError(key)
+
+    def set(self, key, value):
+        setattr(self.obj, key, value)
+
+    def delete(self, key):
+        try:
+            delattr(self.obj, key)
+
+        except AttributeError:
+            pass
+
+
+class Scope(object):
+    """Context manager that gives the code inside it its own ContextCache
+    values, see ContextCache.scope()"""
+    def __init__(self, cache):
+        self.cache = cache
+        self.token = None
+
+    def __enter__(self):
+        self.token = self.cache.current.set({})
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.cache.current.reset(self.token)
+        self.token = None
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        return self.__exit__(exc_type, exc_value, traceback)
+
+
+class ContextCache(Cache):
+    """Caches values for the length of a scope, like one request or task
+
+    The values live in a dict in a ContextVar so every scope (and the threads
+    and tasks that have a copy of its context) sees its own values, they don't
+    need a lock and they are released when the scope ends. Outside of a scope
+    nothing is cached
+
+    :Example:
+        with cache.scope():
+            cache.set("foo", 1)
+            cache.get("foo") # 1
+
+        cache.get("foo") # KeyError
+    """
+    def __init__(self, name="decorators_scope"):
+        self.current = contextvars.ContextVar(name, default=None)
+
+    def get(self, key):
+        values = self.current.get()
+        if values is None:
+            raise KeyError(key)
+        return values[key]
+
+    def set(self, key, value):
+        values = self.current.get()
+        if values is not None:
+            values[key] = value
+
+    def delete(self, key):
+        values = self.current.get()
+        if values is not None:
+            values.pop(key, None)
+
+    def scope(self):
+        """start a new scope, use it as a context manager (with or async with)
+
+        :returns: Scope
+        """
+        return Scope(self)
+
+
+context_cache = ContextCache()
+"""the cache of every once(scope="context") decorator"""
+
+
+def once_scope():
+    """start a scope for once(scope="context") and scoped_once, values cached
+    in the scope are released when it ends
+
+    :Example:
+        # in a request middleware
+        with once_scope():
+            response = handle(request)
+    """
+    return context_cache.scope()
+
+
+class SharedCache(Cache):
+    """Caches picklable values in shared memory so every process on this
+    machine that uses the same name sees them, eg, the workers of a pre-fork
+    server
+
+    The memory is a table of slots, each key is hashed to one slot so a key
+    whose slot is taken by another key replaces it. A slot holds the key's
+    digest and the pickled value, values that pickle to more than slot_size
+    bytes aren't cached. Each slot is locked on its own with fcntl while it is
+    read or written, and the thread locks are replaced in a forked child so a
+    lock held by another thread while forking can't deadlock the child
+
+    Keys have to be the same in every process, once uses decorators.keys for
+    the keys of a shared cache so they are
+
+    :param name: str, processes that use the same name share the cache
+    :param slots: int, how many values the cache can hold
+    :param slot_size: int, the most bytes a pickled value can use
+    """
+    header = struct.Struct("16sI")
+    """each slot starts with the key's digest and the value's length"""
+
+    instances = weakref.WeakSet()
+    """every SharedCache in this process, so they can be reset after a fork"""
+
+    created = set()
+    """the names of the shared memory this process created"""
+
+    def __init__(self, name, slots=4096, slot_size=1024):
+        if shared_memory is None or fcntl is None:
+            raise ValueError("Shared caches need multiprocessing.shared_memory and fcntl")
+
+        self.name = name
+        self.slots = slots
+        self.slot_size = slot_size
+        self.stride = self.header.size + slot_size
+
+        # posix shared memory names are short and can't have slashes
+        digest = hashlib.blake2b(
+            "{}:{}:{}".format(name, slots, slot_size).encode("utf-8"),
+            digest_size=8,
+        ).hexdigest()
+        self.shm_name = "decorators-{}".format(digest)
+        try:
+            self.shm = shared_memory.SharedMemory(self.shm_name, create=True, size=slots * self.stride)
+            self.created.add(self.shm_name)
+
+        except FileExistsError:
+            self.shm = shared_memory.SharedMemory(self.shm_name)
+            if self.shm_name not in self.created:
+                # only the process that created the memory should clean it up
+                resource_tracker.unregister(self.shm._name, "shared_memory")
+
+        directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+        self.path = os.path.join(directory, "{}-{}.lock".format(
+            self.shm_name,
+            re.sub(r"[^\w.-]", "_", name)[:64],
+        ))
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+
+        self.reset()
+        self.instances.add(self)
+
+    def reset(self):
+        """create the thread locks, this is called again in a forked child"""
+        self.locks = [threading.Lock() for _ in range(64)]
+
+    def get_slot(self, key):
+        """returns tuple, (digest, index) of key"""
+        digest = hashlib.blake2b(String(key).encode("utf-8"), digest_size=16).digest()
+        return digest, int.from_bytes(digest[:8], "little") % self.slots
+
+    @contextlib.contextmanager
+    def locked(self, index):
+        # fcntl locks belong to the process, so the thread lock keeps the
+        # threads of this process out of each other's way
+        with self.locks[index % len(self.locks)]:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, 1, index)
+            try:
+                yield
+
+            finally:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN, 1, index)
+
+    def get(self, key):
+        digest, index = self.get_slot(key)
+        offset = index * self.stride
+        buf = self.shm.buf
+        with self.locked(index):
+            slot_digest, length = self.header.unpack_from(buf, offset)
+            if not length or slot_digest != digest:
+                raise KeyError(key)
+
+            start = offset + self.header.size
+            data = bytes(buf[start:start + length])
+
+        return pickle.loads(data)
+
+    def set(self, key, value):
+        """cache value, returns False if it couldn't be pickled or was too big"""
+        try:
+            data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+        except Exception:
+            return False
+
+        if len(data) > self.slot_size:
+            return False
+
+        digest, index = self.get_slot(key)
+        offset = index * self.stride
+        buf = self.shm.buf
+        with self.locked(index):
+            start = offset + self.header.size
+            buf[start:start + len(data)] = data
+            self.header.pack_into(buf, offset, digest, len(data))
+
+        return True
+
+    def delete(self, key):
+        digest, index = self.get_slot(key)
+        offset = index * self.stride
+        with self.locked(index):
+            slot_digest, length = self.header.unpack_from(self.shm.buf, offset)
+            if slot_digest == digest:
+                self.header.pack_into(self.shm.buf, offset, b"", 0)
+
+    def clear(self):
+        """remove every value"""
+        for index in range(self.slots):
+            with self.locked(index):
+                self.header.pack_into(self.shm.buf, index * self.stride, b"", 0)
+
+    def close(self):
+        self.shm.close()
+        os.close(self.fd)
+
+    def unlink(self):
+        """remove the shared memory and lock file, the other processes that
+        have it open can keep using it"""
+        self.shm.unlink()
+        self.created.discard(self.shm_name)
+        try:
+            os.remove(self.path)
+
+        except OSError:
+            pass
+
+
+def reset_shared_caches():
+    for cache in list(SharedCache.instances):
+        cache.reset()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=reset_shared_caches)
@@ -2,6 +2,7 @@
 from __future__ import unicode_literals, division, print_function, absolute_import
 import sys
 import hashlib
+import inspect
 
 try:
     import cPickle as pickle
@@ -53,6 +54,17 @@ elif is_py3:
     from http import cookies
     from urllib import parse as urlparse
     import builtins
+    import asyncio
+    import contextvars
+
+    # python 3.12+ can mark any callable as a coroutine function
+    markcoroutinefunction = getattr(inspect, "markcoroutinefunction", None)
+
+    def get_running_loop():
+        """return the running event loop of the current thread or None, unlike
+        asyncio.get_running_loop() this doesn't raise an error if there isn't
+        a running loop"""
+        return asyncio._get_running_loop()
 
     # ripped from six https://github.com/benjaminp/six
     def reraise(exception_class, e, traceback=None):
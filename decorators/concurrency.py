@@ -0,0 +1,611 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, division, print_function, absolute_import
+import functools
+import threading
+import atexit
+import importlib
+import itertools
+import collections
+import time
+import os
+import re
+from concurrent.futures import (
+    ThreadPoolExecutor,
+    ProcessPoolExecutor,
+    wait,
+    FIRST_COMPLETED,
+)
+
+from .compat import *
+from .base import FuncDecorator
+from .instrument import Histogram, get_counter, get_function_name
+
+
+def get_unwrapped(module_name, qualname):
+    """Find the original function of a decorated module level function
+
+    Functions sent to a process pool are pickled by name, but the name points
+    to the decorated function and not the original function, so this finds the
+    decorated function in the other process and returns the function it wraps
+
+    :param module_name: str, the module the decorated function is defined in
+    :param qualname: str, the qualified name of the decorated function
+    :returns: callable, the original function
+    """
+    func = importlib.import_module(module_name)
+    for name in qualname.split("."):
+        func = getattr(func, name)
+    return getattr(func, "__wrapped__", func)
+
+
+def call_unwrapped(module_name, qualname, args, kwargs):
+    """Call the original function of a decorated module level function, see
+    get_unwrapped()"""
+    return get_unwrapped(module_name, qualname)(*args, **kwargs)
+
+
+def map_items(func, items, args, kwargs):
+    """Call func on each item
+
+    :returns: tuple, (results, elapsed) where results is a list of what func
+        returned for each item and elapsed is how many seconds it took
+    """
+    start = time.monotonic()
+    results = [func(item, *args, **kwargs) for item in items]
+    return results, time.monotonic() - start
+
+
+def map_unwrapped(module_name, qualname, items, args, kwargs):
+    """Call the original function of a decorated module level function on each
+    item, see get_unwrapped() and map_items()"""
+    return map_items(get_unwrapped(module_name, qualname), items, args, kwargs)
+
+
+class Pools(object):
+    """Named executors that are shared between all the decorators that use them
+
+    Pools are created lazily the first time they are requested and are all shut
+    down when the interpreter exits
+
+    :Example:
+        pools.configure("cpu", max_workers=4, kind="process")
+        executor = pools.get("cpu") # ProcessPoolExecutor with 4 workers
+        executor = pools.get("io") # ThreadPoolExecutor with the default workers
+    """
+    kinds = {
+        "thread": ThreadPoolExecutor,
+        "process": ProcessPoolExecutor,
+    }
+
+    def __init__(self):
+        self.configs = {}
+        self.executors = {}
+        self.lock = threading.Lock()
+
+    def configure(self, name, max_workers=None, kind="thread"):
+        """Set how the named pool will be created
+
+        :param name: str, the name of the pool
+        :param max_workers: int, how many workers the pool will have, None for
+            the executor's default
+        :param kind: str, either "thread" or "process"
+        """
+        if kind not in self.kinds:
+            raise ValueError("Unknown pool kind {}".format(kind))
+
+        with self.lock:
+            if name in self.executors:
+                raise ValueError("Pool {} has already been created".format(name))
+            self.configs[name] = (max_workers, kind)
+
+    def setdefault(self, name, max_workers=None, kind="thread"):
+        """configure the named pool only if it hasn't been configured already"""
+        with self.lock:
+            if name not in self.configs:
+                self.configs[name] = (max_workers, kind)
+
+    def get_kind(self, name):
+        """return the kind (eg, "thread") of the named pool"""
+        return self.configs.get(name, (None, "thread"))[1]
+
+    def get(self, name):
+        """return the named executor, creating it if needed
+
+        :param name: str, the name of the pool
+        :returns: concurrent.futures.Executor
+        """
+        try:
+            return self.executors[name]
+
+        except KeyError:
+            with self.lock:
+                if name not in self.executors:
+                    max_workers, kind = self.configs.get(name, (None, "thread"))
+                    executor_class = self.kinds[kind]
+                    kwargs = {}
+                    if kind == "thread":
+                        kwargs["thread_name_prefix"] = "decorators-{}".format(name)
+                    self.executors[name] = executor_class(max_workers, **kwargs)
+
+                return self.executors[name]
+
+    def shutdown(self, wait=True):
+        """shut down all the created executors, they will be recreated if they
+        are requested again"""
+        with self.lock:
+            executors = self.executors
+            self.executors = {}
+
+        for executor in executors.values():
+            executor.shutdown(wait=wait)
+
+
+pools = Pools()
+atexit.register(pools.shutdown)
+
+
+class offload(FuncDecorator):
+    """Run the decorated function on a named thread or process pool
+
+    When called from a running event loop the decorated function returns an
+    awaitable, otherwise the function is called normally (or it is submitted
+    to the pool and a concurrent.futures.Future is returned if future=True)
+
+    Functions ran on a process pool need to be defined at the module level
+
+    :Example:
+        @offload(pool="io")
+        def read(path):
+            with open(path) as fp:
+                return fp.read()
+
+        async def main():
+            contents = await read("/some/path") # ran in the "io" pool
+
+        contents = read("/some/path") # ran normally in the current thread
+
+    :param pool: str, the name of the pool, see Pools.configure() to set the size
+        and kind of the pool
+    :param future: bool, True to have calls outside of an event loop submitted
+        to the pool and return a concurrent.futures.Future
+    """
+    callback_args = False
+
+    def decorate(self, func, pool="default", future=False):
+        def wrapped(*args, **kwargs):
+            loop = get_running_loop()
+            if not loop and not future:
+                return func(*args, **kwargs)
+
+            executor = pools.get(pool)
+            if pools.get_kind(pool) == "process":
+                callback = functools.partial(
+                    call_unwrapped,
+                    func.__module__,
+                    func.__qualname__,
+                    args,
+                    kwargs,
+                )
+
+            else:
+                # carry contextvars into the thread just like asyncio.to_thread
+                callback = functools.partial(
+                    contextvars.copy_context().run,
+                    func,
+                    *args,
+                    **kwargs
+                )
+
+            if loop:
+                return loop.run_in_executor(executor, callback)
+
+            return executor.submit(callback)
+
+        return wrapped
+
+    def decorate_async(self, func, *args, **kwargs):
+        raise ValueError("Coroutine function {} can't be offloaded".format(func.__name__))
+
+
+class parallel_map(FuncDecorator):
+    """Turn a function that takes one item into a function that takes an iterable
+    of items and processes them in chunks on a process pool
+
+    Results are streamed back through a generator and only a bounded number of
+    chunks are in flight at any one time, so large (or infinite) iterables don't
+    have to fit in memory. The decorated function needs to be defined at the
+    module level to run on a process pool
+
+    :Example:
+        @parallel_map(workers=8)
+        def transform(item):
+            return item * 2
+
+        for result in transform(range(1000000)):
+            print(result)
+
+    :param workers: int, how many processes, defaults to the number of cpus
+    :param chunksize: int|str, how many items to send to a worker at a time,
+        "auto" will size the chunks so each chunk takes about target_chunk_time
+    :param ordered: bool, False to yield results as soon as their chunk is done
+        instead of in the same order as the input
+    :param pool: str, the name of a configured pool to use instead of a process
+        pool with workers processes
+    """
+    callback_args = False
+
+    target_chunk_time = 0.05
+    """how many seconds each chunk should take when chunksize is "auto" """
+
+    max_chunksize = 10000
+
+    def decorate(self, func, workers=None, chunksize="auto", ordered=True, pool=None):
+        if pool is None:
+            workers = workers or os.cpu_count() or 1
+            pool = "parallel_map-{}".format(workers)
+            pools.setdefault(pool, max_workers=workers, kind="process")
+
+        else:
+            workers = workers or pools.configs.get(pool, (None, None))[0] or os.cpu_count() or 1
+
+        def wrapped(iterable, *args, **kwargs):
+            if pools.get_kind(pool) == "process":
+                task = functools.partial(map_unwrapped, func.__module__, func.__qualname__)
+
+            else:
+                task = functools.partial(map_items, func)
+
+            return self.map(
+                task,
+                pools.get(pool),
+                iterable,
+                args,
+                kwargs,
+                chunksize=chunksize,
+                ordered=ordered,
+                # keep every worker busy while results are being consumed
+                window=workers * 2,
+            )
+
+        return wrapped
+
+    def decorate_async(self, func, *args, **kwargs):
+        raise ValueError("Coroutine function {} can't be mapped".format(func.__name__))
+
+    def get_chunksize(self, chunksize, count, elapsed):
+        """adjust the chunksize using how long the last chunk took
+
+        :param chunksize: int, the current chunksize
+        :param count: int, how many items were in the last chunk
+        :param elapsed: float, how many seconds the last chunk took
+        :returns: int, the new chunksize
+        """
+        if elapsed > 0:
+            size = int(self.target_chunk_time / (elapsed / count))
+            # don't grow too fast in case the first items were unusually quick
+            chunksize = max(1, min(size, chunksize * 2, self.max_chunksize))
+
+        else:
+            chunksize = min(chunksize * 2, self.max_chunksize)
+
+        return chunksize
+
+    def map(self, task, executor, iterable, args, kwargs, chunksize, ordered, window):
+        """generator that submits chunks of iterable to executor and yields the
+        results"""
+        auto = chunksize == "auto"
+        if auto:
+            chunksize = 1
+
+        it = iter(iterable)
+        pending = collections.deque()
+        exhausted = False
+
+        try:
+            while True:
+                while not exhausted and len(pending) < window:
+                    chunk = list(itertools.islice(it, chunksize))
+                    if chunk:
+                        pending.append(executor.submit(task, chunk, args, kwargs))
+
+                    else:
+                        exhausted = True
+
+                if not pending:
+                    break
+
+                if ordered:
+                    f = pending.popleft()
+
+                else:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    f = done.pop()
+                    pending.remove(f)
+
+                results, elapsed = f.result()
+                if auto:
+                    chunksize = self.get_chunksize(chunksize, len(results), elapsed)
+
+                for result in results:
+                    yield result
+
+        finally:
+            for f in pending:
+                f.cancel()
+
+
+class Hedger(object):
+    """Keeps the recent latency history of a function and decides how long a
+    call waits before it is hedged
+
+    Latencies are recorded in a histogram that is replaced every window
+    seconds, the percentile comes from the current window or, until it has
+    min_samples latencies, the window before it, so old latencies stop
+    counting. Every call adds budget to a bucket of hedges and every hedge
+    takes one out of it, so no more than about budget of the calls are hedged
+    even when every call is slow
+
+    :param name: str, the function's full name
+    :param after: str|float, a percentile of the recorded latencies (eg, "p95")
+        or a fixed number of milliseconds
+    :param min_samples: int, calls aren't hedged until this many latencies
+        have been recorded
+    :param budget: float, the fraction of calls that can be hedged (eg, 0.1
+        for at most a tenth of the calls)
+    """
+    refresh = 1.0
+    """how many seconds the percentile is cached for"""
+
+    window = 10.0
+    """how many seconds of latencies a histogram holds before it is replaced"""
+
+    burst = 10.0
+    """the most hedges that can be saved up by calls that weren't hedged"""
+
+    def __init__(self, name, after="p95", min_samples=20, budget=0.1):
+        self.name = name
+        self.min_samples = min_samples
+        self.budget = budget
+        self.tokens = self.burst
+        self.history = Histogram(name)
+        self.previous = None
+        self.rotated = time.monotonic()
+        self.percentile = None
+        self.delay = None
+        self.refreshed = None
+        self.lock = threading.Lock()
+
+        if isinstance(after, basestring):
+            m = re.match(r"^p(\d+(?:\.\d+)?)$", after)
+            if not m:
+                raise ValueError("after should look like p95, not {}".format(after))
+            self.percentile = float(m.group(1))
+
+        else:
+            self.delay = after / 1000.0
+
+        self.hedges = get_counter(
+            "decorators_hedges_total",
+            "Duplicate calls started because the first call was slow",
+            function=name,
+        )
+        self.wins = get_counter(
+            "decorators_hedge_wins_total",
+            "Hedged calls where a duplicate finished first",
+            function=name,
+        )
+
+    def rotate(self, now):
+        """start a new histogram if the current one is older than window"""
+        with self.lock:
+            if now - self.rotated >= self.window:
+                self.previous = self.history
+                self.history = Histogram(self.name)
+                self.rotated = now
+
+    def get_delay(self):
+        """returns how many seconds to wait before hedging, None to not hedge"""
+        if self.percentile is None:
+            return self.delay
+
+        now = time.monotonic()
+        if self.refreshed is None or now - self.refreshed >= self.refresh:
+            self.rotate(now)
+            delay = None
+            for history in [self.history, self.previous]:
+                if history is not None:
+                    s = history.snapshot()
+                    if s.count >= self.min_samples:
+                        delay = s.percentile(self.percentile)
+                        break
+
+            self.delay = delay
+            self.refreshed = now
+
+        return self.delay
+
+    def add_call(self):
+        """a call was made, add its share of the budget"""
+        with self.lock:
+            self.tokens = min(self.burst, self.tokens + self.budget)
+
+    def take_hedge(self):
+        """returns True if the budget has room for another hedge"""
+        with self.lock:
+            if self.tokens >= 1.0:
+                self.tokens -= 1.0
+                self.hedges.inc()
+                return True
+        return False
+
+    def record(self, elapsed, error=False):
+        self.history.record(int(elapsed * 1e9), error)
+
+
+running = threading.local()
+"""running.hedged is True in a pool thread that is running a sync hedged call,
+see hedge"""
+
+
+class hedge(FuncDecorator):
+    """Start a duplicate call when a call is slower than usual and return
+    whichever call finishes first
+
+    The decorated function should be idempotent since it might run more than
+    once. Sync calls run on a named pool while they can be hedged and the
+    duplicates that lose are ignored, async duplicates are tasks and the losers
+    are cancelled. Every call's latency is recorded in wrapped.hedger.history
+
+    A sync call only starts waiting to be hedged once a pool thread has started
+    running it, so time spent queued for a busy pool doesn't look slow, and a
+    hedged call made while running on the pool (eg, a hedged function that
+    calls another one) runs in that thread instead of waiting on the pool
+
+    :Example:
+        @hedge(after="p95", max_extra=1)
+        def fetch(key):
+            return replica.get(key)
+
+    :param after: str|float, hedge once the call has taken longer than this
+        percentile of the function's recent latencies (eg, "p95"), or this many
+        milliseconds
+    :param max_extra: int, the most duplicates a call can start
+    :param pool: str, the pool sync calls run on, see Pools
+    :param min_samples: int, how many calls need to be recorded before calls
+        will be hedged
+    :param budget: float, the fraction of calls that can be hedged, see Hedger
+    """
+    callback_args = False
+
+    def decorate(self, func, after="p95", max_extra=1, pool="hedge", min_samples=20, budget=0.1):
+        hedger = Hedger(get_function_name(func), after, min_samples, budget)
+        clock = time.perf_counter
+
+        def attempt(context, args, kwargs):
+            start = clock()
+            try:
+                ret = context.run(func, *args, **kwargs)
+
+            except BaseException:
+                hedger.record(clock() - start, True)
+                raise
+
+            hedger.record(clock() - start)
+            return ret
+
+        def run(started, context, args, kwargs):
+            started.set()
+            running.hedged = True
+            try:
+                return attempt(context, args, kwargs)
+
+            finally:
+                running.hedged = False
+
+        def wrapped(*args, **kwargs):
+            hedger.add_call()
+            delay = hedger.get_delay()
+            if delay is None or getattr(running, "hedged", False):
+                return attempt(contextvars.copy_context(), args, kwargs)
+
+            executor = pools.get(pool)
+            started = threading.Event()
+            first = executor.submit(run, started, contextvars.copy_context(), args, kwargs)
+            pending = {first}
+            errors = []
+            extra = 0
+            try:
+                # a hedge would wait for a pool thread too, so the delay starts
+                # when the call does
+                started.wait()
+                while pending:
+                    done, pending = wait(
+                        pending,
+                        timeout=delay if extra < max_extra else None,
+                        return_when=FIRST_COMPLETED,
+                    )
+
+                    for f in done:
+                        if f.exception() is None:
+                            if f is not first:
+                                hedger.wins.inc()
+                            return f.result()
+                        errors.append(f.exception())
+
+                    if not done:
+                        extra += 1
+                        if hedger.take_hedge():
+                            pending.add(executor.submit(
+                                run,
+                                threading.Event(),
+                                contextvars.copy_context(),
+                                args,
+                                kwargs,
+                            ))
+
+            finally:
+                for f in pending:
+                    f.cancel()
+
+            raise errors[0]
+
+        wrapped.hedger = hedger
+        return wrapped
+
+    def decorate_async(self, func, after="p95", max_extra=1, pool="hedge", min_samples=20, budget=0.1):
+        hedger = Hedger(get_function_name(func), after, min_samples, budget)
+        clock = time.perf_counter
+
+        async def attempt(args, kwargs):
+            start = clock()
+            try:
+                ret = await func(*args, **kwargs)
+
+            except asyncio.CancelledError:
+                raise
+
+            except BaseException:
+                hedger.record(clock() - start, True)
+                raise
+
+            hedger.record(clock() - start)
+            return ret
+
+        async def wrapped(*args, **kwargs):
+            hedger.add_call()
+            delay = hedger.get_delay()
+            if delay is None:
+                return await attempt(args, kwargs)
+
+            first = asyncio.ensure_future(attempt(args, kwargs))
+            pending = {first}
+            errors = []
+            extra = 0
+            try:
+                while pending:
+                    done, pending = await asyncio.wait(
+                        pending,
+                        timeout=delay if extra < max_extra else None,
+                        return_when=asyncio.FIRST_COMPLETED,
+                    )
+
+                    for t in done:
+                        if t.exception() is None:
+                            if t is not first:
+                                hedger.wins.inc()
+                            return t.result()
+                        errors.append(t.exception())
+
+                    if not done:
+                        extra += 1
+                        if hedger.take_hedge():
+                            pending.add(asyncio.ensure_future(attempt(args, kwargs)))
+
+            finally:
+                for t in pending:
+                    t.cancel()
+
+            raise errors[0]
+
+        wrapped.hedger = hedger
+        return wrapped
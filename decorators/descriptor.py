@@ -3,6 +3,7 @@ from __future__ import unicode_literals, division, print_function, absolute_impo
 
 from .compat import *
 from .base import FuncDecorator
+from .instrument import get_cache_counters, get_function_name
 
 
 class classproperty(property):
@@ -72,6 +73,10 @@ class property(FuncDecorator):
             setters and getters will be created
         * readonly -- string, the decorated method will be the getter and set the value 
             into the name defined in readonly, and no setter or deleter will be allowed
+        * backend -- object, a cache backend (see decorators.cache.Cache) that cached
+            values are also kept in, so other processes can use them
+        * key -- callable, returns what identifies the instance in the backend's key
+            (eg, lambda self: self.pk), this is required with backend
     """
     def __init__(self, fget=None, fset=None, fdel=None, doc=None, **kwargs):
         self.getter(fget)
@@ -94,6 +99,12 @@ class property(FuncDecorator):
 
         self.cached = True if self.name else False
         self.allow_empty = kwargs.pop('allow_empty', True)
+        self.backend = kwargs.pop("backend", None)
+        self.key = kwargs.pop("key", None)
+        if self.backend is not None and self.key is None:
+            # hash() of most objects is their address, which is reused by
+            # other instances and means nothing to other processes
+            raise ValueError("A property with a backend needs a key")
 
     def log(self, format_str, *format_args, **log_options):
         fget = getattr(self, "fget", None)
@@ -116,6 +127,32 @@ class property(FuncDecorator):
 
         return ret
 
+    def get_counters(self):
+        """returns the (hits, misses, evictions) counters of a cached property"""
+        try:
+            return self.counters
+
+        except AttributeError:
+            func = self.fget or self.fset or self.fdel
+            self.counters = get_cache_counters(func, "property")
+            return self.counters
+
+    def get_key(self, instance):
+        """returns str, the key of instance's value in the backend"""
+        func = self.fget or self.fset or self.fdel
+        return "{}:{}".format(get_function_name(func), self.key(instance))
+
+    def get_backend_value(self, instance):
+        """returns the value of instance cached in the backend, raises KeyError
+        if it isn't cached"""
+        if self.backend is None:
+            raise KeyError(self.name)
+
+        value = self.backend.get(self.get_key(instance))
+        if not value and not self.allow_empty:
+            raise KeyError(self.name)
+        return value
+
     def get_value(self, instance):
         if self.fget:
             try:
@@ -150,20 +187,32 @@ class property(FuncDecorator):
         self.readonly = False
 
         if self.cached:
+            hits, misses, _ = self.get_counters()
             if self.name in instance.__dict__:
                 self.log("Checking cache for {}", self.name)
                 value = instance.__dict__[self.name]
                 if not value and not self.allow_empty:
                     self.log("Cache failed for {}", self.name)
+                    misses.inc()
                     value = self.get_value(instance)
                     if value or self.allow_empty:
                         self.__set__(instance, value)
 
+                else:
+                    hits.inc()
+
             else:
-                value = self.get_value(instance)
-                if value or self.allow_empty:
-                    self.log("Caching value in {}", self.name)
-                    self.__set__(instance, value)
+                try:
+                    value = self.get_backend_value(instance)
+                    hits.inc()
+                    self.cache_value(instance, value)
+
+                except KeyError:
+                    misses.inc()
+                    value = self.get_value(instance)
+                    if value or self.allow_empty:
+                        self.log("Caching value in {}", self.name)
+                        self.__set__(instance, value)
 
         else:
             value = self.get_value(instance)
@@ -178,11 +227,9 @@ class property(FuncDecorator):
 
         if self.cached:
             self.log("Caching value in {}", self.name)
-            if self.fset:
-                self.fset(instance, value)
-
-            else:
-                instance.__dict__[self.name] = value
+            self.cache_value(instance, value)
+            if self.backend is not None:
+                self.backend.set(self.get_key(instance), value)
 
         else:
             if self.fset is None:
@@ -190,18 +237,30 @@ class property(FuncDecorator):
 
             self.fset(instance, value)
 
+    def cache_value(self, instance, value):
+        """set value as the cached value of instance in this process"""
+        if self.fset:
+            self.fset(instance, value)
+
+        else:
+            instance.__dict__[self.name] = value
+
     def __delete__(self, instance):
         if self.readonly:
             raise AttributeError("Can't delete readonly attribute")
 
         if self.cached:
             self.log("Deleting cached value in {}", self.name)
+            if self.backend is not None:
+                self.backend.delete(self.get_key(instance))
             if self.fdel:
                 self.fdel(instance)
+                self.get_counters()[2].inc()
 
             else:
                 if self.name in instance.__dict__:
                     instance.__dict__.pop(self.name, None)
+                    self.get_counters()[2].inc()
 
                 else:
                     raise AttributeError("Can't delete attribute")
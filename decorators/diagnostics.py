@@ -0,0 +1,367 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, division, print_function, absolute_import
+import logging
+import reprlib
+import sys
+import threading
+import time
+import traceback
+
+from .compat import *
+from .base import FuncDecorator
+from .instrument import get_function_name, get_counter
+from .concurrency import offload as offload_decorator
+
+
+logger = logging.getLogger(__name__)
+
+
+summarizer = reprlib.Repr()
+summarizer.maxstring = 60
+summarizer.maxother = 60
+
+
+def summarize(args, kwargs):
+    """return short reprs of args and kwargs so they are safe to put in a log
+
+    :returns: tuple, (list, dict)
+    """
+    return (
+        [summarizer.repr(arg) for arg in args],
+        {k: summarizer.repr(v) for k, v in kwargs.items()},
+    )
+
+
+class Call(object):
+    """A call the Watchdog is keeping an eye on"""
+    __slots__ = ("thread", "deadline", "stack")
+
+    def __init__(self, thread, deadline):
+        self.thread = thread
+        self.deadline = deadline
+        self.stack = None
+
+
+class Watchdog(object):
+    """A background thread that captures the stack of any watched call that is
+    still running past its deadline
+
+    The stack is read from sys._current_frames() so the watched thread doesn't
+    have to do anything besides adding and removing its call. The thread only
+    wakes up every interval while there are calls to watch, otherwise it waits
+    for add() to wake it
+    """
+    min_interval = 0.001
+
+    def __init__(self):
+        self.calls = {}
+        self.interval = None
+        self.thread = None
+        self.lock = threading.Lock()
+        self.busy = threading.Event()
+
+    def watch(self, threshold):
+        """make sure calls that take threshold seconds will be seen, this starts
+        the background thread if needed"""
+        with self.lock:
+            interval = max(self.min_interval, threshold / 2.0)
+            if self.interval is None or interval < self.interval:
+                self.interval = interval
+
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="decorators-watchdog")
+                self.thread.daemon = True
+                self.thread.start()
+
+    def add(self, threshold):
+        """start watching the calling thread
+
+        :param threshold: float, how many seconds until the stack is captured
+        :returns: Call, pass this to remove() when the call is done
+        """
+        call = Call(threading.get_ident(), time.monotonic() + threshold)
+        self.calls[id(call)] = call
+        if not self.busy.is_set():
+            self.busy.set()
+        return call
+
+    def remove(self, call):
+        self.calls.pop(id(call), None)
+
+    def run(self):
+        while True:
+            self.busy.wait()
+            time.sleep(self.interval)
+            self.sample()
+
+            if not self.calls:
+                self.busy.clear()
+                if self.calls:
+                    # a call was added before busy was cleared
+                    self.busy.set()
+
+    def sample(self):
+        """capture the stack of every call that is past its deadline"""
+        now = time.monotonic()
+        frames = None
+        for call in list(self.calls.values()):
+            if call.stack is None and now >= call.deadline:
+                if frames is None:
+                    frames = sys._current_frames()
+
+                frame = frames.get(call.thread)
+                if frame is not None:
+                    call.stack = traceback.format_stack(frame)
+
+
+watchdog = Watchdog()
+
+
+class RateLimit(object):
+    """Allow at most one event every interval seconds, events in between are
+    counted so the next allowed event can say how many were suppressed"""
+    def __init__(self, interval):
+        self.interval = interval
+        self.last = None
+        self.suppressed = 0
+
+    def allow(self):
+        """returns None if the event should be suppressed, otherwise how many
+        events were suppressed since the last allowed event"""
+        now = time.monotonic()
+        if self.last is not None and now - self.last < self.interval:
+            self.suppressed += 1
+            return None
+
+        self.last = now
+        suppressed = self.suppressed
+        self.suppressed = 0
+        return suppressed
+
+
+class slow_call(FuncDecorator):
+    """Log a structured event when a call takes longer than threshold_ms
+
+    The event is logged as a warning with the event dict in the record's
+    slow_call attribute (eg, logging's extra), it has the function's name, how
+    long the call took, a summary of the arguments, the error if the call
+    raised one, and the stack if stack=True
+
+    :Example:
+        @slow_call(threshold_ms=50, stack=True)
+        def foo(*args, **kwargs):
+            ...
+
+    :param threshold_ms: float, calls that take longer than this many
+        milliseconds are reported
+    :param stack: bool, True to capture the stack of the call while it is still
+        running once it passes the threshold, this is done from a watchdog
+        thread so it shows where the call is stuck
+    :param interval: float, report at most one slow call for the function every
+        interval seconds
+    :param callback: callable, called with the event dict of each reported call
+    """
+    callback_args = False
+
+    event_name = "slow_call"
+    """the log record attribute the event is put in"""
+
+    def get_message(self, event):
+        return "Slow call {} took {:.1f}ms (threshold {:.1f}ms)".format(
+            event["function"],
+            event["elapsed_ms"],
+            event["threshold_ms"],
+        )
+
+    def get_event(self, func, elapsed, threshold, args, kwargs, error, stack):
+        args, kwargs = summarize(args, kwargs)
+        event = {
+            "function": get_function_name(func),
+            "elapsed_ms": elapsed * 1000.0,
+            "threshold_ms": threshold * 1000.0,
+            "args": args,
+            "kwargs": kwargs,
+            "thread": threading.current_thread().name,
+        }
+        if error is not None:
+            event["error"] = "{}: {}".format(error.__class__.__name__, error)
+
+        if stack is not None:
+            event["stack"] = stack
+
+        return event
+
+    def get_report(self, func, threshold, interval, callback):
+        limit = RateLimit(interval)
+        def report(elapsed, args, kwargs, error, stack):
+            suppressed = limit.allow()
+            if suppressed is None:
+                return
+
+            event = self.get_event(func, elapsed, threshold, args, kwargs, error, stack)
+            event["suppressed"] = suppressed
+            logger.warning(self.get_message(event), extra={self.event_name: event})
+
+            if callback:
+                callback(event)
+
+        return report
+
+    def decorate(self, func, threshold_ms=50, stack=False, interval=60.0, callback=None):
+        threshold = threshold_ms / 1000.0
+        report = self.get_report(func, threshold, interval, callback)
+        clock = time.perf_counter
+
+        if stack:
+            watchdog.watch(threshold)
+
+        def wrapped(*args, **kwargs):
+            call = watchdog.add(threshold) if stack else None
+            error = None
+            start = clock()
+            try:
+                return func(*args, **kwargs)
+
+            except Exception as e:
+                error = e
+                raise
+
+            finally:
+                elapsed = clock() - start
+                if call:
+                    watchdog.remove(call)
+
+                if elapsed > threshold:
+                    report(elapsed, args, kwargs, error, call.stack if call else None)
+
+        return wrapped
+
+    def decorate_async(self, func, threshold_ms=50, stack=False, interval=60.0, callback=None):
+        threshold = threshold_ms / 1000.0
+        report = self.get_report(func, threshold, interval, callback)
+        clock = time.perf_counter
+
+        if stack:
+            watchdog.watch(threshold)
+
+        # the captured stack is whatever the loop's thread was running when the
+        # threshold passed, which is the culprit when the loop itself is stuck
+        async def wrapped(*args, **kwargs):
+            call = watchdog.add(threshold) if stack else None
+            error = None
+            start = clock()
+            try:
+                return await func(*args, **kwargs)
+
+            except Exception as e:
+                error = e
+                raise
+
+            finally:
+                elapsed = clock() - start
+                if call:
+                    watchdog.remove(call)
+
+                if elapsed > threshold:
+                    report(elapsed, args, kwargs, error, call.stack if call else None)
+
+        return wrapped
+
+
+class blocking(slow_call):
+    """Report sync calls that block a running event loop for longer than
+    threshold_ms
+
+    Calls made from a thread without a running event loop are not timed. A
+    reported event also has the task that was blocked on the loop and a
+    suggestion, and every blocking call is counted in the
+    decorators_loop_blocked_total counter
+
+    :Example:
+        @blocking(threshold_ms=10)
+        def read(path):
+            with open(path) as fp:
+                return fp.read()
+
+        async def main():
+            read("/some/path") # logs a warning if the read took over 10ms
+
+    :param threshold_ms: float, loop calls that take longer than this many
+        milliseconds are reported
+    :param offload: bool, True to run calls made from the loop on pool instead,
+        like the offload decorator the callers then have to await the returned
+        awaitable
+    :param pool: str, the pool that calls are offloaded to
+    :param stack: bool, see slow_call
+    :param interval: float, see slow_call
+    :param callback: callable, see slow_call
+    """
+    event_name = "blocking"
+
+    def get_message(self, event):
+        return "Call {} blocked the event loop in task {} for {:.1f}ms (threshold {:.1f}ms), {}".format(
+            event["function"],
+            event["task"],
+            event["elapsed_ms"],
+            event["threshold_ms"],
+            event["suggestion"],
+        )
+
+    def get_event(self, func, elapsed, threshold, args, kwargs, error, stack):
+        event = super(blocking, self).get_event(func, elapsed, threshold, args, kwargs, error, stack)
+        task = asyncio.current_task()
+        if task is None:
+            event["task"] = None
+            event["coroutine"] = None
+
+        else:
+            event["task"] = task.get_name()
+            coro = task.get_coro()
+            event["coroutine"] = getattr(coro, "__qualname__", repr(coro))
+
+        event["suggestion"] = "decorate it with @offload and await it, or await asyncio.to_thread()"
+        return event
+
+    def decorate(self, func, threshold_ms=10, offload=False, pool="default", stack=False, interval=60.0, callback=None):
+        if offload:
+            return offload_decorator().decorate(func, pool=pool)
+
+        threshold = threshold_ms / 1000.0
+        report = self.get_report(func, threshold, interval, callback)
+        blocked = get_counter(
+            "decorators_loop_blocked_total",
+            "Sync calls that blocked a running event loop for longer than their threshold",
+            function=get_function_name(func),
+        )
+        clock = time.perf_counter
+
+        if stack:
+            watchdog.watch(threshold)
+
+        def wrapped(*args, **kwargs):
+            if not get_running_loop():
+                return func(*args, **kwargs)
+
+            call = watchdog.add(threshold) if stack else None
+            error = None
+            start = clock()
+            try:
+                return func(*args, **kwargs)
+
+            except Exception as e:
+                error = e
+                raise
+
+            finally:
+                elapsed = clock() - start
+                if call:
+                    watchdog.remove(call)
+
+                if elapsed > threshold:
+                    blocked.inc()
+                    report(elapsed, args, kwargs, error, call.stack if call else None)
+
+        return wrapped
+
+    def decorate_async(self, func, *args, **kwargs):
+        raise ValueError("Coroutine function {} is already async".format(func.__name__))
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, division, print_function, absolute_import
+import threading
+
+from .compat import *
+from . import instrument
+
+
+class MetricsHandler(SimpleHTTPRequestHandler):
+    """Serves the exporter's metrics at / and /metrics"""
+    def do_GET(self):
+        if urlparse.urlsplit(self.path).path in ("/", "/metrics"):
+            body = self.server.exporter.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        else:
+            self.send_error(404)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Exporter(object):
+    """Serve the metrics of all the decorators (eg, timed latencies and cache
+    hits/misses/evictions) in the Prometheus text format
+
+    The server runs on a daemon thread and only reads snapshots of the metrics
+    so it never touches the decorated functions' hot paths
+
+    :Example:
+        exporter = Exporter(port=9464).start()
+        # curl http://127.0.0.1:9464/metrics
+        exporter.stop()
+
+    :param host: str, the interface to listen on, defaults to only local
+        connections
+    :param port: int, 0 to pick a free port
+    """
+    quantiles = (0.5, 0.9, 0.99)
+
+    def __init__(self, host="127.0.0.1", port=9464):
+        self.host = host
+        self.port = port
+        self.server = None
+        self.thread = None
+
+    @property
+    def address(self):
+        """the (host, port) the server is listening on"""
+        return self.server.server_address if self.server else (self.host, self.port)
+
+    def start(self):
+        self.server = HTTPServer((self.host, self.port), MetricsHandler)
+        self.server.daemon_threads = True
+        self.server.exporter = self
+        self.thread = threading.Thread(
+            target=self.server.serve_forever,
+            name="decorators-exporter",
+            daemon=True,
+        )
+        self.thread.start()
+        return self
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.thread.join()
+            self.server = None
+            self.thread = None
+
+    def escape(self, value):
+        return String(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+    def format_labels(self, labels):
+        if not labels:
+            return ""
+        return "{" + ",".join(
+            '{}="{}"'.format(k, self.escape(v)) for k, v in sorted(labels.items())
+        ) + "}"
+
+    def format_family(self, name, kind, help, samples):
+        """
+        :param samples: list, (suffix, labels, value) tuples
+        :returns: list, the lines of the metric family
+        """
+        lines = [
+            "# HELP {} {}".format(name, help),
+            "# TYPE {} {}".format(name, kind),
+        ]
+        for suffix, labels, value in samples:
+            lines.append("{}{}{} {}".format(
+                name,
+                suffix,
+                self.format_labels(labels),
+                repr(float(value)) if isinstance(value, float) else value,
+            ))
+        return lines
+
+    def get_families(self):
+        """return all the metric families as tuples of (name, kind, help, samples)"""
+        calls = []
+        errors = []
+        active = []
+        latency = []
+        maximums = []
+        # list() copies the dicts atomically so decorating while rendering is safe
+        for name, histogram in sorted(list(instrument.histograms.items())):
+            s = histogram.snapshot()
+            labels = {"function": name}
+            calls.append(("", labels, s.count))
+            errors.append(("", labels, s.errors))
+            active.append(("", labels, s.active))
+            for q in self.quantiles:
+                latency.append(("", dict(labels, quantile=String(q)), s.percentile(q * 100)))
+            latency.append(("_sum", labels, s.total))
+            latency.append(("_count", labels, s.count))
+            maximums.append(("", labels, s.max))
+
+        families = []
+        if calls:
+            families.extend([
+                ("decorators_calls_total", "counter", "Calls of timed functions", calls),
+                ("decorators_errors_total", "counter", "Calls of timed functions that raised", errors),
+                ("decorators_in_flight", "gauge", "Calls of timed functions in progress", active),
+                ("decorators_latency_seconds", "summary", "Latency of timed functions", latency),
+                ("decorators_latency_max_seconds", "gauge", "Slowest call of timed functions", maximums),
+            ])
+
+        grouped = {}
+        for (name, _), counter in sorted(list(instrument.counters.items())):
+            if name not in grouped:
+                grouped[name] = (name, "counter", counter.help, [])
+                families.append(grouped[name])
+            grouped[name][3].append(("", counter.labels, counter.value))
+
+        return families
+
+    def render(self):
+        """return all the metrics in the Prometheus text exposition format"""
+        lines = []
+        for family in self.get_families():
+            lines.extend(self.format_family(*family))
+        return "\n".join(lines) + "\n"
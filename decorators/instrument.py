@@ -0,0 +1,648 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, division, print_function, absolute_import
+import threading
+import itertools
+import time
+import weakref
+
+from .compat import *
+from .base import FuncDecorator
+
+
+histograms = {}
+"""every Histogram created by a decorator, keyed by name"""
+
+counters = {}
+"""every Counter created by a decorator, keyed by (name, labels)"""
+
+
+def get_counter(name, help="", **labels):
+    """return the counter with name and labels, creating it if needed
+
+    :param name: str, the metric name (eg, "decorators_cache_hits_total")
+    :param help: str, a description of the metric
+    :param **labels: the labels that identify this counter (eg, function="foo")
+    :returns: Counter
+    """
+    key = (name, tuple(sorted(labels.items())))
+    counter = counters.get(key)
+    if counter is None:
+        counter = counters.setdefault(key, Counter(name, help, labels))
+    return counter
+
+
+def get_function_name(func):
+    """return the full name (eg, module.Class.method) of func"""
+    return "{}.{}".format(func.__module__, func.__qualname__)
+
+
+def is_done(thread):
+    """return True if the thread weakref points to a thread that has finished"""
+    thread = thread()
+    return thread is None or not thread.is_alive()
+
+
+def get_cache_counters(func, decorator):
+    """return the counters a caching decorator uses to track its effectiveness
+
+    :param func: callable, the function whose return value is cached
+    :param decorator: str, the name of the caching decorator (eg, "once")
+    :returns: tuple, (hits, misses, evictions) counters
+    """
+    labels = {"function": get_function_name(func), "decorator": decorator}
+    return (
+        get_counter("decorators_cache_hits_total", "Cached values found", **labels),
+        get_counter("decorators_cache_misses_total", "Cached values computed", **labels),
+        get_counter("decorators_cache_evictions_total", "Cached values removed", **labels),
+    )
+
+
+class Counter(object):
+    """A counter that doesn't need a lock, each thread increments its own cell
+    and the cells are summed when the value is read
+
+    The cells of threads that have finished are added to .base and dropped, so
+    short lived threads don't leave their cells behind
+
+    :param name: str
+    :param help: str
+    :param labels: dict
+    """
+    fold_size = 64
+    """finished threads' cells are folded when a new cell is added and there
+    are more than this many (or twice as many as the last fold kept)"""
+
+    def __init__(self, name, help="", labels=None):
+        self.name = name
+        self.help = help
+        self.labels = labels or {}
+        self.local = threading.local()
+        self.cells = []
+        self.base = 0
+        self.fold_at = self.fold_size
+        self.lock = threading.Lock()
+
+    def get_cell(self):
+        cell = [0, weakref.ref(threading.current_thread())]
+        self.local.cell = cell
+        with self.lock:
+            self.cells.append(cell)
+            if len(self.cells) > self.fold_at:
+                self.fold()
+        return cell
+
+    def fold(self):
+        """add the cells of finished threads to .base, the lock must be held"""
+        cells = []
+        for cell in self.cells:
+            if is_done(cell[1]):
+                self.base += cell[0]
+
+            else:
+                cells.append(cell)
+
+        self.cells = cells
+        self.fold_at = max(self.fold_size, len(cells) * 2)
+
+    def inc(self, amount=1):
+        try:
+            cell = self.local.cell
+        except AttributeError:
+            cell = self.get_cell()
+        cell[0] += amount
+
+    @property
+    def value(self):
+        with self.lock:
+            self.fold()
+            base = self.base
+            cells = list(self.cells)
+        return base + sum(cell[0] for cell in cells)
+
+
+class Stripe(object):
+    """Holds one thread's recorded values so threads never contend with each
+    other when recording"""
+    __slots__ = (
+        "thread",
+        "counts",
+        "count",
+        "samples",
+        "errors",
+        "active",
+        "total",
+        "max",
+        "window_seconds",
+        "window_counts",
+        "window_errors",
+        "window_totals",
+    )
+
+    def __init__(self, size, window, thread=None):
+        self.thread = thread
+        self.counts = [0] * size
+        self.count = 0
+        self.samples = 0
+        self.errors = 0
+        self.active = 0
+        self.total = 0
+        self.max = 0
+        self.window_seconds = [-1] * window
+        self.window_counts = [0] * window
+        self.window_errors = [0] * window
+        self.window_totals = [0] * window
+
+    def merge(self, stripe):
+        """add the values recorded in stripe to this stripe"""
+        for index, c in enumerate(stripe.counts):
+            if c:
+                self.counts[index] += c
+        self.count += stripe.count
+        self.samples += stripe.samples
+        self.errors += stripe.errors
+        self.active += stripe.active
+        self.total += stripe.total
+        self.max = max(self.max, stripe.max)
+
+        for slot, second in enumerate(stripe.window_seconds):
+            if second > self.window_seconds[slot]:
+                self.window_seconds[slot] = second
+                self.window_counts[slot] = stripe.window_counts[slot]
+                self.window_errors[slot] = stripe.window_errors[slot]
+                self.window_totals[slot] = stripe.window_totals[slot]
+
+            elif second >= 0 and second == self.window_seconds[slot]:
+                self.window_counts[slot] += stripe.window_counts[slot]
+                self.window_errors[slot] += stripe.window_errors[slot]
+                self.window_totals[slot] += stripe.window_totals[slot]
+
+
+class Snapshot(object):
+    """A point in time copy of a Histogram, all times are in seconds
+
+    count and errors are scaled up when only some calls were sampled, samples
+    is how many values were actually recorded, active is how many calls are
+    currently in flight
+    """
+    def __init__(self, histogram, counts, count, samples, errors, active, total, max_value, windows):
+        self.histogram = histogram
+        self.counts = counts
+        self.count = count
+        self.samples = samples
+        self.errors = errors
+        self.active = active
+        self.total = total / 1e9
+        self.max = max_value / 1e9
+        self.windows = windows
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    @property
+    def p50(self):
+        return self.percentile(50)
+
+    @property
+    def p90(self):
+        return self.percentile(90)
+
+    @property
+    def p99(self):
+        return self.percentile(99)
+
+    def percentile(self, percent):
+        """return the value that percent of the recorded values are less than or
+        equal to, this is accurate to the precision of the histogram's buckets
+
+        :param percent: float, between 0 and 100
+        :returns: float, seconds
+        """
+        if not self.count:
+            return 0.0
+
+        target = max(1, self.count * percent / 100.0)
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                value = self.histogram.get_value(index + 1) - 1
+                return min(value / 1e9, self.max)
+
+        return self.max
+
+    def __repr__(self):
+        return "<{} count={} errors={} p50={:.6f} p90={:.6f} p99={:.6f} max={:.6f}>".format(
+            self.__class__.__name__,
+            self.count,
+            self.errors,
+            self.p50,
+            self.p90,
+            self.p99,
+            self.max,
+        )
+
+
+class Histogram(object):
+    """A fixed memory histogram of nanosecond values with log sized buckets (like
+    HdrHistogram)
+
+    Each power of 2 is split into 2**sub_bits linear buckets, so any recorded
+    value is accurate to about 1 / 2**sub_bits (~6%). Each thread records into
+    its own stripe so recording doesn't need a lock, stripes are merged when a
+    snapshot is taken. The stripes of threads that have finished are merged
+    into .base and dropped, so short lived threads don't leave their stripes
+    behind
+
+    :param name: str
+    :param window: int, how many seconds of per second counts to keep
+    """
+    sub_bits = 4
+
+    max_value = 2 ** 42
+    """about 73 minutes in nanoseconds, larger values go in the last bucket"""
+
+    fold_size = 64
+    """finished threads' stripes are folded when a new stripe is added and
+    there are more than this many (or twice as many as the last fold kept)"""
+
+    def __init__(self, name="", window=60):
+        self.name = name
+        self.window = window
+        self.size = self.get_index(self.max_value) + 1
+        self.local = threading.local()
+        self.stripes = []
+        self.base = Stripe(self.size, self.window)
+        self.fold_at = self.fold_size
+        self.lock = threading.Lock()
+
+    def get_index(self, value):
+        """return the bucket index for value"""
+        shift = value.bit_length() - self.sub_bits - 1
+        if shift <= 0:
+            return value
+        return (shift << self.sub_bits) + (value >> shift)
+
+    def get_value(self, index):
+        """return the lowest value that would be put in the bucket at index"""
+        shift = (index >> self.sub_bits) - 1
+        if shift <= 0:
+            return index
+        return (index - (shift << self.sub_bits)) << shift
+
+    def get_stripe(self):
+        stripe = Stripe(self.size, self.window, weakref.ref(threading.current_thread()))
+        self.local.stripe = stripe
+        with self.lock:
+            self.stripes.append(stripe)
+            if len(self.stripes) > self.fold_at:
+                self.fold()
+        return stripe
+
+    def fold(self):
+        """merge the stripes of finished threads into .base, the lock must be
+        held
+
+        .base is replaced instead of changed so a snapshot that is reading the
+        old one isn't affected
+        """
+        stripes = []
+        done = []
+        for stripe in self.stripes:
+            if is_done(stripe.thread):
+                done.append(stripe)
+
+            else:
+                stripes.append(stripe)
+
+        if done:
+            base = Stripe(self.size, self.window)
+            base.merge(self.base)
+            for stripe in done:
+                base.merge(stripe)
+            self.base = base
+            self.stripes = stripes
+
+        self.fold_at = max(self.fold_size, len(stripes) * 2)
+
+    def enter(self, weight=1):
+        """mark a call as in flight, the returned stripe should be passed to
+        record() when the call is done
+
+        :param weight: int, see record()
+        :returns: Stripe
+        """
+        try:
+            stripe = self.local.stripe
+        except AttributeError:
+            stripe = self.get_stripe()
+
+        stripe.active += weight
+        return stripe
+
+    def record(self, value, error=False, weight=1, stripe=None):
+        """record value for the current thread
+
+        :param value: int, nanoseconds
+        :param error: bool, True if the recorded call raised an error
+        :param weight: int, how many calls this value represents, this is used
+            when only some calls are sampled so the counts are scaled up
+        :param stripe: Stripe, the value returned from enter() if the call was
+            marked as in flight
+        """
+        if stripe is None:
+            try:
+                stripe = self.local.stripe
+            except AttributeError:
+                stripe = self.get_stripe()
+
+        else:
+            stripe.active -= weight
+
+        index = self.get_index(value) if value < self.max_value else self.size - 1
+        stripe.counts[index] += weight
+        stripe.count += weight
+        stripe.samples += 1
+        stripe.total += value * weight
+        if value > stripe.max:
+            stripe.max = value
+
+        second = int(time.time())
+        slot = second % self.window
+        if stripe.window_seconds[slot] != second:
+            stripe.window_seconds[slot] = second
+            stripe.window_counts[slot] = 0
+            stripe.window_errors[slot] = 0
+            stripe.window_totals[slot] = 0
+        stripe.window_counts[slot] += weight
+        stripe.window_totals[slot] += value * weight
+
+        if error:
+            stripe.errors += weight
+            stripe.window_errors[slot] += weight
+
+    def snapshot(self):
+        """merge all the stripes
+
+        :returns: Snapshot
+        """
+        counts = [0] * self.size
+        count = samples = errors = active = total = max_value = 0
+        windows = {}
+        oldest = int(time.time()) - self.window
+
+        with self.lock:
+            self.fold()
+            stripes = [self.base] + self.stripes
+
+        for stripe in stripes:
+            for index, c in enumerate(stripe.counts):
+                if c:
+                    counts[index] += c
+            count += stripe.count
+            samples += stripe.samples
+            errors += stripe.errors
+            active += stripe.active
+            total += stripe.total
+            max_value = max(max_value, stripe.max)
+
+            for slot, second in enumerate(stripe.window_seconds):
+                if second > oldest:
+                    w = windows.setdefault(second, [0, 0, 0])
+                    w[0] += stripe.window_counts[slot]
+                    w[1] += stripe.window_errors[slot]
+                    w[2] += stripe.window_totals[slot]
+
+        return Snapshot(
+            self,
+            counts,
+            count,
+            samples,
+            errors,
+            active,
+            total,
+            max_value,
+            [
+                {
+                    "second": second,
+                    "count": w[0],
+                    "errors": w[1],
+                    "mean": w[2] / w[0] / 1e9 if w[0] else 0.0,
+                } for second, w in sorted(windows.items())
+            ],
+        )
+
+
+class Sampler(object):
+    """Decides which calls are sampled
+
+    Every call increments a counter and every Nth call is sampled, each sample
+    should be recorded with a weight of N so the statistics are scaled up. If
+    max_rate is set then N is adjusted about once a second (the clock is checked
+    every check_every calls, sampled or not, so N drops soon after the call rate
+    does) so no more than max_rate calls a second are sampled, N grows at most
+    max_growth times each adjustment so a short burst can't make sampling too
+    sparse for the calls after it
+
+    :param sample_rate: float, between 0 and 1, the fraction of calls to sample
+    :param max_rate: int, if set this is the most samples per second
+    """
+    interval = 1.0
+    """how many seconds between adjustments"""
+
+    max_growth = 10
+    """the most N can be multiplied by in one adjustment"""
+
+    check_every = 1024
+    """how many calls between checks of the clock, this is a power of 2 so the
+    check is a bitwise and"""
+
+    def __init__(self, sample_rate=1.0, max_rate=None):
+        if sample_rate <= 0 or sample_rate > 1:
+            raise ValueError("sample_rate must be greater than 0 and at most 1")
+
+        self.every = max(1, int(round(1.0 / sample_rate)))
+        self.max_rate = max_rate
+        self.counter = itertools.count(1)
+        self.start = time.monotonic()
+        self.start_n = 0
+        self.deadline = self.start + self.interval
+        """adjust() should be called by the first check after this time"""
+
+    def adjust(self, n, now=None):
+        """adjust how often calls are sampled using how many calls have been made
+        since the last adjustment, this is called by the first call (sampled or
+        not) that checks the clock after deadline
+
+        :param n: int, the counter value of the call
+        :param now: float, time.monotonic()
+        """
+        now = time.monotonic() if now is None else now
+        elapsed = now - self.start
+        if elapsed >= self.interval:
+            rate = (n - self.start_n) / elapsed
+            every = max(1, int(rate / self.max_rate))
+            self.every = min(every, self.every * self.max_growth)
+            self.start = now
+            self.start_n = n
+            self.deadline = now + self.interval
+
+
+class timed(FuncDecorator):
+    """Record the latency of every call of the decorated function in a Histogram
+
+    :Example:
+        @timed
+        def foo():
+            pass
+
+        foo()
+        s = foo.histogram.snapshot()
+        print(s.count, s.p50, s.p99, s.max)
+
+    To keep the overhead fixed for functions that are called a lot, only some
+    of the calls can be timed
+
+        @timed(sample_rate=0.01) # time 1 out of every 100 calls
+        def foo(): pass
+
+        @timed(max_rate=1000) # time at most about 1000 calls a second
+        def bar(): pass
+
+    :param name: str, the histogram's name in the module's histograms dict,
+        defaults to the function's full name
+    :param sample_rate: float, the fraction of calls that will be timed
+    :param max_rate: int, adaptively sample so at most this many calls a second
+        will be timed
+    """
+    callback_args = False
+
+    def get_histogram(self, func, name=""):
+        if not name:
+            name = get_function_name(func)
+
+        histogram = histograms.get(name)
+        if histogram is None:
+            histogram = histograms.setdefault(name, Histogram(name))
+        return histogram
+
+    def get_sampler(self, sample_rate=1.0, max_rate=None):
+        """returns a Sampler or None if every call should be timed"""
+        if sample_rate < 1.0 or max_rate:
+            return Sampler(sample_rate, max_rate)
+
+    def decorate(self, func, name="", sample_rate=1.0, max_rate=None):
+        histogram = self.get_histogram(func, name)
+        sampler = self.get_sampler(sample_rate, max_rate)
+        enter = histogram.enter
+        record = histogram.record
+        clock = time.perf_counter_ns
+
+        if sampler:
+            counter = sampler.counter
+            # n & -1 is never 0 so a fixed sample rate never checks the clock
+            mask = sampler.check_every - 1 if max_rate else -1
+            monotonic = time.monotonic
+
+            def wrapped(*args, **kwargs):
+                n = next(counter)
+                every = sampler.every
+                if n % every and n & mask:
+                    return func(*args, **kwargs)
+
+                if not n & mask:
+                    now = monotonic()
+                    if now >= sampler.deadline:
+                        sampler.adjust(n, now)
+                        every = sampler.every
+
+                    if n % every:
+                        return func(*args, **kwargs)
+
+                stripe = enter(every)
+                start = clock()
+                try:
+                    ret = func(*args, **kwargs)
+
+                except BaseException:
+                    record(clock() - start, True, every, stripe)
+                    raise
+
+                record(clock() - start, False, every, stripe)
+                return ret
+
+        else:
+            def wrapped(*args, **kwargs):
+                stripe = enter()
+                start = clock()
+                try:
+                    ret = func(*args, **kwargs)
+
+                except BaseException:
+                    record(clock() - start, True, 1, stripe)
+                    raise
+
+                record(clock() - start, False, 1, stripe)
+                return ret
+
+        wrapped.histogram = histogram
+        wrapped.sampler = sampler
+        return wrapped
+
+    def decorate_async(self, func, name="", sample_rate=1.0, max_rate=None):
+        histogram = self.get_histogram(func, name)
+        sampler = self.get_sampler(sample_rate, max_rate)
+        enter = histogram.enter
+        record = histogram.record
+        clock = time.perf_counter_ns
+
+        if sampler:
+            counter = sampler.counter
+            # n & -1 is never 0 so a fixed sample rate never checks the clock
+            mask = sampler.check_every - 1 if max_rate else -1
+            monotonic = time.monotonic
+
+            async def wrapped(*args, **kwargs):
+                n = next(counter)
+                every = sampler.every
+                if n % every and n & mask:
+                    return await func(*args, **kwargs)
+
+                if not n & mask:
+                    now = monotonic()
+                    if now >= sampler.deadline:
+                        sampler.adjust(n, now)
+                        every = sampler.every
+
+                    if n % every:
+                        return await func(*args, **kwargs)
+
+                stripe = enter(every)
+                start = clock()
+                try:
+                    ret = await func(*args, **kwargs)
+
+                except BaseException:
+                    record(clock() - start, True, every, stripe)
+                    raise
+
+                record(clock() - start, False, every, stripe)
+                return ret
+
+        else:
+            async def wrapped(*args, **kwargs):
+                stripe = enter()
+                start = clock()
+                try:
+                    ret = await func(*args, **kwargs)
+
+                except BaseException:
+                    record(clock() - start, True, 1, stripe)
+                    raise
+
+                record(clock() - start, False, 1, stripe)
+                return ret
+
+        wrapped.histogram = histogram
+        wrapped.sampler = sampler
+        return wrapped
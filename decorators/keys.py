@@ -0,0 +1,367 @@
+# -*- coding: utf-8 -*-
+"""Cache keys that are the same in every process and after restarts
+
+hash() of a str is randomized in every process (see PYTHONHASHSEED) so keys
+built with it can't be shared. The keys here are a blake2b digest of a canonical
+encoding of the arguments instead: every value is written with its type and
+length, dicts and sets are written in a fixed order, and other types can
+register a canonicalizer that turns them into values that can be encoded
+
+get_hash() and IdentityKey are the keys once uses for arguments that aren't
+hashable, print what each kind of key costs with:
+
+    python -m decorators.keys [-n NUMBER]
+
+:Example:
+    get_key(func, (1, "two"), {"three": [3]}) # "module.func:<32 hex digits>"
+
+    @canonicalizer(User)
+    def canonicalize_user(user):
+        return user.pk
+"""
+from __future__ import unicode_literals, division, print_function, absolute_import
+import argparse
+import dataclasses
+import datetime
+import decimal
+import enum
+import inspect
+import pathlib
+import struct
+import sys
+import uuid
+
+from .compat import *
+from .instrument import get_function_name
+from .cache import AttributeCache
+
+
+class UnstableKeyError(TypeError):
+    """Raised in strict mode when an argument can't be encoded the same way in
+    every process"""
+    pass
+
+
+canonicalizers = {}
+"""type -> callable, see register()"""
+
+
+def register(klass, callback):
+    """canonicalize instances of klass (and its subclasses) with callback
+
+    :param klass: type
+    :param callback: callable, callback(obj) returns a value that can be
+        encoded (eg, a str or a tuple of ints) and identifies obj
+    """
+    canonicalizers[klass] = callback
+
+
+def canonicalizer(*klasses):
+    """decorator version of register()
+
+    :Example:
+        @canonicalizer(User, Admin)
+        def canonicalize_user(user):
+            return user.pk
+    """
+    def decorator(callback):
+        for klass in klasses:
+            register(klass, callback)
+        return callback
+    return decorator
+
+
+register(datetime.datetime, lambda o: o.isoformat())
+register(datetime.date, lambda o: o.isoformat())
+register(datetime.time, lambda o: o.isoformat())
+register(datetime.timedelta, lambda o: (o.days, o.seconds, o.microseconds))
+register(decimal.Decimal, lambda o: str(o))
+register(uuid.UUID, lambda o: o.bytes)
+register(enum.Enum, lambda o: o.name)
+register(pathlib.PurePath, lambda o: str(o))
+
+
+class KeyHasher(object):
+    """Writes the canonical encoding of values into a blake2b hash
+
+    :param strict: bool, True to raise UnstableKeyError for values that don't
+        have a stable encoding, otherwise they are encoded with hash() which
+        is only the same in this process
+    """
+    size = struct.Struct("!Q")
+
+    def __init__(self, strict=False):
+        self.strict = strict
+        self.digest = hashlib.blake2b(digest_size=16)
+
+    def write(self, tag, data=b"", size=None):
+        self.digest.update(tag + self.size.pack(len(data) if size is None else size))
+        self.digest.update(data)
+
+    def update_buffer(self, view):
+        """write the contents of memoryview view, C-contiguous buffers (eg,
+        bytes, array.array, most numpy arrays) are hashed in place without
+        being copied"""
+        if view.ndim != 1 or view.format not in ("B", "b", "c"):
+            # the layout is part of the key so the same bytes in a different
+            # shape or type aren't the same key
+            self.write(b"m", "{}:{}".format(view.format, view.shape).encode("ascii"))
+
+        data = view if view.c_contiguous else view.tobytes()
+        self.write(b"b", data, view.nbytes)
+
+    def get_canonicalizer(self, klass):
+        for parent in klass.__mro__:
+            callback = canonicalizers.get(parent)
+            if callback is not None:
+                return callback
+
+    def get_sorted(self, values):
+        """returns list, the digest of each value sorted so the order values are
+        in doesn't change the key"""
+        digests = []
+        for value in values:
+            hasher = type(self)(self.strict)
+            hasher.update(value)
+            digests.append(hasher.digest.digest())
+        return sorted(digests)
+
+    def update(self, obj):
+        """write the encoding of obj"""
+        klass = type(obj)
+
+        if obj is None:
+            self.write(b"N")
+
+        elif klass is bool:
+            self.write(b"T" if obj else b"F")
+
+        elif klass is int:
+            self.write(b"i", str(obj).encode("ascii"))
+
+        elif klass is float:
+            self.write(b"f", obj.hex().encode("ascii"))
+
+        elif klass is str:
+            self.write(b"s", obj.encode("utf-8", "surrogatepass"))
+
+        elif klass is bytes:
+            self.write(b"b", obj)
+
+        elif klass is tuple or klass is list:
+            self.write(b"t" if klass is tuple else b"l", self.size.pack(len(obj)))
+            for value in obj:
+                self.update(value)
+
+        elif klass is dict:
+            self.write(b"d", self.size.pack(len(obj)))
+            items = {}
+            for k, v in obj.items():
+                hasher = type(self)(self.strict)
+                hasher.update(k)
+                items[hasher.digest.digest()] = v
+
+            for digest in sorted(items):
+                self.digest.update(digest)
+                self.update(items[digest])
+
+        elif klass is set or klass is frozenset:
+            self.write(b"e", self.size.pack(len(obj)))
+            for digest in self.get_sorted(obj):
+                self.digest.update(digest)
+
+        else:
+            self.update_object(obj)
+
+    def update_object(self, obj):
+        klass = type(obj)
+        callback = self.get_canonicalizer(klass)
+        if callback is not None:
+            self.write(b"c", get_function_name(klass).encode("utf-8"))
+            self.update(callback(obj))
+
+        elif isinstance(obj, (bytearray, memoryview)):
+            self.update_buffer(memoryview(obj))
+
+        elif inspect.isfunction(obj) or inspect.isclass(obj) or inspect.ismodule(obj):
+            name = obj.__name__ if inspect.ismodule(obj) else get_function_name(obj)
+            if "<lambda>" in name or "<locals>" in name:
+                # every lambda in a module (or closure from the same function)
+                # has the same name so the name doesn't identify it
+                self.update_unknown(obj)
+
+            else:
+                self.write(b"n", name.encode("utf-8"))
+
+        elif dataclasses.is_dataclass(obj):
+            self.write(b"c", get_function_name(klass).encode("utf-8"))
+            self.update({f.name: getattr(obj, f.name) for f in dataclasses.fields(obj)})
+
+        elif isinstance(obj, (str, bytes, int, float, tuple, list, dict, set, frozenset)):
+            # a subclass of a builtin is encoded as its builtin
+            for builtin in (bool, str, bytes, int, float, tuple, list, dict, frozenset, set):
+                if isinstance(obj, builtin):
+                    self.write(b"c", get_function_name(klass).encode("utf-8"))
+                    self.update(builtin(obj))
+                    break
+
+        else:
+            try:
+                view = memoryview(obj)
+
+            except TypeError:
+                self.update_unknown(obj)
+
+            else:
+                self.update_buffer(view)
+
+    def update_unknown(self, obj):
+        if self.strict:
+            raise UnstableKeyError(
+                "{} has no stable key, register a canonicalizer for it".format(
+                    get_function_name(type(obj))
+                )
+            )
+
+        try:
+            self.write(b"h", str(hash(obj)).encode("ascii"))
+
+        except TypeError:
+            if not hasattr(obj, "__dict__"):
+                raise
+
+            # an unhashable object is keyed by its attributes
+            self.write(b"c", get_function_name(type(obj)).encode("utf-8"))
+            self.update(vars(obj))
+
+    def hexdigest(self):
+        return self.digest.hexdigest()
+
+
+def get_key(func, args, kwargs, strict=False):
+    """returns str, a key for calling func with args and kwargs that is the same
+    in every process
+
+    :param func: callable
+    :param args: tuple
+    :param kwargs: dict
+    :param strict: bool, see KeyHasher
+    """
+    hasher = KeyHasher(strict)
+    hasher.update(args)
+    hasher.update(kwargs)
+    return "{}:{}".format(get_function_name(func), hasher.hexdigest())
+
+
+def get_hash(obj):
+    """returns str, hash(obj) or, if obj isn't hashable (eg, a list or a dict),
+    a digest of its contents so it can still be part of a key
+
+    buffers (eg, bytearray or numpy arrays) are hashed by their contents
+    without being copied, see KeyHasher.update_buffer
+    """
+    try:
+        return str(hash(obj))
+
+    except TypeError:
+        hasher = KeyHasher()
+        hasher.update(obj)
+        return hasher.hexdigest()
+
+
+class IdentityKey(object):
+    """Builds keys from the identity of the arguments instead of their values,
+    this is the cheapest key for big arguments but a call only hits the cache
+    when it is passed the same objects, so they shouldn't be changed
+
+    None, bools, numbers, str, and bytes are still keyed by their hash. Every
+    other argument is kept in cache next to the values so its id() can't be
+    reused by another object while a key with it is cached, and it is released
+    when the cache's values are (eg, at the end of a once_scope())
+
+    :param cache: Cache, where the arguments are kept, this should be the
+        cache the values are kept in, defaults to an attribute of this object
+    """
+    scalars = (type(None), bool, int, float, str, bytes)
+
+    def __init__(self, cache=None):
+        self.cache = AttributeCache(self) if cache is None else cache
+
+    def get_part(self, obj):
+        if type(obj) in self.scalars:
+            return str(hash(obj))
+
+        part = "@{}".format(id(obj))
+        try:
+            self.cache.get(part)
+
+        except KeyError:
+            self.cache.set(part, obj)
+
+        return part
+
+    def __call__(self, func, args, kwargs):
+        parts = [str(id(func))]
+        for a in args:
+            parts.append(self.get_part(a))
+
+        for k in sorted(kwargs):
+            parts.append("{}={}".format(k, self.get_part(kwargs[k])))
+
+        return ":".join(parts)
+
+
+def benchmark(number=1000):
+    """time how long each kind of key takes to build for a few payloads
+
+    :param number: int, how many keys of each kind are built
+    :returns: list, (payload, mode, microseconds per key) tuples
+    """
+    import array
+    import timeit
+
+    def func(*args, **kwargs):
+        pass
+
+    payloads = [
+        ("scalars", (1, "two", 3.0)),
+        ("list 1k ints", (list(range(1000)),)),
+        ("json dict", ({"users": [{"id": i, "name": "user{}".format(i), "tags": ["a", "b"]} for i in range(100)]},)),
+        ("bytes 1MB", (bytes(1024 * 1024),)),
+        ("bytearray 1MB", (bytearray(1024 * 1024),)),
+        ("array 128k doubles", (array.array("d", range(128 * 1024)),)),
+    ]
+
+    from .misc import once
+    modes = [
+        ("hash", once().get_name),
+        ("stable", get_key),
+        ("identity", IdentityKey()),
+    ]
+
+    rows = []
+    for name, args in payloads:
+        for mode, get in modes:
+            seconds = timeit.timeit(lambda: get(func, args, {}), number=number)
+            rows.append((name, mode, seconds / number * 1e6))
+
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m decorators.keys",
+        description="Print how long each once key mode takes to build keys",
+    )
+    parser.add_argument("-n", "--number", type=int, default=1000, help="how many keys of each kind to build")
+    options = parser.parse_args(argv)
+
+    print("{:<20} {:<10} {:>14}".format("payload", "key", "us/key"))
+    for name, mode, micros in benchmark(options.number):
+        print("{:<20} {:<10} {:>14.2f}".format(name, mode, micros))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,446 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, division, print_function, absolute_import
+import collections
+import contextlib
+import mmap
+import os
+import re
+import struct
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from .compat import *
+from .base import FuncDecorator
+from .instrument import Histogram, get_counter, get_function_name
+
+
+class Overloaded(RuntimeError):
+    """Raised when a call is shed instead of ran
+
+    :param reason: str, why the call was shed (eg, "queue_full" or "timeout")
+    """
+    def __init__(self, message, reason=""):
+        super(Overloaded, self).__init__(message)
+        self.reason = reason
+
+
+class Limiter(object):
+    """Admits up to concurrency calls at once and queues up to queue more,
+    calls past that are shed right away with Overloaded
+
+    :param name: str, used in errors and as the function label of the counters
+    :param concurrency: int, how many calls can run at the same time
+    :param queue: int, how many calls can wait for their turn
+    :param timeout: float, the most seconds a call will wait in the queue, None
+        to wait until there is room
+    """
+    def __init__(self, name, concurrency=16, queue=64, timeout=None):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue = queue
+        self.timeout = timeout
+        self.active = 0
+        self.waiting = 0
+        self.wait = Histogram(name)
+        """how long admitted calls waited in the queue"""
+
+        self.admitted = get_counter(
+            "decorators_limit_admitted_total",
+            "Calls admitted by a concurrency limit",
+            function=name,
+        )
+        self.wait_seconds = get_counter(
+            "decorators_limit_queue_wait_seconds_total",
+            "Seconds admitted calls waited for a concurrency limit",
+            function=name,
+        )
+
+    def get_rejected(self, reason):
+        return get_counter(
+            "decorators_limit_rejected_total",
+            "Calls shed by a concurrency limit",
+            function=self.name,
+            reason=reason,
+        )
+
+    def reject(self, reason):
+        self.get_rejected(reason).inc()
+        if reason == "queue_full":
+            message = "{} is running {} calls with {} queued".format(
+                self.name,
+                self.active,
+                self.waiting,
+            )
+
+        else:
+            message = "{} waited more than {} seconds to run".format(self.name, self.timeout)
+
+        return Overloaded(message, reason)
+
+    def admit(self, waited):
+        self.admitted.inc()
+        if waited:
+            self.wait.record(int(waited * 1e9))
+            self.wait_seconds.inc(waited)
+
+
+class ThreadLimiter(Limiter):
+    """Limiter for threaded callers"""
+    def __init__(self, *args, **kwargs):
+        super(ThreadLimiter, self).__init__(*args, **kwargs)
+        self.condition = threading.Condition(threading.Lock())
+
+    def acquire(self):
+        waited = 0
+        with self.condition:
+            if self.active >= self.concurrency:
+                if self.waiting >= self.queue:
+                    raise self.reject("queue_full")
+
+                start = time.monotonic()
+                self.waiting += 1
+                try:
+                    admitted = self.condition.wait_for(
+                        lambda: self.active < self.concurrency,
+                        self.timeout,
+                    )
+
+                finally:
+                    self.waiting -= 1
+
+                if not admitted:
+                    raise self.reject("timeout")
+                waited = time.monotonic() - start
+
+            self.active += 1
+
+        self.admit(waited)
+
+    def release(self):
+        with self.condition:
+            self.active -= 1
+            self.condition.notify()
+
+
+class AsyncLimiter(Limiter):
+    """Limiter for callers in an event loop, this isn't thread safe so all the
+    callers need to be in the same thread"""
+    def __init__(self, *args, **kwargs):
+        super(AsyncLimiter, self).__init__(*args, **kwargs)
+        self.waiters = collections.deque()
+
+    async def acquire(self):
+        if self.active < self.concurrency and not self.waiters:
+            self.active += 1
+            self.admit(0)
+            return
+
+        if len(self.waiters) >= self.queue:
+            raise self.reject("queue_full")
+
+        start = time.monotonic()
+        future = get_running_loop().create_future()
+        self.waiters.append(future)
+        self.waiting += 1
+        try:
+            # release() hands its slot straight to the future so active doesn't
+            # change when a waiter is admitted
+            await asyncio.wait_for(future, self.timeout)
+
+        except asyncio.TimeoutError:
+            if not future.done() or future.cancelled():
+                raise self.reject("timeout")
+
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # we were handed a slot but won't use it
+                self.release()
+            raise
+
+        finally:
+            self.waiting -= 1
+            try:
+                self.waiters.remove(future)
+
+            except ValueError:
+                pass
+
+        self.admit(time.monotonic() - start)
+
+    def release(self):
+        while self.waiters:
+            future = self.waiters.popleft()
+            if not future.done():
+                future.set_result(None)
+                return
+
+        self.active -= 1
+
+
+class limit(FuncDecorator):
+    """Limit how many calls of the decorated function run at the same time and
+    shed the calls that don't fit in the queue with Overloaded
+
+    Admitted and shed calls are counted and how long admitted calls waited is
+    recorded, see the decorators_limit_* counters and wrapped.limiter.wait
+
+    :Example:
+        @limit(concurrency=16, queue=64, timeout=1.0)
+        def expensive():
+            ...
+
+        try:
+            expensive()
+
+        except Overloaded:
+            # return a 503 or similar
+            pass
+
+    :param concurrency: int, how many calls can run at the same time
+    :param queue: int, how many calls can wait to run, 0 to shed every call
+        that can't run right away
+    :param timeout: float, the most seconds a call will wait in the queue
+        before it is shed, None to wait until there is room
+    """
+    callback_args = False
+
+    def decorate(self, func, concurrency=16, queue=64, timeout=None):
+        limiter = ThreadLimiter(get_function_name(func), concurrency, queue, timeout)
+        acquire = limiter.acquire
+        release = limiter.release
+
+        def wrapped(*args, **kwargs):
+            acquire()
+            try:
+                return func(*args, **kwargs)
+
+            finally:
+                release()
+
+        wrapped.limiter = limiter
+        return wrapped
+
+    def decorate_async(self, func, concurrency=16, queue=64, timeout=None):
+        limiter = AsyncLimiter(get_function_name(func), concurrency, queue, timeout)
+        acquire = limiter.acquire
+        release = limiter.release
+
+        async def wrapped(*args, **kwargs):
+            await acquire()
+            try:
+                return await func(*args, **kwargs)
+
+            finally:
+                release()
+
+        wrapped.limiter = limiter
+        return wrapped
+
+
+class RateLimited(Overloaded):
+    """Raised when a call would have to wait longer than it is allowed to for
+    its rate limit"""
+    pass
+
+
+class Bucket(object):
+    """A token bucket that refills at rate tokens every per seconds and holds
+    at most burst tokens
+
+    This is the GCRA form of a token bucket, instead of counting tokens it
+    keeps the time (tat) when the bucket will be full again, so each call only
+    has to read and write one number under the bucket's own lock
+
+    :param rate: float, how many calls are allowed every per seconds
+    :param per: float, seconds
+    :param burst: int, how many calls can be made at once when the bucket is full
+    """
+    def __init__(self, rate, per=1.0, burst=1):
+        if rate <= 0 or per <= 0 or burst < 1:
+            raise ValueError("rate and per must be positive and burst at least 1")
+
+        self.interval = per / float(rate)
+        self.tolerance = self.interval * burst
+        self.tat = 0.0
+        self.lock = threading.Lock()
+
+    def load(self):
+        return self.tat
+
+    def store(self, tat):
+        self.tat = tat
+
+    def locked(self):
+        return self.lock
+
+    def reserve(self, max_wait=None):
+        """take a token, waiting for it if needed
+
+        :param max_wait: float, the most seconds the caller is willing to wait,
+            None to wait as long as it takes
+        :returns: float, how many seconds the caller has to wait before its
+            token is available, None if that is more than max_wait and no
+            token was taken
+        """
+        with self.locked():
+            now = time.monotonic()
+            tat = max(self.load(), now)
+            wait = max(0.0, tat + self.interval - self.tolerance - now)
+            if max_wait is not None and wait > max_wait:
+                return None
+
+            self.store(tat + self.interval)
+            return wait
+
+
+class SharedBucket(Bucket):
+    """A Bucket whose state is shared with every process that uses the same
+    name on this machine
+
+    The bucket's tat is kept in a small memory mapped file in /dev/shm (or the
+    temp directory) that is locked with fcntl while it is updated, this works
+    because time.monotonic() is the same clock in every process
+
+    time.monotonic() starts over when the machine boots, but a file in the temp
+    directory doesn't go away, so the wall clock time the monotonic clock
+    started at is stored with the tat and a tat from another boot is ignored
+
+    :param name: str, processes that use the same name share the bucket
+    """
+    boot_tolerance = 60.0
+    """how many seconds the stored start of the monotonic clock can be off by
+    before the tat is treated as being from another boot"""
+
+    def __init__(self, name, *args, **kwargs):
+        super(SharedBucket, self).__init__(*args, **kwargs)
+        if fcntl is None:
+            raise ValueError("Shared rate limits need fcntl")
+
+        directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+        self.path = os.path.join(directory, "decorators-rate-{}".format(
+            re.sub(r"[^\w.-]", "_", name)
+        ))
+        self.struct = struct.Struct("dd")
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self.fd).st_size < self.struct.size:
+            os.ftruncate(self.fd, self.struct.size)
+
+        self.map = mmap.mmap(self.fd, self.struct.size)
+
+    def get_boot(self):
+        """returns float, the wall clock time time.monotonic() started at"""
+        return time.time() - time.monotonic()
+
+    def load(self):
+        tat, boot = self.struct.unpack_from(self.map, 0)
+        if abs(boot - self.get_boot()) > self.boot_tolerance:
+            return 0.0
+        return tat
+
+    def store(self, tat):
+        self.struct.pack_into(self.map, 0, tat, self.get_boot())
+
+    @contextlib.contextmanager
+    def locked(self):
+        # fcntl locks belong to the process, so the thread lock keeps the
+        # threads of this process out of each other's way
+        with self.lock:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX)
+            try:
+                yield
+
+            finally:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN)
+
+
+class rate_limit(FuncDecorator):
+    """Limit how often the decorated function can be called
+
+    Sync calls sleep until they are allowed to run (or raise RateLimited if
+    block=False or they would wait longer than timeout), async calls await
+    instead of sleeping so the event loop keeps running
+
+    :Example:
+        # 100 calls a second with bursts of up to 20 calls
+        @rate_limit(rate=100, per=1.0, burst=20)
+        def call_api():
+            ...
+
+        # shared by every worker process on this machine
+        @rate_limit(rate=10, shared="api")
+        def call_other_api():
+            ...
+
+    :param rate: float, how many calls are allowed every per seconds
+    :param per: float, seconds
+    :param burst: int, how many calls can be made back to back
+    :param block: bool, False to raise RateLimited instead of waiting
+    :param timeout: float, the most seconds a call will wait before raising
+        RateLimited, None to wait as long as needed
+    :param shared: str, share the limit with the other processes that use this
+        name, see SharedBucket
+    """
+    callback_args = False
+
+    def get_bucket(self, rate, per, burst, shared):
+        if shared:
+            return SharedBucket(shared, rate, per, burst)
+        return Bucket(rate, per, burst)
+
+    def get_reserve(self, func, bucket, block, timeout):
+        name = get_function_name(func)
+        limited = get_counter(
+            "decorators_rate_limited_total",
+            "Calls rejected by a rate limit",
+            function=name,
+        )
+        waited = get_counter(
+            "decorators_rate_limit_wait_seconds_total",
+            "Seconds calls waited for a rate limit",
+            function=name,
+        )
+        max_wait = timeout if block else 0.0
+
+        def reserve():
+            wait = bucket.reserve(max_wait)
+            if wait is None:
+                limited.inc()
+                raise RateLimited("{} is over its rate limit".format(name), "rate")
+
+            if wait:
+                waited.inc(wait)
+            return wait
+
+        return reserve
+
+    def decorate(self, func, rate=100, per=1.0, burst=20, block=True, timeout=None, shared=None):
+        bucket = self.get_bucket(rate, per, burst, shared)
+        reserve = self.get_reserve(func, bucket, block, timeout)
+
+        def wrapped(*args, **kwargs):
+            wait = reserve()
+            if wait:
+                time.sleep(wait)
+            return func(*args, **kwargs)
+
+        wrapped.bucket = bucket
+        return wrapped
+
+    def decorate_async(self, func, rate=100, per=1.0, burst=20, block=True, timeout=None, shared=None):
+        bucket = self.get_bucket(rate, per, burst, shared)
+        reserve = self.get_reserve(func, bucket, block, timeout)
+
+        async def wrapped(*args, **kwargs):
+            wait = reserve()
+            if wait:
+                await asyncio.sleep(wait)
+            return await func(*args, **kwargs)
+
+        wrapped.bucket = bucket
+        return wrapped
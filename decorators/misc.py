@@ -2,9 +2,13 @@
 from __future__ import unicode_literals, division, print_function, absolute_import
 import warnings
 import inspect
+import functools
 
 from .compat import *
 from .base import FuncDecorator, Decorator
+from .instrument import get_cache_counters, get_function_name
+from .cache import Cache, AttributeCache, SharedCache, context_cache, once_scope
+from .keys import get_key, get_hash, IdentityKey
 
 
 class once(FuncDecorator):
@@ -19,30 +23,254 @@ class once(FuncDecorator):
         func(10) # prints "adding"
         func(4) # returns 5, no print
         func(10) # returns 11, no print
+
+        # only cache for the length of a request
+        @once(scope="context")
+        def can(user, permission):
+            ...
+
+        with once_scope():
+            can(user, "read") # ran
+            can(user, "read") # cached
+
+        # look up many calls at once, the misses are computed with one call
+        # to bulk (which is passed a list of argument tuples) and the results
+        # are returned in the same order as the calls
+        func.many([1, 4, 7], bulk=lambda calls: [x + 1 for (x,) in calls])
+
+        # many isn't bound to an instance, on a method call it through the class
+        # with the instance as the first argument of each call
+        Foo.method.many([(foo, 1), (foo, 4)])
+
+        # share the values with the other workers of a pre-fork server
+        @once(scope="shared")
+        def load(name):
+            ...
+
+    :param scope: str, "process" to cache for the life of the process,
+        "context" to cache inside a once_scope(), see cache.ContextCache, or
+        "shared" to cache in shared memory, see cache.SharedCache
+    :param backend: object, cache the values in this instead, it needs get
+        (that raises KeyError on a miss), set, and delete methods like the
+        caches in decorators.cache, many() uses its multi_get and multi_set
+        methods if it has them and calls get and set for each key if it
+        doesn't
+    :param key: str|callable, how the cache keys are built, "hash" uses hash()
+        of the arguments (or their contents if they aren't hashable),
+        "identity" uses the id() of arguments that aren't numbers or strings
+        and keeps them in the cache with the values (so it can't be used with
+        scope "shared" or a backend), see decorators.keys.IdentityKey, "strict" uses decorators.keys.get_key
+        so the keys are the same in every process and raises UnstableKeyError
+        for arguments that can't have a stable key, "stable" is "strict" but
+        falls back to hash() for those arguments so its keys are only good in
+        this process, or a callable that is passed (f, args, kwargs) and
+        returns the key. Defaults to "strict" when the values are kept outside
+        of this process (scope "shared" or a backend) and "hash" otherwise
     """
-    def decorate(self, f, *once_args, **once_kwargs):
-        def wrapped(*args, **kwargs):
-            name = String(hash(f))
-            if args:
-                for a in args:
-                    name += String(hash(a))
+    callback_args = False
+
+    def get_name(self, f, args, kwargs):
+        """get the cache key for calling f with args and kwargs, unhashable
+        arguments (eg, lists and dicts) are keyed by their contents"""
+        # every part is tagged with its position or name so f(1, 23) and
+        # f(12, 3) aren't the same key
+        parts = [str(hash(f))]
+        for i, a in enumerate(args):
+            parts.append("{}={}".format(i, get_hash(a)))
+
+        for k in sorted(kwargs):
+            parts.append("{}={}".format(k, get_hash(kwargs[k])))
+
+        return ":".join(parts)
+
+    def get_key_function(self, scope, backend, key, cache=None):
+        """return the callable that builds the cache keys, see the key param
+
+        :param cache: Cache, the cache the values are kept in
+        """
+        if callable(key):
+            return key
+
+        if key is None:
+            # a key that falls back to hash() could give another object's value
+            # to other processes
+            key = "strict" if (backend is not None or scope == "shared") else "hash"
+
+        if key == "hash":
+            return self.get_name
+
+        elif key == "stable":
+            return get_key
+
+        elif key == "strict":
+            return functools.partial(get_key, strict=True)
+
+        elif key == "identity":
+            if backend is not None or scope == "shared":
+                raise ValueError("Identity keys only work with values kept in this process")
+            return IdentityKey(cache)
+
+        raise ValueError("Unknown once key {}".format(key))
 
-            if kwargs:
-                for k, v in kwargs.items():
-                    name += String(hash(k))
-                    name += String(hash(v))
+    def get_cache(self, f, scope, backend):
+        """return the cache the values will be kept in"""
+        if backend is not None:
+            return backend
 
+        elif scope == "process":
+            return AttributeCache(self)
+
+        elif scope == "context":
+            return context_cache
+
+        elif scope == "shared":
+            return SharedCache(get_function_name(f))
+
+        raise ValueError("Unknown once scope {}".format(scope))
+
+    def lookup_many(self, f, cache, get_name, calls):
+        """find the cached values of calls with one cache lookup
+
+        :param calls: iterable, the positional arguments of each call, a tuple
+            of arguments or, if it isn't a tuple, the only argument
+        :returns: tuple, (keys, values, missing), the key of each call in
+            order, a dict of the cached values, and a dict of the arguments of
+            each key that isn't cached
+        """
+        keys = []
+        missing = {}
+        for args in calls:
+            if not isinstance(args, tuple):
+                args = (args,)
+
+            name = get_name(f, args, {})
+            keys.append(name)
+            missing[name] = args
+
+        multi_get = getattr(cache, "multi_get", None)
+        if multi_get is None:
+            values = Cache.multi_get(cache, list(missing))
+
+        else:
+            values = multi_get(list(missing))
+        for name in values:
+            missing.pop(name, None)
+
+        return keys, values, missing
+
+    def fill_many(self, cache, keys, values, missing, results):
+        """cache the results of the missing calls and return the value of every
+        call in order"""
+        results = list(results)
+        if len(results) != len(missing):
+            raise ValueError("Expected {} results but got {}".format(len(missing), len(results)))
+
+        computed = dict(zip(missing, results))
+        if computed:
+            multi_set = getattr(cache, "multi_set", None)
+            if multi_set is None:
+                Cache.multi_set(cache, computed)
+
+            else:
+                multi_set(computed)
+            values.update(computed)
+
+        return [values[name] for name in keys]
+
+    def decorate(self, f, scope="process", backend=None, key=None):
+        hits, misses, _ = get_cache_counters(f, "once")
+        cache = self.get_cache(f, scope, backend)
+        get_name = self.get_key_function(scope, backend, key, cache)
+        def wrapped(*args, **kwargs):
+            name = get_name(f, args, kwargs)
             try:
-                ret = getattr(self, name)
+                ret = cache.get(name)
+                hits.inc()
 
-            except AttributeError:
+            except KeyError:
+                misses.inc()
                 ret = f(*args, **kwargs)
-                setattr(self, name, ret)
+                cache.set(name, ret)
 
             return ret
+
+        def many(calls, bulk=None):
+            keys, values, missing = self.lookup_many(f, cache, get_name, calls)
+            hits.inc(len(keys) - len(missing))
+            misses.inc(len(missing))
+
+            if not missing:
+                results = []
+
+            elif bulk:
+                results = bulk(list(missing.values()))
+
+            else:
+                results = [f(*args) for args in missing.values()]
+
+            return self.fill_many(cache, keys, values, missing, results)
+
+        wrapped.cache = cache
+        wrapped.many = many
+        return wrapped
+
+    def decorate_async(self, f, scope="process", backend=None, key=None):
+        hits, misses, _ = get_cache_counters(f, "once")
+        cache = self.get_cache(f, scope, backend)
+        get_name = self.get_key_function(scope, backend, key, cache)
+        # we cache the awaited value since a coroutine can only be awaited once
+        async def wrapped(*args, **kwargs):
+            name = get_name(f, args, kwargs)
+            try:
+                ret = cache.get(name)
+                hits.inc()
+
+            except KeyError:
+                misses.inc()
+                ret = await f(*args, **kwargs)
+                cache.set(name, ret)
+
+            return ret
+
+        async def many(calls, bulk=None):
+            keys, values, missing = self.lookup_many(f, cache, get_name, calls)
+            hits.inc(len(keys) - len(missing))
+            misses.inc(len(missing))
+
+            if not missing:
+                results = []
+
+            elif bulk:
+                results = bulk(list(missing.values()))
+                if inspect.isawaitable(results):
+                    results = await results
+
+            else:
+                results = await asyncio.gather(*[f(*args) for args in missing.values()])
+
+            return self.fill_many(cache, keys, values, missing, results)
+
+        wrapped.cache = cache
+        wrapped.many = many
         return wrapped
 
 
+class scoped_once(once):
+    """once(scope="context"), the decorated function only runs once for the
+    given arguments inside each once_scope()
+
+    :Example:
+        @scoped_once
+        def can(user, permission):
+            ...
+    """
+    def decorate(self, f, scope="context", backend=None, key=None):
+        return super(scoped_once, self).decorate(f, scope, backend, key)
+
+    def decorate_async(self, f, scope="context", backend=None, key=None):
+        return super(scoped_once, self).decorate_async(f, scope, backend, key)
+
+
 class deprecated(Decorator):
     """Mark function/class as deprecated
 
@@ -50,13 +278,16 @@ class deprecated(Decorator):
 
     https://stackoverflow.com/a/30253848/5006
     """
+    callback_args = False
+
     def find_definition(self, o, callback):
         src_line = 0
         src_file = ""
 
         st = inspect.stack()
         for ft in st:
-            lines = "\n".join(ft[4])
+            # code context will be None if the source isn't available
+            lines = "\n".join(ft[4] or [])
             if callback(lines):
                 src_file = ft[1]
                 src_line = ft[2]
@@ -83,22 +314,35 @@ class deprecated(Decorator):
 
         return src_file, src_line
 
-    def decorate_func(self, func, *deprecated_args, **deprecated_kwargs):
+    def get_warn(self, func):
+        """returns a callable that will issue the deprecation warning for func"""
         callback = lambda lines: "@" in lines or "def " in lines
         src_file, src_line = self.find_definition(func, callback)
 
+        # https://wiki.python.org/moin/PythonDecoratorLibrary#Generating_Deprecation_Warnings
+        # http://stackoverflow.com/questions/2536307/decorators-in-the-python-standard-lib-deprecated-specifically
+        return functools.partial(
+            warnings.warn_explicit,
+            "Deprecated function {}".format(func.__name__),
+            category=DeprecationWarning,
+            filename=src_file,
+            lineno=src_line
+        )
+
+    def decorate_func(self, func, *deprecated_args, **deprecated_kwargs):
+        warn = self.get_warn(func)
         def wrapped(*args, **kwargs):
-            # https://wiki.python.org/moin/PythonDecoratorLibrary#Generating_Deprecation_Warnings
-            # http://stackoverflow.com/questions/2536307/decorators-in-the-python-standard-lib-deprecated-specifically
-            warnings.warn_explicit(
-                "Deprecated function {}".format(func.__name__),
-                category=DeprecationWarning,
-                filename=src_file,
-                lineno=src_line
-            )
+            warn()
             return func(*args, **kwargs)
         return wrapped
 
+    def decorate_async(self, func, *deprecated_args, **deprecated_kwargs):
+        warn = self.get_warn(func)
+        async def wrapped(*args, **kwargs):
+            warn()
+            return await func(*args, **kwargs)
+        return wrapped
+
     def decorate_class(self, cls, *deprecated_args, **deprecated_kwargs):
         callback = lambda lines: "@" in lines or "class " in lines
         src_file, src_line = self.find_definition(cls, callback)
@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+"""Profile decorated functions with cProfile in a live process
+
+Install the profiler when the process starts, before the decorated modules are
+imported, then start a capture whenever you need one, either with the API or by
+sending the process SIGUSR1:
+
+    from decorators.profiling import profiler
+    profiler.install(directory="/tmp/profiles", seconds=30)
+
+    # later, from a shell
+    $ kill -USR1 <pid>
+
+    # or from code
+    capture = profiler.start("myapp.*", calls=1000)
+    path = capture.wait()
+
+Functions decorated before install() are never touched, and functions
+decorated after it only check if a capture is running on each call
+"""
+from __future__ import unicode_literals, division, print_function, absolute_import
+import cProfile
+import fnmatch
+import functools
+import inspect
+import itertools
+import logging
+import os
+import pstats
+import signal
+import tempfile
+import threading
+import time
+
+from .compat import *
+from .base import Decorator
+from .instrument import get_function_name
+
+
+logger = logging.getLogger(__name__)
+
+
+class Capture(object):
+    """One profiling session, it profiles the calls of the selected decorated
+    functions until it has seen calls calls or seconds have passed
+
+    Each thread records into its own cProfile.Profile which is only enabled
+    while that thread is in a selected function, the profiles are merged and
+    written to path when the capture is done and every profiled call has
+    returned
+
+    :param names: list, fnmatch patterns of the full names (eg, module.Class.method)
+        of the decorated functions to profile
+    :param calls: int, stop after this many calls, None for no limit
+    :param seconds: float, stop after this many seconds, None for no limit
+    :param path: str, where the .pstats file will be written
+    """
+    def __init__(self, names, calls, seconds, path):
+        self.names = names
+        self.max_calls = calls
+        self.deadline = time.monotonic() + seconds if seconds else None
+        self.path = path
+        self.calls = 0
+        self.active = 0
+        self.done = False
+        self.profiles = []
+        self.matched = {}
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+
+    def matches(self, name):
+        """return True if the function with name should be profiled"""
+        try:
+            return self.matched[name]
+
+        except KeyError:
+            matched = any(fnmatch.fnmatchcase(name, pattern) for pattern in self.names)
+            self.matched[name] = matched
+            return matched
+
+    def enter(self):
+        """called before a selected function is called
+
+        :returns: bool, True if the call is being profiled and exit() needs to
+            be called when it returns
+        """
+        depth = getattr(self.local, "depth", 0)
+        if depth:
+            # an outer call in this thread already enabled the profile
+            self.local.depth = depth + 1
+            return True
+
+        with self.lock:
+            if self.done:
+                return False
+
+            if self.deadline and time.monotonic() >= self.deadline:
+                self.done = True
+                self.finish()
+                return False
+
+            profile = getattr(self.local, "profile", None)
+            if profile is None:
+                profile = cProfile.Profile()
+                self.local.profile = profile
+                self.profiles.append(profile)
+
+            try:
+                profile.enable()
+
+            except ValueError:
+                # another profiler is already running in this thread
+                return False
+
+            self.calls += 1
+            if self.max_calls and self.calls >= self.max_calls:
+                self.done = True
+            self.active += 1
+
+        self.local.depth = 1
+        return True
+
+    def exit(self):
+        """called after a profiled call returns"""
+        self.local.depth -= 1
+        if not self.local.depth:
+            self.local.profile.disable()
+            with self.lock:
+                self.active -= 1
+                self.finish()
+
+    def stop(self):
+        """end the capture, the file is written as soon as the profiled calls
+        that are still running return"""
+        with self.lock:
+            self.done = True
+            self.finish()
+
+    def finish(self):
+        """write the file if the capture is done and nothing is being profiled,
+        this has to be called with the lock held"""
+        if not self.done or self.active or self.finished.is_set():
+            return
+
+        profiles = [p for p in self.profiles if p.getstats()]
+        if profiles:
+            stats = pstats.Stats(profiles[0])
+            for profile in profiles[1:]:
+                stats.add(profile)
+            stats.dump_stats(self.path)
+            logger.info("Wrote {} profiled calls to {}".format(self.calls, self.path))
+
+        else:
+            self.path = None
+
+        self.finished.set()
+
+    def wait(self, timeout=None):
+        """block until the capture is written
+
+        :returns: str, the path to the .pstats file, None if no calls were
+            profiled or timeout passed
+        """
+        if self.finished.wait(timeout):
+            return self.path
+
+
+class Profiler(object):
+    """Profiles the decorated functions with cProfile on demand
+
+    install() has Decorator.wrap() hand every decorated function to wrap(), so
+    only functions decorated after install() can be profiled
+
+    :param directory: str, where the .pstats files are written, defaults to the
+        temp directory
+    """
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.capture = None
+        self.defaults = {}
+        self.signal = None
+        self.lock = threading.Lock()
+        self.counter = itertools.count(1)
+
+    def install(self, signum=getattr(signal, "SIGUSR1", None), directory=None, **defaults):
+        """start handing decorated functions to this profiler and have signum
+        start and stop a capture
+
+        :param signum: int, the signal that starts a capture using defaults, or
+            stops the running capture, None to only use the API
+        :param directory: str, see __init__
+        :param **defaults: the default arguments for start()
+        """
+        if directory:
+            self.directory = directory
+        self.defaults = defaults
+        Decorator.profiler = self
+
+        if signum is not None:
+            self.signal = (signum, signal.signal(signum, self.handle_signal))
+
+        return self
+
+    def uninstall(self):
+        """stop handing decorated functions to this profiler and restore the
+        signal handler, functions that were already decorated can still be
+        profiled"""
+        if Decorator.profiler is self:
+            Decorator.profiler = None
+
+        if self.signal:
+            signal.signal(*self.signal)
+            self.signal = None
+
+    def handle_signal(self, signum, frame):
+        # the handler can run while the main thread holds one of the locks so
+        # the capture is toggled from another thread
+        thread = threading.Thread(target=self.toggle, name="decorators-profiler")
+        thread.daemon = True
+        thread.start()
+
+    def toggle(self):
+        """stop the running capture or start a new one with the install() defaults"""
+        if self.capture:
+            self.stop()
+
+        else:
+            self.start(**self.defaults)
+
+    def get_path(self):
+        directory = self.directory or tempfile.gettempdir()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        return os.path.join(directory, "decorators-{}-{}-{}.pstats".format(
+            os.getpid(),
+            time.strftime("%Y%m%d-%H%M%S"),
+            next(self.counter),
+        ))
+
+    def start(self, names="*", calls=None, seconds=10.0):
+        """start a capture, a running capture is stopped first
+
+        :param names: str|list, fnmatch patterns of the full names (eg,
+            myapp.models.*) of the decorated functions to profile
+        :param calls: int, stop after this many profiled calls
+        :param seconds: float, stop after this many seconds
+        :returns: Capture
+        """
+        if isinstance(names, basestring):
+            names = [names]
+
+        capture = Capture(names, calls, seconds, self.get_path())
+        with self.lock:
+            previous = self.capture
+            self.capture = capture
+
+        if previous:
+            previous.stop()
+
+        if seconds:
+            timer = threading.Timer(seconds, self.stop, [capture])
+            timer.daemon = True
+            timer.start()
+
+        logger.info("Started profiling {} to {}".format(", ".join(names), capture.path))
+        return capture
+
+    def stop(self, capture=None):
+        """stop capture, or the running capture
+
+        :returns: Capture
+        """
+        with self.lock:
+            if capture is None:
+                capture = self.capture
+
+            if capture is not None and self.capture is capture:
+                self.capture = None
+
+        if capture is not None:
+            capture.stop()
+        return capture
+
+    def wrap(self, decorator, wrapped, decorated):
+        """this is called from Decorator.wrap()
+
+        :param decorator: Decorator, the decorator instance
+        :param wrapped: callable, the original function
+        :param decorated: callable, what the decorator returned
+        :returns: callable, a function that profiles decorated when a capture
+            for it is running
+        """
+        if not inspect.isfunction(decorated) or not hasattr(wrapped, "__qualname__"):
+            return decorated
+
+        if inspect.isgeneratorfunction(decorated) or inspect.isasyncgenfunction(decorated):
+            return decorated
+
+        name = get_function_name(wrapped)
+        profiler = self
+
+        if inspect.iscoroutinefunction(decorated):
+            async def profiled(*args, **kwargs):
+                capture = profiler.capture
+                if capture is None or not capture.matches(name) or not capture.enter():
+                    return await decorated(*args, **kwargs)
+
+                try:
+                    return await decorated(*args, **kwargs)
+
+                finally:
+                    capture.exit()
+                    if capture.done:
+                        profiler.stop(capture)
+
+        else:
+            def profiled(*args, **kwargs):
+                capture = profiler.capture
+                if capture is None or not capture.matches(name) or not capture.enter():
+                    return decorated(*args, **kwargs)
+
+                try:
+                    return decorated(*args, **kwargs)
+
+                finally:
+                    capture.exit()
+                    if capture.done:
+                        profiler.stop(capture)
+
+        functools.update_wrapper(profiled, decorated, updated=())
+        profiled.__dict__.update(decorated.__dict__)
+        return profiled
+
+
+profiler = Profiler()
@@ -0,0 +1,448 @@
+# -*- coding: utf-8 -*-
+"""A cache that several processes (and machines) share over a socket
+
+Run the reference server on a Unix socket or a TCP port:
+
+    python -m decorators.remote --unix /tmp/decorators.sock
+    python -m decorators.remote --port 7379
+
+And use it as the backend of once or property:
+
+    from decorators.remote import RemoteCache
+
+    cache = RemoteCache("/tmp/decorators.sock", secret="...")
+
+    @once(backend=cache)
+    def expensive(x):
+        ...
+
+Every message is a frame: an op byte, how many parts the frame has, and each
+part prefixed with its length. The server only ever stores and returns bytes
+and doesn't check who is connecting, so it listens on localhost by default.
+The client pickles the values and signs them with an HMAC of a secret that
+every client shares, a value whose signature doesn't match (eg, one written
+by something that doesn't know the secret) is never unpickled
+"""
+from __future__ import unicode_literals, division, print_function, absolute_import
+import argparse
+import collections
+import contextlib
+import hmac
+import logging
+import os
+import socket
+import socketserver
+import struct
+import sys
+import threading
+
+from .compat import *
+from .cache import Cache
+
+
+logger = logging.getLogger(__name__)
+
+
+header = struct.Struct("!cI")
+"""op and how many parts the frame has"""
+
+length = struct.Struct("!I")
+"""each part starts with how many bytes it has"""
+
+
+def pack(op, *parts):
+    """returns bytes, the frame of op and parts"""
+    chunks = [header.pack(op, len(parts))]
+    for part in parts:
+        chunks.append(length.pack(len(part)))
+        chunks.append(part)
+    return b"".join(chunks)
+
+
+def read_exactly(fp, size):
+    data = fp.read(size)
+    if len(data) < size:
+        raise EOFError("Connection closed in the middle of a frame")
+    return data
+
+
+def unpack(fp):
+    """read one frame from fp
+
+    :returns: tuple, (op, parts), op is None if fp was closed between frames
+    """
+    data = fp.read(header.size)
+    if not data:
+        return None, []
+
+    if len(data) < header.size:
+        data += read_exactly(fp, header.size - len(data))
+
+    op, count = header.unpack(data)
+    parts = []
+    for _ in range(count):
+        size = length.unpack(read_exactly(fp, length.size))[0]
+        parts.append(read_exactly(fp, size))
+    return op, parts
+
+
+class Store(object):
+    """The server's values, the least recently used values are dropped when
+    there are more than max_items
+
+    :param max_items: int
+    """
+    def __init__(self, max_items=100000):
+        self.max_items = max_items
+        self.items = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.items.get(key)
+            if value is not None:
+                self.items.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_items:
+                self.items.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.items.pop(key, None)
+
+
+class Handler(socketserver.StreamRequestHandler):
+    """Answers the frames of one connection until the client closes it
+
+    ops:
+        G key -> V value, or V with no parts if key isn't cached
+        S key value -> K
+        D key -> K
+    """
+    def handle(self):
+        store = self.server.store
+        while True:
+            try:
+                op, parts = unpack(self.rfile)
+
+            except EOFError:
+                break
+
+            if op is None:
+                break
+
+            if op == b"G" and len(parts) == 1:
+                value = store.get(parts[0])
+                response = pack(b"V") if value is None else pack(b"V", value)
+
+            elif op == b"S" and len(parts) == 2:
+                store.set(parts[0], parts[1])
+                response = pack(b"K")
+
+            elif op == b"D" and len(parts) == 1:
+                store.delete(parts[0])
+                response = pack(b"K")
+
+            else:
+                response = pack(b"E", "Unknown op {!r}".format(op).encode("utf-8"))
+
+            self.wfile.write(response)
+
+
+class ThreadingUnixStreamServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class ThreadingTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class CacheServer(object):
+    """The reference cache server, it keeps the values in memory
+
+    :Example:
+        server = CacheServer("/tmp/decorators.sock").start()
+        ...
+        server.stop()
+
+    :param address: str|tuple, the path of a Unix socket or a (host, port)
+        tuple, port 0 picks a free port, see .address
+    :param max_items: int, see Store
+    """
+    def __init__(self, address, max_items=100000):
+        if isinstance(address, basestring):
+            if os.path.exists(address):
+                os.remove(address)
+            self.server = ThreadingUnixStreamServer(address, Handler)
+
+        else:
+            self.server = ThreadingTCPServer(tuple(address), Handler)
+
+        self.server.store = Store(max_items)
+        self.address = self.server.server_address
+        self.thread = None
+
+    def serve_forever(self):
+        self.server.serve_forever()
+
+    def start(self):
+        """serve from a daemon thread"""
+        self.thread = threading.Thread(target=self.serve_forever, name="decorators-cache-server")
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if isinstance(self.address, basestring) and os.path.exists(self.address):
+            os.remove(self.address)
+
+
+class Connection(object):
+    """One client connection to a CacheServer"""
+    batch_size = 128
+    """how many frames are sent before their responses are read, the server
+    stops reading while its responses aren't read so this keeps a big pipeline
+    from filling both sides' socket buffers"""
+
+    def __init__(self, address, timeout):
+        if isinstance(address, basestring):
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+        else:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        self.sock.settimeout(timeout)
+        self.sock.connect(address)
+        self.rfile = self.sock.makefile("rb")
+
+    def request(self, *frames):
+        """send frames batch_size at a time and read a response for each of them
+
+        :returns: list, the parts of each response
+        """
+        responses = []
+        for i in range(0, len(frames), self.batch_size):
+            batch = frames[i:i + self.batch_size]
+            self.sock.sendall(b"".join(batch))
+            for _ in batch:
+                op, parts = unpack(self.rfile)
+                if op is None:
+                    raise EOFError("Connection closed before the response")
+
+                elif op == b"E":
+                    raise ValueError(parts[0].decode("utf-8"))
+
+                responses.append(parts)
+        return responses
+
+    def close(self):
+        self.rfile.close()
+        self.sock.close()
+
+
+class RemoteCache(Cache):
+    """A cache backend that keeps its values in a CacheServer
+
+    Connections are pooled and reused, multi_get and multi_set send their
+    requests in batches without waiting for each response, so they cost a
+    round trip per batch instead of per key. If the server can't be reached
+    the error is logged and get() is a miss and set() and delete() do nothing,
+    so the decorated function still runs
+
+    Values are signed with secret and a value with a bad signature is logged
+    and treated as a miss instead of being unpickled
+
+    :param address: str|tuple, the server's Unix socket path or (host, port)
+    :param secret: str|bytes, the key values are signed with, every client of
+        the server needs the same secret, defaults to the
+        DECORATORS_CACHE_SECRET environment variable
+    :param pool_size: int, how many idle connections are kept
+    :param timeout: float, socket timeout in seconds
+    """
+    digest = hashlib.sha256
+
+    def __init__(self, address, secret=None, pool_size=8, timeout=1.0):
+        if secret is None:
+            secret = os.environ.get("DECORATORS_CACHE_SECRET")
+
+        if not secret:
+            raise ValueError("RemoteCache needs a secret to sign its values")
+
+        self.secret = secret.encode("utf-8") if isinstance(secret, unicode) else secret
+        self.signature_size = self.digest().digest_size
+        self.address = address if isinstance(address, basestring) else tuple(address)
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.pool = []
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+
+    def get_connection(self):
+        with self.lock:
+            if self.pid != os.getpid():
+                # a forked child can't share its parent's connections
+                self.pool = []
+                self.pid = os.getpid()
+
+            if self.pool:
+                return self.pool.pop()
+
+        return Connection(self.address, self.timeout)
+
+    def put_connection(self, connection):
+        with self.lock:
+            if len(self.pool) < self.pool_size and self.pid == os.getpid():
+                self.pool.append(connection)
+                return
+
+        connection.close()
+
+    @contextlib.contextmanager
+    def connection(self):
+        connection = self.get_connection()
+        try:
+            yield connection
+
+        except BaseException:
+            # the connection might be in the middle of a response
+            connection.close()
+            raise
+
+        else:
+            self.put_connection(connection)
+
+    def request(self, *frames):
+        """returns list, the response parts of each frame, None if the server
+        couldn't be reached"""
+        try:
+            with self.connection() as connection:
+                return connection.request(*frames)
+
+        except (OSError, EOFError) as e:
+            logger.warning("Cache server {} failed: {}".format(self.address, e))
+            return None
+
+    def encode_key(self, key):
+        return String(key).encode("utf-8")
+
+    def sign(self, key, data):
+        """returns bytes, the signature of data stored at key, the key is signed
+        too so a value can't be moved to another key"""
+        return hmac.new(self.secret, length.pack(len(key)) + key + data, self.digest).digest()
+
+    def dumps(self, key, value):
+        """returns bytes, the signed pickle of value, see loads()"""
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        return self.sign(key, data) + data
+
+    def loads(self, key, data):
+        """returns the value of the signed pickle data, raises KeyError if the
+        signature doesn't match"""
+        signature, data = data[:self.signature_size], data[self.signature_size:]
+        if not hmac.compare_digest(signature, self.sign(key, data)):
+            logger.warning("Cache server {} returned a value for {} with a bad signature".format(
+                self.address,
+                key.decode("utf-8"),
+            ))
+            raise KeyError(key)
+
+        return pickle.loads(data)
+
+    def get(self, key):
+        k = self.encode_key(key)
+        responses = self.request(pack(b"G", k))
+        if not responses or not responses[0]:
+            raise KeyError(key)
+        return self.loads(k, responses[0][0])
+
+    def set(self, key, value):
+        """cache value, returns False if it couldn't be pickled or sent"""
+        k = self.encode_key(key)
+        try:
+            data = self.dumps(k, value)
+
+        except Exception:
+            return False
+
+        return self.request(pack(b"S", k, data)) is not None
+
+    def delete(self, key):
+        self.request(pack(b"D", self.encode_key(key)))
+
+    def multi_get(self, keys):
+        keys = list(keys)
+        ret = {}
+        if keys:
+            encoded = [self.encode_key(k) for k in keys]
+            responses = self.request(*[pack(b"G", k) for k in encoded])
+            for key, k, parts in zip(keys, encoded, responses or []):
+                if parts:
+                    try:
+                        ret[key] = self.loads(k, parts[0])
+
+                    except KeyError:
+                        pass
+
+        return ret
+
+    def multi_set(self, items):
+        """cache every (key, value) in items with one round trip, values that
+        can't be pickled are skipped"""
+        frames = []
+        for key, value in items.items():
+            k = self.encode_key(key)
+            try:
+                frames.append(pack(b"S", k, self.dumps(k, value)))
+
+            except Exception:
+                pass
+
+        if frames:
+            self.request(*frames)
+
+    def close(self):
+        """close the pooled connections"""
+        with self.lock:
+            pool, self.pool = self.pool, []
+
+        for connection in pool:
+            connection.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m decorators.remote",
+        description="Run the reference cache server for decorators.remote.RemoteCache",
+    )
+    parser.add_argument("--unix", default=None, help="the path of the Unix socket to listen on")
+    parser.add_argument("--host", default="127.0.0.1", help="the server doesn't authenticate clients, only listen where you trust every client")
+    parser.add_argument("--port", type=int, default=7379)
+    parser.add_argument("--max-items", type=int, default=100000, help="how many values are kept")
+    options = parser.parse_args(argv)
+
+    address = options.unix if options.unix else (options.host, options.port)
+    server = CacheServer(address, max_items=options.max_items)
+    print("Serving cache on {}".format(server.address), file=sys.stderr)
+    try:
+        server.serve_forever()
+
+    except KeyboardInterrupt:
+        pass
+
+    finally:
+        server.stop()
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,470 @@
+# -*- coding: utf-8 -*-
+"""Keep track of everything that was decorated and how often it was called
+
+The registry is off by default and costs nothing when it is off, turn it on
+before the decorated modules are imported:
+
+    from decorators.stats import registry
+    registry.enable()
+
+    import myapp
+    myapp.main()
+
+    print(registry.table())
+
+Or run a script (or module with -m) with the registry on and print the hot path
+table when it finishes:
+
+    python -m decorators.stats [-a] [-n LIMIT] [-s SORT] (-m module | script.py) [args...]
+"""
+from __future__ import unicode_literals, division, print_function, absolute_import
+import argparse
+import functools
+import inspect
+import reprlib
+import runpy
+import sys
+import threading
+import time
+import weakref
+
+from .compat import *
+from .base import Decorator
+from .instrument import Histogram, Counter, get_function_name
+
+
+class Entry(object):
+    """Everything the registry knows about one decorated function or class
+
+    Only weak references are kept to the decorated and original objects and the
+    decoration arguments are kept as a repr, so registering something never
+    keeps it alive
+
+    :param accounting: bool, True to also keep track of the time spent in the
+        original function and in Decorator's own __call__ and __get__, so the
+        time spent in library code can be separated from the callee's time
+    """
+    def __init__(self, decorator, wrapped, decorator_args, decorator_kwargs, accounting=False):
+        self.name = get_function_name(wrapped)
+        self.decorator = decorator.__class__.__name__
+        self.args = self.get_args(decorator_args, decorator_kwargs)
+        self.kind = "class" if isinstance(wrapped, type) else "function"
+        self.wrapped = weakref.ref(wrapped)
+        self.decorated = None
+        self.histogram = None
+        self.callee = None
+        self.dispatch = None
+        self.calibration = 0
+        if self.kind == "function":
+            self.histogram = Histogram(self.name, window=1)
+            if accounting:
+                self.callee = Histogram(self.name, window=1)
+                self.dispatch = Counter(self.name)
+
+    def get_args(self, decorator_args, decorator_kwargs):
+        """return a short repr of the arguments the decorator was called with"""
+        args = [reprlib.repr(arg) for arg in decorator_args]
+        args.extend("{}={}".format(k, reprlib.repr(v)) for k, v in decorator_kwargs.items())
+        return "({})".format(", ".join(args))
+
+    def row(self):
+        """returns a dict of the entry's name and call statistics, times are in
+        seconds and overhead is the fraction of total spent in library code"""
+        row = {
+            "name": self.name,
+            "decorator": self.decorator,
+            "args": self.args,
+            "kind": self.kind,
+            "calls": 0,
+            "errors": 0,
+            "total": 0.0,
+            "mean": 0.0,
+            "p99": 0.0,
+            "callee": None,
+            "library": None,
+            "overhead": None,
+        }
+        if self.histogram:
+            s = self.histogram.snapshot()
+            row.update({
+                "calls": s.count,
+                "errors": s.errors,
+                "total": s.total,
+                "mean": s.mean,
+                "p99": s.p99,
+            })
+
+            if self.callee:
+                callee = self.callee.snapshot().total
+                total = s.total + self.dispatch.value / 1e9
+                library = total - callee - (s.count * self.calibration / 1e9)
+                library = max(0.0, min(library, total))
+                row.update({
+                    "total": total,
+                    "callee": callee,
+                    "library": library,
+                    "overhead": library / total if total else 0.0,
+                })
+
+        return row
+
+
+class Registry(object):
+    """Records every function and class that is decorated while the registry is
+    enabled, along with the decorator and its arguments, and counts and times
+    the calls to each decorated function
+
+    Decorator.wrap() hands everything to wrap() only when Decorator.registry is
+    set, so a disabled registry doesn't add anything to decorating or calling
+
+    With accounting turned on the original function is timed too, and so are
+    Decorator's __call__ and __get__ for decorators without (...), so the time
+    spent in the library can be separated from the time spent in the callee
+    """
+    sort_keys = ("total", "calls", "mean", "p99", "errors", "overhead", "library", "name")
+
+    calls = 10000
+    """how many calls calibrate() times to figure out the cost of timing"""
+
+    def __init__(self):
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.accounting = False
+        self.calibration = 0
+        self.methods = None
+
+    @property
+    def enabled(self):
+        return Decorator.registry is self
+
+    def enable(self, accounting=False):
+        """start registering everything that is decorated from now on
+
+        :param accounting: bool, True to separate the time spent in decorator
+            code from the time spent in the decorated function
+        """
+        Decorator.registry = self
+        self.accounting = accounting
+        if accounting:
+            if not self.calibration:
+                self.calibration = self.calibrate()
+            self.patch()
+        return self
+
+    def disable(self):
+        """stop registering, already registered functions keep being counted"""
+        if Decorator.registry is self:
+            Decorator.registry = None
+        self.accounting = False
+        self.unpatch()
+
+    def clear(self):
+        with self.lock:
+            self.entries = {}
+
+    def calibrate(self):
+        """return how many nanoseconds timing adds to each call, this is
+        subtracted from the library time so the registry doesn't count itself
+
+        :returns: int
+        """
+        noop = lambda: None
+        outer = Histogram()
+        callee = Histogram()
+        func = self.get_counted(outer, self.get_counted(callee, noop))
+        for _ in range(self.calls):
+            func()
+
+        cost = (outer.snapshot().total - callee.snapshot().total) * 1e9 / self.calls
+        return max(0, int(cost))
+
+    def patch(self):
+        """time Decorator's own __call__ and __get__, they only run on every
+        call for decorators without (...), eg @dec"""
+        if self.methods:
+            return
+
+        call = Decorator.__call__
+        get = Decorator.__get__
+        clock = time.perf_counter_ns
+
+        def __call__(decorator, *args, **kwargs):
+            if decorator.wrapped_call != "__new__":
+                return call(decorator, *args, **kwargs)
+
+            # this is the same as Decorator.__call__'s __new__ branch
+            start = clock()
+            func = decorator.get_wrapped(decorator.decorator_args[0])
+            entry = decorator.__dict__.get("_entry")
+            if entry and entry.dispatch:
+                entry.dispatch.inc(clock() - start)
+            return func(*args, **kwargs)
+
+        def __get__(decorator, instance, instance_class):
+            start = clock()
+            ret = get(decorator, instance, instance_class)
+            entry = decorator.__dict__.get("_entry")
+            if entry and entry.dispatch:
+                entry.dispatch.inc(clock() - start)
+            return ret
+
+        self.methods = (call, get)
+        Decorator.__call__ = functools.update_wrapper(__call__, call)
+        Decorator.__get__ = functools.update_wrapper(__get__, get)
+
+    def unpatch(self):
+        if self.methods:
+            Decorator.__call__, Decorator.__get__ = self.methods
+            self.methods = None
+
+    def get_entry(self, decorator, wrapped, decorator_args, decorator_kwargs):
+        """returns an Entry or None if wrapped can't be tracked"""
+        try:
+            entry = Entry(decorator, wrapped, decorator_args, decorator_kwargs, self.accounting)
+
+        except (AttributeError, TypeError):
+            # things like builtins don't have a __qualname__ or can't be weakly
+            # referenced, so there isn't anything useful to track
+            entry = None
+
+        else:
+            entry.calibration = self.calibration
+
+        return entry
+
+    def wrap(self, decorator, wrapped, decorator_args, decorator_kwargs):
+        """decorate wrapped and register it, this is called from Decorator.wrap()
+
+        :param decorator: Decorator, the decorator instance that is decorating
+        :param wrapped: callable|type, the original function or class
+        :param decorator_args: tuple, the arguments passed to the decorator
+        :param decorator_kwargs: dict, the keyword arguments passed to the decorator
+        :returns: callable|type, what the decorator returned, functions are
+            returned in a wrapper that counts and times calls
+        """
+        entry = self.get_entry(decorator, wrapped, decorator_args, decorator_kwargs)
+        callee = wrapped
+        if entry and entry.callee and inspect.isfunction(wrapped):
+            callee = self.get_counted(entry.callee, wrapped)
+
+        decorated = decorator.decorate_wrapped(callee, *decorator_args, **decorator_kwargs)
+        if entry is None:
+            return decorated
+
+        decorator._entry = entry
+        return self.add(entry, decorated)
+
+    def register(self, decorator, wrapped, decorated, decorator_args, decorator_kwargs):
+        """register something that was already decorated, see wrap()"""
+        entry = self.get_entry(decorator, wrapped, decorator_args, decorator_kwargs)
+        if entry is None:
+            return decorated
+        return self.add(entry, decorated)
+
+    def add(self, entry, decorated):
+        if entry.histogram and inspect.isfunction(decorated):
+            decorated = self.get_counted(entry.histogram, decorated)
+
+        key = id(entry)
+        try:
+            entry.decorated = weakref.ref(decorated, lambda r: self.entries.pop(key, None))
+
+        except TypeError:
+            return decorated
+
+        with self.lock:
+            self.entries[key] = entry
+        return decorated
+
+    def get_counted(self, histogram, func):
+        """return a function of the same kind as func that records each call of
+        func into histogram"""
+        enter = histogram.enter
+        record = histogram.record
+        clock = time.perf_counter_ns
+
+        if inspect.iscoroutinefunction(func):
+            async def counted(*args, **kwargs):
+                stripe = enter()
+                start = clock()
+                try:
+                    ret = await func(*args, **kwargs)
+
+                except BaseException:
+                    record(clock() - start, True, 1, stripe)
+                    raise
+
+                record(clock() - start, False, 1, stripe)
+                return ret
+
+        elif inspect.isasyncgenfunction(func):
+            async def counted(*args, **kwargs):
+                stripe = enter()
+                start = clock()
+                try:
+                    async for v in func(*args, **kwargs):
+                        yield v
+
+                except BaseException:
+                    record(clock() - start, True, 1, stripe)
+                    raise
+
+                record(clock() - start, False, 1, stripe)
+
+        elif inspect.isgeneratorfunction(func):
+            def counted(*args, **kwargs):
+                stripe = enter()
+                start = clock()
+                try:
+                    ret = yield from func(*args, **kwargs)
+
+                except BaseException:
+                    record(clock() - start, True, 1, stripe)
+                    raise
+
+                record(clock() - start, False, 1, stripe)
+                return ret
+
+        else:
+            def counted(*args, **kwargs):
+                stripe = enter()
+                start = clock()
+                try:
+                    ret = func(*args, **kwargs)
+
+                except BaseException:
+                    record(clock() - start, True, 1, stripe)
+                    raise
+
+                record(clock() - start, False, 1, stripe)
+                return ret
+
+        functools.update_wrapper(counted, func, updated=())
+        # this also brings over func's __wrapped__ so it still points to the
+        # original function, but not the fusion attributes since a fused
+        # decorator would skip right past counted and call the fused function
+        counted.__dict__.update(
+            (k, v) for k, v in func.__dict__.items() if not k.startswith("fused_")
+        )
+        return counted
+
+    def rows(self, sort="total"):
+        """return a dict for each registered entry, sorted by sort
+
+        :param sort: str, one of sort_keys, names are sorted ascending and
+            everything else descending
+        :returns: list
+        """
+        if sort not in self.sort_keys:
+            raise ValueError("Unknown sort {}, use one of {}".format(sort, ", ".join(self.sort_keys)))
+
+        with self.lock:
+            entries = list(self.entries.values())
+
+        rows = [entry.row() for entry in entries]
+        rows.sort(key=lambda row: row[sort] or 0, reverse=(sort != "name"))
+        return rows
+
+    def table(self, limit=None, sort="total"):
+        """return the hot path table, the decorated functions that took the most
+        time first
+
+        :param limit: int, only include this many rows
+        :param sort: str, see rows()
+        :returns: str
+        """
+        rows = self.rows(sort)
+        if limit:
+            rows = rows[:limit]
+
+        accounting = any(row["library"] is not None for row in rows)
+        header = ["calls", "errors", "total s", "mean ms", "p99 ms"]
+        if accounting:
+            header.extend(["library s", "overhead"])
+        header.extend(["decorator", "name"])
+
+        lines = [header]
+        for row in rows:
+            line = [
+                str(row["calls"]),
+                str(row["errors"]),
+                "{:.6f}".format(row["total"]),
+                "{:.4f}".format(row["mean"] * 1000.0),
+                "{:.4f}".format(row["p99"] * 1000.0),
+            ]
+            if accounting:
+                if row["library"] is None:
+                    line.extend(["-", "-"])
+
+                else:
+                    line.extend([
+                        "{:.6f}".format(row["library"]),
+                        "{:.1%}".format(row["overhead"]),
+                    ])
+
+            line.extend(["{}{}".format(row["decorator"], row["args"]), row["name"]])
+            lines.append(line)
+
+        numbers = len(header) - 2
+        widths = [max(len(line[i]) for line in lines) for i in range(len(header) - 1)]
+        output = []
+        for line in lines:
+            cols = [col.rjust(w) if i < numbers else col.ljust(w) for i, (col, w) in enumerate(zip(line, widths))]
+            cols.append(line[-1])
+            output.append("  ".join(cols))
+        return "\n".join(output)
+
+
+registry = Registry()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m decorators.stats",
+        description="Run a script with the decorator registry enabled and print the hot path table",
+    )
+    parser.add_argument("-n", "--limit", type=int, default=None, help="how many rows to print")
+    parser.add_argument("-s", "--sort", default="total", choices=Registry.sort_keys)
+    parser.add_argument(
+        "-a", "--accounting",
+        action="store_true",
+        help="separate the time spent in decorator code from the decorated functions",
+    )
+    parser.add_argument("-m", dest="module", default=None, help="run a module like python -m")
+    parser.add_argument("script", nargs="?", default=None)
+    parser.add_argument("args", nargs=argparse.REMAINDER)
+    options = parser.parse_args(argv)
+
+    if options.module:
+        # with -m the script positional is really the first script argument
+        target = options.module
+        args = ([options.script] if options.script else []) + options.args
+
+    elif options.script:
+        target = options.script
+        args = options.args
+
+    else:
+        parser.error("a script or -m module is required")
+
+    # when ran with -m this module is __main__, so use the importable module's
+    # registry so the script sees the same registry we print
+    from decorators.stats import registry
+    registry.enable(accounting=options.accounting)
+
+    sys.argv = [target] + args
+    try:
+        if options.module:
+            runpy.run_module(target, run_name="__main__", alter_sys=True)
+
+        else:
+            runpy.run_path(target, run_name="__main__")
+
+    finally:
+        print(registry.table(limit=options.limit, sort=options.sort), file=sys.stderr)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,370 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, division, print_function, absolute_import
+import atexit
+import collections
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+import weakref
+
+from .compat import *
+from .base import FuncDecorator
+from .instrument import get_counter, get_function_name
+
+
+logger = logging.getLogger(__name__)
+
+
+class Span(object):
+    """One timed call, spans started while another span is current are its
+    children and share its trace_id
+
+    :param name: str
+    :param parent: Span, the current span when this span was started
+    :param attributes: dict
+    """
+    __slots__ = (
+        "name",
+        "trace_id",
+        "span_id",
+        "parent_id",
+        "start",
+        "duration",
+        "attributes",
+        "error",
+        "clock",
+    )
+
+    def __init__(self, name, parent=None, attributes=None):
+        self.name = name
+        self.span_id = "{:016x}".format(random.getrandbits(64))
+        if parent is None:
+            self.trace_id = "{:032x}".format(random.getrandbits(128))
+            self.parent_id = None
+
+        else:
+            self.trace_id = parent.trace_id
+            self.parent_id = parent.span_id
+
+        self.attributes = dict(attributes) if attributes else {}
+        self.error = None
+        self.duration = None
+        self.start = time.time()
+        self.clock = time.perf_counter()
+
+    def set(self, key, value):
+        """set an attribute on the span"""
+        self.attributes[key] = value
+
+    def finish(self):
+        self.duration = time.perf_counter() - self.clock
+
+    def to_dict(self):
+        d = {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start": self.start,
+            "duration": self.duration,
+            "attributes": self.attributes,
+        }
+        if self.error is not None:
+            d["error"] = self.error
+        return d
+
+
+class RingBuffer(object):
+    """A bounded buffer that never blocks, when it is full new items are dropped
+    and counted instead
+
+    deque's append() and popleft() are atomic so writers and the reader don't
+    need a lock, the size check can race so the buffer might briefly hold a
+    few more than size items
+
+    :param size: int, how many items the buffer holds
+    :param dropped: Counter, incremented for each dropped item
+    """
+    def __init__(self, size, dropped):
+        self.size = size
+        self.items = collections.deque()
+        self.dropped = dropped
+
+    def __len__(self):
+        return len(self.items)
+
+    def put(self, item):
+        """add item, returns False if the buffer was full and item was dropped"""
+        if len(self.items) >= self.size:
+            self.dropped.inc()
+            return False
+
+        self.items.append(item)
+        return True
+
+    def drain(self, count=None):
+        """remove and return up to count items, all the items if count is None"""
+        items = []
+        popleft = self.items.popleft
+        count = len(self.items) if count is None else count
+        while len(items) < count:
+            try:
+                items.append(popleft())
+
+            except IndexError:
+                break
+
+        return items
+
+
+class Tracer(object):
+    """Keeps track of the current span and writes finished spans to JSON lines
+    files from a background thread
+
+    Finishing a span only adds it to the ring buffer, the file is written by
+    the background thread every interval seconds, and it is rotated when it
+    gets bigger than max_bytes, keeping backups old files (eg, spans.jsonl.1)
+
+    :param path: str, the file spans are written to, defaults to
+        decorators-spans-<pid>.jsonl in the temp directory, a forked child
+        gets its own default file and writer thread
+    :param max_bytes: int, rotate the file when it is bigger than this
+    :param backups: int, how many rotated files to keep
+    :param size: int, how many finished spans can be buffered
+    :param interval: float, how often the background thread writes the spans
+    """
+    instances = weakref.WeakSet()
+    """every Tracer in this process, so they can be reset after a fork"""
+
+    def __init__(self, path=None, max_bytes=10 * 1024 * 1024, backups=5, size=10000, interval=0.5):
+        self.current = contextvars.ContextVar("decorators_span", default=None)
+        self.lock = threading.Lock()
+        self.thread = None
+        self.fp = None
+        self.wake = threading.Event()
+        self.stopped = False
+        self.configure(path, max_bytes, backups, size, interval)
+        self.instances.add(self)
+
+    def get_default_path(self):
+        return os.path.join(
+            tempfile.gettempdir(),
+            "decorators-spans-{}.jsonl".format(os.getpid()),
+        )
+
+    def reset(self):
+        """called in a forked child, the parent's writer thread doesn't exist
+        in the child so it gets a new one, and new locks and buffer so it
+        doesn't write the parent's spans again"""
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.thread = None
+        self.stopped = False
+        # the parent flushes after every write so the inherited file has
+        # nothing buffered, the child opens its own
+        self.fp = None
+        if self.default_path:
+            self.path = self.get_default_path()
+        self.buffer = RingBuffer(self.buffer.size, self.buffer.dropped)
+
+    def configure(self, path=None, max_bytes=10 * 1024 * 1024, backups=5, size=10000, interval=0.5):
+        """change where and how the spans are written, see __init__"""
+        self.default_path = path is None
+        if path is None:
+            path = self.get_default_path()
+
+        with self.lock:
+            if self.fp:
+                self.fp.close()
+                self.fp = None
+
+            self.path = path
+            self.max_bytes = max_bytes
+            self.backups = backups
+            self.interval = interval
+            self.buffer = RingBuffer(size, get_counter(
+                "decorators_spans_dropped_total",
+                "Finished spans dropped because the span buffer was full",
+            ))
+
+    def get_current_span(self):
+        return self.current.get()
+
+    def start(self, name, attributes=None):
+        """start a span that is a child of the current span and make it the
+        current span
+
+        :returns: tuple, (span, token) pass these to finish()
+        """
+        span = Span(name, self.current.get(), attributes)
+        return span, self.current.set(span)
+
+    def finish(self, span, token, error=None):
+        """finish span and put the previous span back as the current span, this
+        never blocks"""
+        span.finish()
+        if error is not None:
+            span.error = "{}: {}".format(error.__class__.__name__, error)
+
+        self.current.reset(token)
+        self.buffer.put(span)
+        if self.thread is None:
+            self.start_thread()
+
+    def start_thread(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="decorators-tracer")
+                self.thread.daemon = True
+                self.thread.start()
+                atexit.register(self.close)
+
+    def run(self):
+        while not self.stopped:
+            self.wake.wait(self.interval)
+            self.wake.clear()
+            self.flush()
+
+    def flush(self):
+        """write every buffered span to the file"""
+        spans = self.buffer.drain()
+        if not spans:
+            return
+
+        lines = "".join(json.dumps(span.to_dict(), default=repr) + "\n" for span in spans)
+        with self.lock:
+            try:
+                fp = self.get_file()
+                fp.write(lines)
+                fp.flush()
+
+            except (IOError, OSError) as e:
+                logger.exception(e)
+
+    def get_file(self):
+        """return the open file, rotating it first if it is too big, this is
+        called with the lock held"""
+        if self.fp is None:
+            self.fp = open(self.path, "a")
+
+        if self.max_bytes and self.fp.tell() >= self.max_bytes:
+            self.fp.close()
+            self.fp = None
+            self.rotate()
+            self.fp = open(self.path, "a")
+
+        return self.fp
+
+    def rotate(self):
+        """shift path to path.1, path.1 to path.2, etc, dropping the oldest"""
+        for i in range(self.backups - 1, 0, -1):
+            src = "{}.{}".format(self.path, i)
+            if os.path.exists(src):
+                os.replace(src, "{}.{}".format(self.path, i + 1))
+
+        if self.backups:
+            os.replace(self.path, "{}.1".format(self.path))
+
+        else:
+            os.remove(self.path)
+
+    def close(self):
+        """stop the background thread and write what is left in the buffer"""
+        self.stopped = True
+        self.wake.set()
+        if self.thread is not None:
+            self.thread.join(5)
+        self.flush()
+
+        with self.lock:
+            if self.fp:
+                self.fp.close()
+                self.fp = None
+
+
+def reset_tracers():
+    for t in list(Tracer.instances):
+        t.reset()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=reset_tracers)
+
+
+tracer = Tracer()
+
+
+def get_tracer():
+    """return the default tracer"""
+    return tracer
+
+
+def get_current_span():
+    """return the current span of the default tracer, or None"""
+    return tracer.get_current_span()
+
+
+class traced(FuncDecorator):
+    """Record each call of the decorated function as a span
+
+    Spans started during the call (in the same thread or in tasks the call
+    creates) are children of the call's span. Finished spans are written as
+    JSON lines by the tracer's background thread so the call never waits on
+    the file, if the buffer is full the span is dropped and counted in the
+    decorators_spans_dropped_total counter
+
+    :Example:
+        @traced(attributes={"component": "db"})
+        def query(sql):
+            get_current_span().set("sql", sql)
+            ...
+
+    :param name: str, the span name, defaults to the function's full name
+    :param attributes: dict, attributes every span of this function starts with
+    :param tracer: Tracer, defaults to the module's tracer
+    """
+    callback_args = False
+
+    def decorate(self, func, name="", attributes=None, tracer=None):
+        name = name or get_function_name(func)
+        tracer = tracer or get_tracer()
+        start = tracer.start
+        finish = tracer.finish
+
+        def wrapped(*args, **kwargs):
+            span, token = start(name, attributes)
+            try:
+                ret = func(*args, **kwargs)
+
+            except BaseException as e:
+                finish(span, token, e)
+                raise
+
+            finish(span, token)
+            return ret
+
+        return wrapped
+
+    def decorate_async(self, func, name="", attributes=None, tracer=None):
+        name = name or get_function_name(func)
+        tracer = tracer or get_tracer()
+        start = tracer.start
+        finish = tracer.finish
+
+        async def wrapped(*args, **kwargs):
+            span, token = start(name, attributes)
+            try:
+                ret = await func(*args, **kwargs)
+
+            except BaseException as e:
+                finish(span, token, e)
+                raise
+
+            finish(span, token)
+            return ret
+
+        return wrapped
@@ -540,6 +540,280 @@ class FuncDecoratorTest(TestCase):
         self.assertEqual(4, r)
 
 
+    def test_fuse(self):
+        class add(FuncDecorator):
+            def before(self, args, kwargs):
+                return args + self.hook_args, kwargs
+
+        class double(FuncDecorator):
+            def after(self, ret):
+                return ret * 2
+
+        @double()
+        @add(2)
+        @double
+        @add(1)
+        def foo(*args):
+            return sum(args)
+
+        self.assertEqual(4, len(foo.fused_layers))
+        self.assertEqual((2,), foo.fused_layers[1].hook_args)
+        self.assertEqual("foo", foo.fused_func.__name__)
+        # the befores add to the args on the way in: (1 + 2 + 1) * 2 * 2
+        self.assertEqual(16, foo(1))
+        self.assertEqual(16, foo(1))
+
+        @double
+        @double
+        def bar():
+            return 1
+        self.assertEqual(4, bar())
+        self.assertEqual(4, bar())
+        self.assertEqual("bar", bar.__name__)
+
+        class Foo(object):
+            @double
+            @double
+            def bar(self):
+                return 2
+        self.assertEqual(8, Foo().bar())
+
+    def test_fuse_wraps(self):
+        """a functools.wraps decorator in the middle of the stack isn't skipped"""
+        import functools
+
+        class add1(FuncDecorator):
+            def after(self, ret):
+                return ret + 1
+
+        def times10(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                return func(*args, **kwargs) * 10
+            return wrapper
+
+        @add1()
+        @times10
+        @add1()
+        def foo():
+            return 1
+
+        self.assertEqual(21, foo())
+        self.assertEqual(1, len(foo.fused_layers))
+
+    def test_fuse_depth(self):
+        import inspect
+
+        class noop(FuncDecorator):
+            def after(self, ret):
+                return ret
+
+        def depth():
+            return len(inspect.stack(0))
+
+        d1 = noop("one")(depth)
+        d3 = noop("one")(noop("two")(noop("three")(depth)))
+        self.assertEqual(d1(), d3())
+
+    def test_fuse_exception(self):
+        calls = []
+
+        class suppress(FuncDecorator):
+            def around(self):
+                slf = self
+                class cm(object):
+                    def __enter__(self):
+                        calls.append("enter")
+                    def __exit__(self, *exc_info):
+                        calls.append("exit")
+                        return slf.hook_kwargs.get("suppress", False)
+                return cm()
+
+        class after(FuncDecorator):
+            def after(self, ret):
+                calls.append("after")
+                return 5 if ret is None else ret
+
+        @after
+        @suppress(suppress=True)
+        @after
+        @suppress
+        def foo():
+            raise ValueError()
+
+        self.assertEqual(5, foo())
+        # the inner after is skipped because the inner suppress doesn't suppress
+        self.assertEqual(["enter", "enter", "exit", "exit", "after"], calls)
+
+        @after
+        @suppress
+        def bar():
+            raise ValueError()
+
+        with self.assertRaises(ValueError):
+            bar()
+
+        class fail(FuncDecorator):
+            def before(self, args, kwargs):
+                raise KeyError()
+
+        calls[:] = []
+        @suppress(suppress=True)
+        @fail
+        def che():
+            calls.append("che")
+        self.assertIsNone(che())
+        self.assertEqual(["enter", "exit"], calls)
+
+
+    def test_kinds(self):
+        import asyncio
+        import inspect
+
+        class dec(FuncDecorator):
+            match_kinds = True
+            def decorate(self, func, *dec_args, **dec_kwargs):
+                def wrapper(*args, **kwargs):
+                    return func(*args, **kwargs)
+                return wrapper
+
+        class adec(dec):
+            def decorate_async(self, func, *dec_args, **dec_kwargs):
+                async def wrapper(*args, **kwargs):
+                    return await func(*args, **kwargs) + 1
+                return wrapper
+
+        @dec
+        async def foo(v):
+            return v
+        self.assertEqual(1, asyncio.run(foo(1)))
+
+        @dec()
+        async def foo(v):
+            return v
+        self.assertTrue(inspect.iscoroutinefunction(foo))
+        self.assertEqual(2, asyncio.run(foo(2)))
+
+        @adec(1)
+        async def foo(v):
+            return v
+        self.assertTrue(inspect.iscoroutinefunction(foo))
+        self.assertEqual(4, asyncio.run(foo(3)))
+
+        class Foo(object):
+            @dec
+            async def bar(self, v):
+                return v
+
+            @adec
+            async def che(self, v):
+                return v
+
+        f = Foo()
+        self.assertTrue(inspect.iscoroutinefunction(f.bar))
+        self.assertEqual(5, asyncio.run(f.bar(5)))
+        self.assertTrue(inspect.iscoroutinefunction(f.che))
+        self.assertEqual(6, asyncio.run(f.che(5)))
+
+        @dec()
+        def foo(v):
+            for i in range(v):
+                yield i
+            return v
+        self.assertTrue(inspect.isgeneratorfunction(foo))
+        self.assertEqual([0, 1, 2], list(foo(3)))
+
+        @dec()
+        async def foo(v):
+            for i in range(v):
+                yield i
+
+        async def collect():
+            return [i async for i in foo(3)]
+        self.assertTrue(inspect.isasyncgenfunction(foo))
+        self.assertEqual([0, 1, 2], asyncio.run(collect()))
+
+    def test_change_kinds(self):
+        """decorators that don't set match_kinds can change the function's kind"""
+        import asyncio
+        import inspect
+
+        class to_list(FuncDecorator):
+            def decorate(self, func):
+                return lambda *args: list(func(*args))
+
+        class to_sync(FuncDecorator):
+            def decorate(self, func):
+                return lambda *args: asyncio.run(func(*args))
+
+        @to_list
+        def foo(v):
+            for i in range(v):
+                yield i
+        self.assertFalse(inspect.isgeneratorfunction(foo))
+        self.assertEqual([0, 1, 2], foo(3))
+
+        @to_list()
+        def foo(v):
+            yield v
+        self.assertEqual([1], foo(1))
+
+        @to_sync
+        async def bar(v):
+            return v
+        self.assertFalse(inspect.iscoroutinefunction(bar))
+        self.assertEqual(1, bar(1))
+
+        @to_sync()
+        async def bar(v):
+            return v
+        self.assertEqual(2, bar(2))
+
+    def test_fuse_async(self):
+        import asyncio
+        import inspect
+
+        class double(FuncDecorator):
+            def after(self, ret):
+                return ret * 2
+
+        @double()
+        @double
+        async def foo():
+            return 1
+        self.assertTrue(inspect.iscoroutinefunction(foo))
+        self.assertEqual(2, len(foo.fused_layers))
+        self.assertEqual(4, asyncio.run(foo()))
+
+
+    def test_callback_args(self):
+        class dec(FuncDecorator):
+            callback_args = False
+            def decorate(self, func, *dec_args, **dec_kwargs):
+                def wrapper(*args, **kwargs):
+                    return func(*args, **kwargs)
+                wrapper.dec_args = dec_args
+                return wrapper
+
+        @dec
+        def foo(v):
+            return v
+        self.assertEqual((), foo.dec_args)
+        self.assertEqual(1, foo(1))
+
+        @dec(1, 2)
+        def foo(v):
+            return v
+        self.assertEqual((1, 2), foo.dec_args)
+        self.assertEqual(1, foo(1))
+
+        class Foo(object):
+            @dec
+            def bar(self, v):
+                return v
+        self.assertEqual(2, Foo().bar(2))
+
+
     def test_ambiguity_1(self):
         class dec(FuncDecorator):
             def decorate(self, func, callback=None):
@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, division, print_function, absolute_import
+import asyncio
+import threading
+import time
+
+from decorators.compat import *
+from decorators.batching import (
+    Batcher,
+    batched,
+    WriteBehind,
+    write_behind,
+    debounce,
+    throttle,
+)
+
+from . import TestCase, testdata
+
+
+class BatchedTest(TestCase):
+    def test_threads(self):
+        calls = []
+
+        @batched(max_size=10, max_wait_ms=50)
+        def foo(keys):
+            calls.append(keys)
+            return [k * 2 for k in keys]
+
+        results = {}
+        def target(k):
+            results[k] = foo(k)
+
+        threads = [threading.Thread(target=target, args=(k,)) for k in range(20)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual({k: k * 2 for k in range(20)}, results)
+        self.assertLess(len(calls), 20)
+        for keys in calls:
+            self.assertLessEqual(len(keys), 10)
+
+        # a lone caller only waits max_wait
+        self.assertEqual(4, foo(2))
+
+    def test_async(self):
+        calls = []
+
+        @batched(max_size=3)
+        async def foo(keys):
+            calls.append(keys)
+            return {k: str(k) for k in keys}
+
+        async def main():
+            return await asyncio.gather(*[foo(k) for k in [1, 2, 2, 3, 4]])
+
+        self.assertEqual(["1", "2", "2", "3", "4"], asyncio.run(main()))
+        self.assertEqual([[1, 2, 3], [4]], calls)
+
+        @batched
+        def bar(keys):
+            return keys
+
+        async def main():
+            return await asyncio.gather(bar(1), bar(2))
+        self.assertEqual([1, 2], asyncio.run(main()))
+
+    def test_errors(self):
+        @batched(max_wait_ms=1)
+        def foo(keys):
+            raise KeyError("bulk failed")
+
+        with self.assertRaises(KeyError):
+            foo(1)
+
+        @batched(max_wait_ms=1)
+        def foo(keys):
+            return [1, 2, 3]
+
+        with self.assertRaises(ValueError):
+            foo(1)
+
+        @batched(max_wait_ms=1)
+        def foo(keys):
+            return {}
+
+        with self.assertRaises(KeyError):
+            foo(1)
+
+
+class WriteBehindTest(TestCase):
+    def test_flush_every(self):
+        writes = []
+        event = threading.Event()
+        def bulk(calls):
+            writes.append([args[0] for args, kwargs in calls])
+            event.set()
+
+        @write_behind(flush_every=3, flush_interval=10, bulk=bulk)
+        def foo(v):
+            raise RuntimeError("this shouldn't be called")
+
+        for v in range(3):
+            self.assertIsNone(foo(v))
+
+        self.assertTrue(event.wait(2))
+        self.assertEqual([[0, 1, 2]], writes)
+
+        foo(3)
+        foo.writer.close()
+        self.assertEqual([[0, 1, 2], [3]], writes)
+
+        # calls after close are written immediately
+        foo(4)
+        self.assertEqual([4], writes[-1])
+
+    def test_flush_interval(self):
+        calls = []
+        event = threading.Event()
+
+        @write_behind(flush_interval=0.01)
+        def foo(v, k=None):
+            calls.append((v, k))
+            event.set()
+
+        foo(1, k=2)
+        self.assertTrue(event.wait(2))
+        self.assertEqual([(1, 2)], calls)
+        foo.writer.close()
+
+    def test_backpressure(self):
+        started = threading.Event()
+        release = threading.Event()
+        def bulk(items):
+            started.set()
+            release.wait(2)
+
+        wb = WriteBehind(bulk, flush_every=1, maxsize=1, timeout=0.01)
+        wb.put(1) # picked up by the thread which then blocks in bulk
+        self.assertTrue(started.wait(2))
+        wb.put(2) # fills the buffer
+        with self.assertRaises(queue.Full):
+            wb.put(3)
+
+        release.set()
+        wb.close()
+
+    def test_on_error(self):
+        errors = []
+        wb = WriteBehind(
+            lambda items: 1/0,
+            on_error=lambda e, items: errors.append((e, items)),
+        )
+        wb.put(1)
+        wb.close()
+        self.assertEqual(1, len(errors))
+        self.assertTrue(isinstance(errors[0][0], ZeroDivisionError))
+        self.assertEqual([1], errors[0][1])
+
+    def test_on_error_raises(self):
+        written = []
+        def bulk(items):
+            if 1 in items:
+                raise ValueError()
+            written.extend(items)
+
+        def on_error(e, items):
+            raise KeyError()
+
+        wb = WriteBehind(bulk, flush_every=1, flush_interval=0.01, maxsize=2, on_error=on_error)
+        with self.assertLogs("decorators.batching", "ERROR"):
+            wb.put(1)
+            # the thread is still writing so the buffer doesn't fill up
+            for i in range(2, 10):
+                wb.put(i)
+            self.assertTrue(wait_for(lambda: len(written) == 8))
+        self.assertTrue(wb.thread.is_alive())
+        wb.close()
+
+    def test_close_dead_thread(self):
+        wb = WriteBehind(lambda items: None, maxsize=1)
+        wb.start()
+        wb.queue.put(wb.stop)
+        wb.thread.join(2)
+
+        # nothing is emptying the full buffer, close() still returns
+        wb.queue.put(1)
+        wb.close()
+        self.assertTrue(wb.queue.empty())
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.005)
+    return condition()
+
+
+class DebounceTest(TestCase):
+    def test_threads(self):
+        calls = []
+
+        @debounce(wait=0.05)
+        def foo(v):
+            calls.append(v)
+
+        for i in range(100):
+            self.assertIsNone(foo(i))
+        self.assertEqual([], calls)
+
+        self.assertTrue(wait_for(lambda: calls))
+        time.sleep(0.1)
+        self.assertEqual([99], calls)
+
+    def test_flush(self):
+        calls = []
+
+        @debounce(wait=10)
+        def foo(v):
+            calls.append(v)
+            return v
+
+        foo(1)
+        foo(2)
+        self.assertEqual(2, foo.flush())
+        self.assertEqual([2], calls)
+        self.assertIsNone(foo.flush())
+
+        foo(3)
+        foo.cancel()
+        self.assertIsNone(foo.flush())
+        self.assertEqual([2], calls)
+
+    def test_async(self):
+        calls = []
+
+        @debounce(wait=0.02)
+        async def foo(v):
+            calls.append(v)
+
+        async def main():
+            for i in range(10):
+                await foo(i)
+            self.assertEqual([], calls)
+            await asyncio.sleep(0.1)
+
+            await foo(10)
+            await foo(11)
+            await foo.flush()
+
+        asyncio.run(main())
+        self.assertEqual([9, 11], calls)
+
+
+class ThrottleTest(TestCase):
+    def test_threads(self):
+        calls = []
+
+        @throttle(interval=0.1)
+        def foo(v):
+            calls.append(v)
+            return v
+
+        self.assertEqual(0, foo(0))
+        for i in range(1, 50):
+            self.assertIsNone(foo(i))
+        self.assertEqual([0], calls)
+
+        self.assertTrue(wait_for(lambda: len(calls) == 2))
+        self.assertEqual([0, 49], calls)
+
+        # the trailing call started a new interval
+        self.assertIsNone(foo(50))
+        self.assertTrue(wait_for(lambda: len(calls) == 3))
+        self.assertEqual(50, calls[-1])
+
+    def test_no_trailing(self):
+        calls = []
+
+        @throttle(interval=0.05, trailing=False)
+        def foo(v):
+            calls.append(v)
+
+        foo(1)
+        foo(2)
+        time.sleep(0.1)
+        foo(3)
+        self.assertEqual([1, 3], calls)
+
+    def test_no_leading(self):
+        calls = []
+
+        @throttle(interval=0.05, leading=False)
+        def foo(v):
+            calls.append(v)
+
+        foo(1)
+        foo(2)
+        self.assertEqual([], calls)
+        self.assertTrue(wait_for(lambda: calls))
+        self.assertEqual([2], calls)
+
+    def test_async(self):
+        calls = []
+
+        @throttle(interval=0.05)
+        async def foo(v):
+            calls.append(v)
+            return v
+
+        async def main():
+            self.assertEqual(0, await foo(0))
+            for i in range(1, 10):
+                self.assertIsNone(await foo(i))
+            await asyncio.sleep(0.1)
+
+        asyncio.run(main())
+        self.assertEqual([0, 9], calls)
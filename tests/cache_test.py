@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, division, print_function, absolute_import
+import os
+import threading
+
+from decorators.compat import *
+from decorators.cache import SharedCache
+from decorators.misc import once
+
+from . import TestCase, testdata
+
+
+class SharedCacheTest(TestCase):
+    def get_cache(self, **kwargs):
+        cache = SharedCache(testdata.get_ascii(16), **kwargs)
+        def cleanup():
+            cache.unlink()
+            cache.close()
+        self.addCleanup(cleanup)
+        return cache
+
+    def fork(self, target):
+        """run target in a forked child and return what it wrote to the pipe"""
+        r, w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                os.write(w, String(target()).encode("utf-8"))
+            finally:
+                os._exit(0)
+
+        os.close(w)
+        os.waitpid(pid, 0)
+        with os.fdopen(r) as fp:
+            return fp.read()
+
+    def test_get_set_delete(self):
+        cache = self.get_cache(slots=16, slot_size=64)
+
+        with self.assertRaises(KeyError):
+            cache.get("foo")
+
+        self.assertTrue(cache.set("foo", {"bar": 1}))
+        self.assertEqual({"bar": 1}, cache.get("foo"))
+
+        cache.delete("foo")
+        with self.assertRaises(KeyError):
+            cache.get("foo")
+
+        # too big and unpicklable values aren't cached
+        self.assertFalse(cache.set("foo", "x" * 100))
+        self.assertFalse(cache.set("foo", lambda: 1))
+        with self.assertRaises(KeyError):
+            cache.get("foo")
+
+        cache.set("foo", 1)
+        cache.clear()
+        with self.assertRaises(KeyError):
+            cache.get("foo")
+
+    def test_same_name(self):
+        cache = self.get_cache()
+        cache.set("foo", 1)
+
+        cache2 = SharedCache(cache.name)
+        self.addCleanup(cache2.close)
+        self.assertEqual(1, cache2.get("foo"))
+
+    def test_fork(self):
+        cache = self.get_cache()
+        calls = []
+
+        @once(backend=cache)
+        def foo(v):
+            calls.append(v)
+            return v + 1
+
+        # the child computes the value and the parent uses it
+        self.assertEqual("2", self.fork(lambda: foo(1)))
+        self.assertEqual(2, foo(1))
+        self.assertEqual([], calls)
+
+        self.assertEqual(3, foo(2))
+        self.assertEqual("3", self.fork(lambda: foo(2)))
+        self.assertEqual([2], calls)
+
+    def test_fork_locks(self):
+        cache = self.get_cache()
+        cache.set("foo", 1)
+
+        # a lock held by another thread while forking is replaced in the child
+        lock = cache.locks[cache.get_slot("foo")[1] % len(cache.locks)]
+        lock.acquire()
+        try:
+            self.assertEqual("1", self.fork(lambda: cache.get("foo")))
+
+        finally:
+            lock.release()
+
+    def test_once_scope(self):
+        calls = []
+
+        @once(scope="shared")
+        def foo(v):
+            calls.append(v)
+            return v
+        self.addCleanup(foo.cache.close)
+        self.addCleanup(foo.cache.unlink)
+
+        self.assertTrue(isinstance(foo.cache, SharedCache))
+        self.assertEqual(1, foo(1))
+        self.assertEqual(1, foo(1))
+        self.assertEqual([1], calls)
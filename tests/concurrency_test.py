@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, division, print_function, absolute_import
+import asyncio
+import threading
+import inspect
+import itertools
+import time
+from concurrent.futures import Future
+
+from decorators.compat import *
+from decorators.concurrency import (
+    Pools,
+    pools,
+    offload,
+    parallel_map,
+    Hedger,
+    hedge,
+)
+
+from . import TestCase, testdata
+
+
+pools.configure("test-process", max_workers=2, kind="process")
+
+
+@offload(pool="test-process", future=True)
+def process_add(v1, v2):
+    import os
+    return v1 + v2, os.getpid()
+
+
+@parallel_map(workers=2)
+def process_double(v):
+    return v * 2
+
+
+class PoolsTest(TestCase):
+    def test_lifecycle(self):
+        ps = Pools()
+        ps.configure("foo", max_workers=2)
+        e = ps.get("foo")
+        self.assertEqual(2, e._max_workers)
+        self.assertIs(e, ps.get("foo"))
+
+        with self.assertRaises(ValueError):
+            ps.configure("foo", max_workers=3)
+
+        with self.assertRaises(ValueError):
+            ps.configure("bar", kind="fiber")
+
+        ps.shutdown()
+        self.assertIsNot(e, ps.get("foo"))
+        ps.shutdown()
+
+
+class OffloadTest(TestCase):
+    def test_async(self):
+        @offload(pool="test-io")
+        def foo(v):
+            return v, threading.current_thread().name
+
+        async def main():
+            return await foo(1)
+
+        v, name = asyncio.run(main())
+        self.assertEqual(1, v)
+        self.assertTrue(name.startswith("decorators-test-io"))
+
+        # outside of an event loop the function is just called
+        v, name = foo(2)
+        self.assertEqual(2, v)
+        self.assertEqual(threading.current_thread().name, name)
+
+    def test_future(self):
+        @offload(pool="test-io", future=True)
+        def foo(v):
+            return v
+
+        f = foo(3)
+        self.assertTrue(isinstance(f, Future))
+        self.assertEqual(3, f.result())
+
+    def test_process(self):
+        import os
+        v, pid = process_add(1, 2).result()
+        self.assertEqual(3, v)
+        self.assertNotEqual(os.getpid(), pid)
+
+    def test_coroutine(self):
+        with self.assertRaises(ValueError):
+            @offload()
+            async def foo():
+                pass
+
+
+class ParallelMapTest(TestCase):
+    def test_process(self):
+        r = process_double(range(100))
+        self.assertTrue(inspect.isgenerator(r))
+        self.assertEqual([v * 2 for v in range(100)], list(r))
+
+    def test_thread(self):
+        import time
+
+        @parallel_map(pool="test-io", ordered=False, chunksize=1)
+        def foo(v, offset=0):
+            # make the first item finish last
+            if v == 0:
+                time.sleep(0.1)
+            return v + offset
+
+        r = list(foo(range(5), offset=1))
+        self.assertEqual([1, 2, 3, 4, 5], sorted(r))
+        self.assertEqual(1, r[-1])
+
+        @parallel_map(pool="test-io")
+        def foo(v):
+            return v
+        r = list(foo(iter(range(1000))))
+        self.assertEqual(list(range(1000)), r)
+
+    def test_chunksize(self):
+        pm = parallel_map(pool="test-io")
+        self.assertEqual(2, pm.get_chunksize(1, 1, 0.0))
+        self.assertEqual(4, pm.get_chunksize(2, 2, 0.00001))
+        self.assertEqual(1, pm.get_chunksize(8, 8, 10.0))
+
+
+class HedgeTest(TestCase):
+    def test_hedger(self):
+        hedger = Hedger("foo", after="p50", min_samples=2)
+        hedger.refresh = 0
+        self.assertIsNone(hedger.get_delay())
+        hedger.record(0.01)
+        hedger.record(0.01)
+        self.assertAlmostEqual(0.01, hedger.get_delay(), delta=0.001)
+
+        self.assertEqual(0.02, Hedger("foo", after=20).get_delay())
+        with self.assertRaises(ValueError):
+            Hedger("foo", after="95")
+
+    def test_window(self):
+        hedger = Hedger("foo", after="p50", min_samples=2)
+        hedger.refresh = 0
+        hedger.record(1.0)
+        hedger.record(1.0)
+        self.assertAlmostEqual(1.0, hedger.get_delay(), delta=0.1)
+
+        # the old window is used until the new one has enough latencies
+        hedger.rotated -= hedger.window
+        self.assertAlmostEqual(1.0, hedger.get_delay(), delta=0.1)
+        hedger.record(0.01)
+        self.assertAlmostEqual(1.0, hedger.get_delay(), delta=0.1)
+        hedger.record(0.01)
+        self.assertAlmostEqual(0.01, hedger.get_delay(), delta=0.001)
+
+        # and then old latencies stop counting
+        hedger.rotated -= hedger.window
+        hedger.get_delay()
+        hedger.rotated -= hedger.window
+        self.assertIsNone(hedger.get_delay())
+
+    def test_budget(self):
+        hedger = Hedger("foo", after=1, budget=0.5)
+        hedges = [hedger.take_hedge() for _ in range(int(hedger.burst) + 1)]
+        self.assertEqual(int(hedger.burst), sum(hedges))
+        self.assertFalse(hedges[-1])
+
+        for _ in range(4):
+            hedger.add_call()
+        self.assertEqual([True, True, False], [hedger.take_hedge() for _ in range(3)])
+
+    def test_queued(self):
+        """time spent waiting for a pool thread doesn't cause a hedge"""
+        pools.configure("test-hedge-queued", max_workers=1)
+
+        @hedge(after=20, pool="test-hedge-queued")
+        def foo():
+            return 1
+
+        pools.get("test-hedge-queued").submit(time.sleep, 0.2)
+        self.assertEqual(1, foo())
+        self.assertEqual(0, foo.hedger.hedges.value)
+
+    def test_nested(self):
+        """a hedged call made on the pool doesn't wait for the pool"""
+        pools.configure("test-hedge-nested", max_workers=1)
+
+        @hedge(after=1, pool="test-hedge-nested")
+        def bar():
+            return 2
+
+        @hedge(after=1, pool="test-hedge-nested")
+        def foo():
+            return bar() + 1
+
+        f = pools.get("hedge-nested-runner").submit(foo)
+        self.assertEqual(3, f.result(timeout=2))
+
+    def test_sync(self):
+        calls = itertools.count()
+        slow = set()
+
+        @hedge(after="p90", min_samples=5)
+        def foo():
+            if next(calls) in slow:
+                time.sleep(0.5)
+                return "slow"
+            time.sleep(0.001)
+            return "fast"
+        foo.hedger.refresh = 0
+
+        for _ in range(10):
+            self.assertEqual("fast", foo())
+
+        slow.add(10)
+        start = time.monotonic()
+        self.assertEqual("fast", foo())
+        self.assertLess(time.monotonic() - start, 0.25)
+        self.assertEqual(1, foo.hedger.hedges.value)
+        self.assertEqual(1, foo.hedger.wins.value)
+
+    def test_error(self):
+        @hedge(after=1)
+        def foo():
+            raise ValueError()
+
+        with self.assertRaises(ValueError):
+            foo()
+
+    def test_async(self):
+        calls = itertools.count()
+        cancelled = []
+
+        @hedge(after=20)
+        async def foo():
+            if next(calls) == 0:
+                try:
+                    await asyncio.sleep(0.5)
+                except asyncio.CancelledError:
+                    cancelled.append(True)
+                    raise
+                return "slow"
+            return "fast"
+
+        async def main():
+            start = time.monotonic()
+            ret = await foo()
+            await asyncio.sleep(0)
+            return ret, time.monotonic() - start
+
+        ret, elapsed = asyncio.run(main())
+        self.assertEqual("fast", ret)
+        self.assertLess(elapsed, 0.25)
+        self.assertEqual([True], cancelled)
+        self.assertEqual(1, foo.hedger.wins.value)
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, division, print_function, absolute_import
+import asyncio
+import time
+
+from decorators.compat import *
+from decorators.instrument import get_counter
+from decorators.diagnostics import (
+    Watchdog,
+    RateLimit,
+    slow_call,
+    blocking,
+)
+
+from . import TestCase, testdata
+
+
+class WatchdogTest(TestCase):
+    def test_idle(self):
+        """the thread only samples while there are calls to watch"""
+        w = Watchdog()
+        samples = []
+        sample = w.sample
+        def counted():
+            samples.append(1)
+            sample()
+        w.sample = counted
+
+        w.watch(0.002)
+        time.sleep(0.05)
+        self.assertEqual(0, len(samples))
+
+        call = w.add(0.002)
+        time.sleep(0.05)
+        w.remove(call)
+        self.assertLess(0, len(samples))
+        self.assertIsNotNone(call.stack)
+
+        time.sleep(0.01)
+        count = len(samples)
+        time.sleep(0.05)
+        self.assertEqual(count, len(samples))
+        self.assertFalse(w.busy.is_set())
+
+
+class SlowCallTest(TestCase):
+    def test_threshold(self):
+        events = []
+
+        @slow_call(threshold_ms=10, callback=events.append)
+        def foo(duration, name="bar"):
+            time.sleep(duration)
+            return 1
+
+        self.assertEqual(1, foo(0))
+        self.assertEqual(0, len(events))
+
+        with self.assertLogs("decorators.diagnostics", "WARNING") as c:
+            self.assertEqual(1, foo(0.02, name="x" * 1000))
+        self.assertTrue("Slow call" in c.output[0])
+        self.assertEqual(events[0], c.records[0].slow_call)
+
+        event = events[0]
+        self.assertTrue(event["function"].endswith("foo"))
+        self.assertLessEqual(20, event["elapsed_ms"])
+        self.assertEqual(10, event["threshold_ms"])
+        self.assertEqual(["0.02"], event["args"])
+        self.assertLess(len(event["kwargs"]["name"]), 100)
+        self.assertFalse("stack" in event)
+
+    def test_error(self):
+        events = []
+
+        @slow_call(threshold_ms=1, callback=events.append)
+        def foo():
+            time.sleep(0.01)
+            raise ValueError("boom")
+
+        with self.assertRaises(ValueError):
+            foo()
+        self.assertEqual("ValueError: boom", events[0]["error"])
+
+    def test_stack(self):
+        events = []
+
+        def stuck_here():
+            time.sleep(0.05)
+
+        @slow_call(threshold_ms=10, stack=True, callback=events.append)
+        def foo():
+            stuck_here()
+
+        foo()
+        stack = "".join(events[0]["stack"])
+        self.assertTrue("stuck_here" in stack)
+
+    def test_rate_limit(self):
+        events = []
+
+        @slow_call(threshold_ms=1, interval=60, callback=events.append)
+        def foo():
+            time.sleep(0.002)
+
+        for _ in range(3):
+            foo()
+        self.assertEqual(1, len(events))
+
+        limit = RateLimit(0)
+        self.assertEqual(0, limit.allow())
+        limit = RateLimit(60)
+        self.assertEqual(0, limit.allow())
+        self.assertIsNone(limit.allow())
+        self.assertIsNone(limit.allow())
+        limit.last -= 60
+        self.assertEqual(2, limit.allow())
+
+    def test_async(self):
+        events = []
+
+        @slow_call(threshold_ms=10, callback=events.append)
+        async def foo():
+            await asyncio.sleep(0.02)
+            return 1
+
+        self.assertEqual(1, asyncio.run(foo()))
+        self.assertEqual(1, len(events))
+
+
+class BlockingTest(TestCase):
+    def test_loop(self):
+        events = []
+
+        @blocking(threshold_ms=10, callback=events.append)
+        def foo(duration):
+            time.sleep(duration)
+            return 1
+
+        # there isn't a loop so nothing is reported
+        self.assertEqual(1, foo(0.02))
+        self.assertEqual(0, len(events))
+
+        async def main():
+            return foo(0.02)
+
+        async def run():
+            return await asyncio.create_task(main(), name="main-task")
+
+        with self.assertLogs("decorators.diagnostics", "WARNING") as c:
+            self.assertEqual(1, asyncio.run(run()))
+
+        event = events[0]
+        self.assertEqual("main-task", event["task"])
+        self.assertTrue(event["coroutine"].endswith("main"))
+        self.assertTrue("offload" in event["suggestion"])
+        self.assertTrue("main-task" in c.output[0])
+
+        counter = get_counter("decorators_loop_blocked_total", function=event["function"])
+        self.assertEqual(1, counter.value)
+
+    def test_offload(self):
+        @blocking(offload=True)
+        def foo():
+            time.sleep(0.01)
+            return 1
+
+        async def main():
+            return await foo()
+
+        self.assertEqual(1, asyncio.run(main()))
+        self.assertEqual(1, foo())
+
+        with self.assertRaises(ValueError):
+            @blocking
+            async def bar(): pass
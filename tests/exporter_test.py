@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, division, print_function, absolute_import
+from urllib.request import urlopen
+from urllib.error import HTTPError
+
+from decorators.compat import *
+from decorators.exporter import Exporter
+from decorators.instrument import timed
+from decorators import once, property
+
+from . import TestCase, testdata
+
+
+class ExporterTest(TestCase):
+    def test_render(self):
+        @timed(name='exporter"test')
+        def foo():
+            pass
+        foo()
+        foo()
+
+        @once
+        def bar(v):
+            return v
+        bar(1)
+        bar(1)
+        bar(2)
+
+        class Che(object):
+            @property(cached="_baz")
+            def baz(self):
+                return 1
+        c = Che()
+        c.baz
+        c.baz
+        del c.baz
+
+        text = Exporter().render()
+        self.assertTrue("# TYPE decorators_latency_seconds summary" in text)
+        self.assertTrue('decorators_calls_total{function="exporter\\"test"} 2' in text)
+        self.assertTrue('decorators_latency_seconds_count{function="exporter\\"test"} 2' in text)
+        self.assertTrue('decorators_latency_seconds{function="exporter\\"test",quantile="0.99"}' in text)
+
+        name = bar.__wrapped__.__qualname__
+        self.assertTrue('decorators_cache_hits_total{{decorator="once",function="{}.{}"}} 1'.format(
+            __name__,
+            name,
+        ) in text)
+        self.assertTrue('decorators_cache_misses_total{{decorator="once",function="{}.{}"}} 2'.format(
+            __name__,
+            name,
+        ) in text)
+
+        name = "{}.{}".format(__name__, Che.baz.fget.__qualname__)
+        self.assertTrue('decorators_cache_evictions_total{{decorator="property",function="{}"}} 1'.format(
+            name,
+        ) in text)
+
+    def test_server(self):
+        exporter = Exporter(port=0).start()
+        try:
+            host, port = exporter.address
+            res = urlopen("http://{}:{}/metrics".format(host, port))
+            self.assertEqual(200, res.status)
+            self.assertTrue(res.headers["Content-Type"].startswith("text/plain"))
+            res.read()
+
+            with self.assertRaises(HTTPError):
+                urlopen("http://{}:{}/foo".format(host, port))
+
+        finally:
+            exporter.stop()
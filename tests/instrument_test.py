@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, division, print_function, absolute_import
+import asyncio
+import threading
+
+from decorators.compat import *
+from decorators.instrument import (
+    histograms,
+    Counter,
+    Histogram,
+    Sampler,
+    timed,
+)
+
+from . import TestCase, testdata
+
+
+class HistogramTest(TestCase):
+    def test_buckets(self):
+        h = Histogram()
+        for v in [0, 1, 31, 32, 33, 1000, 123456789, 2 ** 41]:
+            index = h.get_index(v)
+            self.assertLessEqual(h.get_value(index), v)
+            self.assertLess(v, h.get_value(index + 1))
+            # values are accurate to the bucket's precision
+            self.assertLessEqual(v - h.get_value(index), v / 2 ** h.sub_bits)
+
+        self.assertLess(h.get_index(2 ** 42), h.size)
+
+    def test_snapshot(self):
+        h = Histogram()
+        for v in range(1, 1001):
+            h.record(v * 1000)
+        h.record(2 ** 50, error=True)
+
+        s = h.snapshot()
+        self.assertEqual(1001, s.count)
+        self.assertEqual(1, s.errors)
+        self.assertAlmostEqual(0.0005, s.p50, delta=0.0005 / 16)
+        self.assertAlmostEqual(0.00099, s.p99, delta=0.00099 / 16)
+        self.assertEqual(2 ** 50 / 1e9, s.max)
+        self.assertEqual(1001, sum(w["count"] for w in s.windows))
+
+    def test_threads(self):
+        h = Histogram()
+        def target():
+            for v in range(1000):
+                h.record(v)
+
+        threads = [threading.Thread(target=target) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(4, len(h.stripes))
+        self.assertEqual(4000, h.snapshot().count)
+
+    def test_short_threads(self):
+        """the stripes of finished threads are folded so they don't pile up"""
+        h = Histogram()
+        c = Counter("foo")
+        def target():
+            h.record(1000, error=True)
+            c.inc()
+
+        for _ in range(500):
+            t = threading.Thread(target=target)
+            t.start()
+            t.join()
+
+        self.assertLessEqual(len(h.stripes), h.fold_size + 1)
+        self.assertLessEqual(len(c.cells), c.fold_size + 1)
+
+        s = h.snapshot()
+        self.assertEqual(0, len(h.stripes))
+        self.assertEqual(500, s.count)
+        self.assertEqual(500, s.errors)
+        self.assertEqual(500, sum(w["count"] for w in s.windows))
+        self.assertEqual(500, c.value)
+        self.assertEqual(0, len(c.cells))
+
+        # a thread that is still running keeps its stripe
+        h.record(1000)
+        self.assertEqual(501, h.snapshot().count)
+        self.assertEqual(1, len(h.stripes))
+
+
+class SamplerTest(TestCase):
+    def test_adjust(self):
+        s = Sampler(max_rate=100)
+        self.assertEqual(1, s.every)
+
+        # every can only grow max_growth times each adjustment
+        s.start -= 1.0
+        s.adjust(10000)
+        self.assertEqual(10, s.every)
+
+        s.start -= 1.0
+        s.adjust(20000)
+        self.assertAlmostEqual(100, s.every, delta=1)
+
+        s.start -= 2.0
+        s.adjust(20100)
+        self.assertEqual(1, s.every)
+
+        with self.assertRaises(ValueError):
+            Sampler(0)
+
+    def test_after_burst(self):
+        @timed(max_rate=100)
+        def foo():
+            pass
+
+        # a burst left the sampler sampling 1 of every 5922 calls
+        sampler = foo.sampler
+        sampler.every = 5922
+        sampler.start -= 1.0
+        sampler.deadline = 0
+        for _ in range(sampler.check_every - 1):
+            foo()
+        self.assertEqual(5922, sampler.every)
+
+        # the first clock check after the deadline adjusted it even though the
+        # call wasn't sampled, so the slower calls are sampled again
+        for _ in range(100):
+            foo()
+        self.assertLess(sampler.every, 100)
+        self.assertTrue(foo.histogram.snapshot().count > 0)
+
+
+class TimedTest(TestCase):
+    def test_func(self):
+        @timed
+        def foo(v):
+            if v:
+                raise ValueError(v)
+            return v
+
+        foo(0)
+        foo(0)
+        with self.assertRaises(ValueError):
+            foo(1)
+
+        s = foo.histogram.snapshot()
+        self.assertEqual(3, s.count)
+        self.assertEqual(1, s.errors)
+        self.assertTrue(foo.histogram.name in histograms)
+
+        @timed(name="timed-test-bar")
+        def bar():
+            pass
+        bar()
+        self.assertEqual(1, histograms["timed-test-bar"].snapshot().count)
+
+    def test_async(self):
+        @timed
+        async def foo():
+            await asyncio.sleep(0.01)
+            return 1
+
+        self.assertEqual(1, asyncio.run(foo()))
+        s = foo.histogram.snapshot()
+        self.assertEqual(1, s.count)
+        self.assertGreaterEqual(s.max, 0.01)
+
+    def test_sample_rate(self):
+        @timed(sample_rate=0.1)
+        def foo(v):
+            if v:
+                raise ValueError()
+
+        for _ in range(100):
+            foo(0)
+
+        for _ in range(10):
+            with self.assertRaises(ValueError):
+                foo(1)
+
+        s = foo.histogram.snapshot()
+        self.assertEqual(110, s.count)
+        self.assertEqual(11, s.samples)
+        self.assertEqual(10, s.errors)
+
+        @timed(sample_rate=0.5)
+        async def bar():
+            pass
+
+        async def main():
+            for _ in range(10):
+                await bar()
+        asyncio.run(main())
+        s = bar.histogram.snapshot()
+        self.assertEqual(10, s.count)
+        self.assertEqual(5, s.samples)
+
+        @timed
+        def che():
+            pass
+        self.assertIsNone(che.sampler)
@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, division, print_function, absolute_import
+import array
+import datetime
+import dataclasses
+import os
+import subprocess
+import sys
+
+from decorators.compat import *
+from decorators.keys import (
+    get_key,
+    get_hash,
+    canonicalizer,
+    canonicalizers,
+    UnstableKeyError,
+    IdentityKey,
+    benchmark,
+)
+from decorators.misc import once
+
+from . import TestCase, testdata
+
+
+def foo(*args, **kwargs):
+    pass
+
+
+class Point(object):
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+
+@dataclasses.dataclass
+class Pair(object):
+    left: int
+    right: str
+
+
+class GetKeyTest(TestCase):
+    def test_processes(self):
+        """keys are the same in processes with different hash seeds"""
+        code = "\n".join([
+            "from decorators.keys import get_key",
+            "from tests.keys_test import foo",
+            "print(get_key(foo, ('one', 2, 3.0, None, b'four'), {'five': {'six', 'seven'}}))",
+        ])
+        keys = set()
+        for seed in ["1", "2"]:
+            env = dict(os.environ, PYTHONHASHSEED=seed)
+            output = subprocess.check_output([sys.executable, "-c", code], env=env)
+            keys.add(output.decode("utf-8").strip())
+
+        self.assertEqual(1, len(keys))
+        self.assertEqual(
+            get_key(foo, ("one", 2, 3.0, None, b"four"), {"five": {"six", "seven"}}),
+            keys.pop(),
+        )
+        self.assertTrue(get_key(foo, (), {}).startswith("tests.keys_test.foo:"))
+
+    def test_canonical(self):
+        # order of dicts and sets doesn't matter
+        self.assertEqual(
+            get_key(foo, ({"a": 1, "b": 2},), {"c": 3, "d": 4}),
+            get_key(foo, ({"b": 2, "a": 1},), {"d": 4, "c": 3}),
+        )
+        self.assertEqual(
+            get_key(foo, ({3, 1, 2},), {}),
+            get_key(foo, ({1, 2, 3},), {}),
+        )
+
+        # but types and positions do
+        values = [1, "1", 1.0, True, b"1", (1,), [1], None, ("a", "b"), ("ab",)]
+        keys = set(get_key(foo, (v,), {}) for v in values)
+        self.assertEqual(len(values), len(keys))
+        self.assertNotEqual(get_key(foo, (1, 2), {}), get_key(foo, (2, 1), {}))
+        self.assertNotEqual(get_key(foo, (1,), {}), get_key(foo, (), {"a": 1}))
+
+        # bytes-like values are the same as their bytes
+        self.assertEqual(get_key(foo, (b"ab",), {}), get_key(foo, (bytearray(b"ab"),), {}))
+
+        # known types and dataclasses
+        d = datetime.datetime(2020, 1, 2, 3, 4, 5)
+        self.assertEqual(get_key(foo, (d,), {}), get_key(foo, (d.replace(),), {}))
+        self.assertEqual(
+            get_key(foo, (Pair(1, "2"),), {}, strict=True),
+            get_key(foo, (Pair(1, "2"),), {}, strict=True),
+        )
+        self.assertNotEqual(get_key(foo, (Pair(1, "2"),), {}), get_key(foo, (Pair(2, "2"),), {}))
+
+    def test_strict(self):
+        with self.assertRaises(UnstableKeyError):
+            get_key(foo, (Point(1, 2),), {}, strict=True)
+
+        # without strict the object is keyed by its hash
+        p = Point(1, 2)
+        self.assertEqual(get_key(foo, (p,), {}), get_key(foo, (p,), {}))
+        self.assertNotEqual(get_key(foo, (p,), {}), get_key(foo, (Point(1, 2),), {}))
+
+    def test_strict_functions(self):
+        self.assertEqual(
+            get_key(foo, (foo, Point), {}, strict=True),
+            get_key(foo, (foo, Point), {}, strict=True),
+        )
+
+        # lambdas and closures don't have a name of their own
+        def get_closure(v):
+            def closure():
+                return v
+            return closure
+
+        for func in [lambda: 1, get_closure(1)]:
+            with self.assertRaises(UnstableKeyError):
+                get_key(foo, (func,), {}, strict=True)
+
+        l1 = lambda: 1
+        l2 = lambda: 2
+        self.assertNotEqual(get_key(foo, (l1,), {}), get_key(foo, (l2,), {}))
+
+    def test_canonicalizer(self):
+        self.addCleanup(canonicalizers.pop, Point, None)
+
+        @canonicalizer(Point)
+        def canonicalize_point(p):
+            return (p.x, p.y)
+
+        self.assertEqual(
+            get_key(foo, (Point(1, 2),), {}, strict=True),
+            get_key(foo, (Point(1, 2),), {}, strict=True),
+        )
+        self.assertNotEqual(
+            get_key(foo, (Point(1, 2),), {}),
+            get_key(foo, ((1, 2),), {}),
+        )
+
+    def test_once(self):
+        calls = []
+
+        @once(key="strict")
+        def bar(v):
+            calls.append(v)
+            return v
+
+        bar(1)
+        bar(1)
+        self.assertEqual([1], calls)
+        self.assertEqual(1, bar.cache.get(get_key(bar.__wrapped__, (1,), {})))
+
+        with self.assertRaises(UnstableKeyError):
+            bar(Point(1, 2))
+
+        @once(key=lambda f, args, kwargs: "same")
+        def che(v):
+            return v
+        self.assertEqual(1, che(1))
+        self.assertEqual(1, che(2))
+
+        with self.assertRaises(ValueError):
+            @once(key="nope")
+            def baz(): pass
+
+    def test_buffers(self):
+        a = array.array("d", [1.0, 2.0])
+        self.assertEqual(get_key(foo, (a,), {}), get_key(foo, (array.array("d", [1.0, 2.0]),), {}))
+        # the same bytes in a different type aren't the same key
+        self.assertNotEqual(get_key(foo, (a,), {}), get_key(foo, (a.tobytes(),), {}))
+
+        # non-contiguous views are keyed by their contents
+        view = memoryview(b"abcd")[::2]
+        self.assertEqual(get_key(foo, (view,), {}), get_key(foo, (b"ac",), {}))
+
+        b = bytearray(b"foo")
+        k = get_key(foo, (b,), {})
+        b[0] = ord("b")
+        self.assertNotEqual(k, get_key(foo, (b,), {}))
+
+
+class GetHashTest(TestCase):
+    def test_unhashable(self):
+        self.assertEqual(str(hash("foo")), get_hash("foo"))
+        self.assertEqual(get_hash([1, {"a": [2]}]), get_hash([1, {"a": [2]}]))
+        self.assertNotEqual(get_hash([1, 2]), get_hash([2, 1]))
+        self.assertEqual(get_hash((1, [2])), get_hash((1, [2])))
+
+        class Unhashable(object):
+            __hash__ = None
+            def __init__(self, v):
+                self.v = v
+
+        self.assertEqual(get_hash(Unhashable([1])), get_hash(Unhashable([1])))
+        self.assertNotEqual(get_hash(Unhashable([1])), get_hash(Unhashable([2])))
+
+
+class IdentityKeyTest(TestCase):
+    def test_call(self):
+        key = IdentityKey()
+        l = [1, 2]
+        self.assertEqual(key(foo, (l, 1), {"a": "b"}), key(foo, (l, 1), {"a": "b"}))
+        self.assertNotEqual(key(foo, (l,), {}), key(foo, ([1, 2],), {}))
+        self.assertIs(l, key.cache.get("@{}".format(id(l))))
+
+    def test_once_scope(self):
+        import gc
+        import weakref
+        from decorators.cache import once_scope
+
+        class Big(object):
+            pass
+
+        calls = []
+
+        @once(scope="context", key="identity")
+        def bar(v):
+            calls.append(v)
+            return 1
+
+        with once_scope():
+            b = Big()
+            r = weakref.ref(b)
+            bar(b)
+            bar(b)
+            self.assertEqual(1, len(calls))
+            del b
+            calls[:] = []
+            gc.collect()
+            # the cached key keeps the argument alive for the rest of the scope
+            self.assertIsNotNone(r())
+
+        gc.collect()
+        self.assertIsNone(r())
+
+        with self.assertRaises(ValueError):
+            @once(scope="shared", key="identity")
+            def che(v): pass
+
+
+class BenchmarkTest(TestCase):
+    def test_benchmark(self):
+        rows = benchmark(number=1)
+        self.assertEqual(set(["hash", "stable", "identity"]), set(r[1] for r in rows))
+        for name, mode, micros in rows:
+            self.assertTrue(micros > 0)
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, division, print_function, absolute_import
+import asyncio
+import os
+import threading
+import time
+
+from decorators.compat import *
+from decorators.limits import (
+    limit,
+    Overloaded,
+    Bucket,
+    SharedBucket,
+    rate_limit,
+    RateLimited,
+)
+
+from . import TestCase, testdata
+
+
+class LimitTest(TestCase):
+    def test_sync(self):
+        release = threading.Event()
+        started = threading.Semaphore(0)
+
+        @limit(concurrency=2, queue=1)
+        def foo():
+            started.release()
+            release.wait()
+            return 1
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(foo())) for _ in range(3)]
+        for t in threads:
+            t.start()
+
+        # wait for 2 to be running and 1 to be queued
+        started.acquire()
+        started.acquire()
+        for _ in range(100):
+            if foo.limiter.waiting:
+                break
+            time.sleep(0.01)
+
+        with self.assertRaises(Overloaded) as cm:
+            foo()
+        self.assertEqual("queue_full", cm.exception.reason)
+
+        release.set()
+        for t in threads:
+            t.join()
+
+        self.assertEqual([1, 1, 1], results)
+        self.assertEqual(0, foo.limiter.active)
+        self.assertEqual(3, foo.limiter.admitted.value)
+        self.assertEqual(1, foo.limiter.get_rejected("queue_full").value)
+        self.assertEqual(1, foo.limiter.wait.snapshot().count)
+
+    def test_sync_timeout(self):
+        release = threading.Event()
+
+        @limit(concurrency=1, queue=1, timeout=0.05)
+        def foo():
+            release.wait()
+
+        t = threading.Thread(target=foo)
+        t.start()
+        for _ in range(100):
+            if foo.limiter.active:
+                break
+            time.sleep(0.01)
+
+        with self.assertRaises(Overloaded) as cm:
+            foo()
+        self.assertEqual("timeout", cm.exception.reason)
+
+        release.set()
+        t.join()
+        self.assertEqual(0, foo.limiter.active)
+
+    def test_async(self):
+        @limit(concurrency=2, queue=2)
+        async def foo():
+            await asyncio.sleep(0.01)
+            return 1
+
+        async def main():
+            return await asyncio.gather(*[foo() for _ in range(5)], return_exceptions=True)
+
+        results = asyncio.run(main())
+        self.assertEqual(4, results.count(1))
+        self.assertIsInstance(results[-1], Overloaded)
+        self.assertEqual(0, foo.limiter.active)
+        self.assertEqual(2, foo.limiter.wait.snapshot().count)
+
+        # the limiter works in a new event loop too
+        self.assertEqual(1, asyncio.run(foo()))
+
+    def test_async_timeout(self):
+        @limit(concurrency=1, queue=1, timeout=0.01)
+        async def foo():
+            await asyncio.sleep(0.05)
+            return 1
+
+        async def main():
+            return await asyncio.gather(foo(), foo(), return_exceptions=True)
+
+        results = asyncio.run(main())
+        self.assertEqual(1, results[0])
+        self.assertEqual("timeout", results[1].reason)
+        self.assertEqual(0, foo.limiter.active)
+        self.assertEqual(0, len(foo.limiter.waiters))
+
+    def test_async_cancel(self):
+        @limit(concurrency=1, queue=1)
+        async def foo():
+            await asyncio.sleep(0.01)
+            return 1
+
+        async def main():
+            t1 = asyncio.create_task(foo())
+            t2 = asyncio.create_task(foo())
+            await asyncio.sleep(0)
+            t2.cancel()
+            await t1
+            with self.assertRaises(asyncio.CancelledError):
+                await t2
+            return await foo()
+
+        self.assertEqual(1, asyncio.run(main()))
+        self.assertEqual(0, foo.limiter.active)
+
+
+def shared_calls(name, count):
+    from decorators.limits import rate_limit
+
+    @rate_limit(rate=100, per=1.0, burst=1, shared=name)
+    def foo(): return time.monotonic()
+
+    return [foo() for _ in range(count)]
+
+
+class RateLimitTest(TestCase):
+    def test_bucket(self):
+        b = Bucket(10, per=1.0, burst=2)
+        self.assertEqual(0, b.reserve())
+        self.assertEqual(0, b.reserve())
+        # the burst is used up so the next token is 0.1 seconds away
+        self.assertAlmostEqual(0.1, b.reserve(), delta=0.01)
+        self.assertIsNone(b.reserve(0.1))
+        self.assertAlmostEqual(0.2, b.reserve(), delta=0.01)
+
+        with self.assertRaises(ValueError):
+            Bucket(0)
+
+    def test_sync(self):
+        @rate_limit(rate=100, per=1.0, burst=5)
+        def foo(): return 1
+
+        start = time.monotonic()
+        for _ in range(15):
+            foo()
+        # 5 in the burst and then 10 more at 100 a second
+        self.assertLessEqual(0.09, time.monotonic() - start)
+
+    def test_raise(self):
+        @rate_limit(rate=1, per=10.0, burst=2, block=False)
+        def foo(): return 1
+
+        foo()
+        foo()
+        with self.assertRaises(RateLimited) as cm:
+            foo()
+        self.assertEqual("rate", cm.exception.reason)
+        self.assertIsInstance(cm.exception, Overloaded)
+
+        @rate_limit(rate=10, per=1.0, burst=1, timeout=0.05)
+        def bar(): return 1
+
+        bar()
+        with self.assertRaises(RateLimited):
+            bar()
+
+    def test_threads(self):
+        @rate_limit(rate=200, per=1.0, burst=1)
+        def foo(): return time.monotonic()
+
+        times = []
+        threads = [
+            threading.Thread(target=lambda: times.extend(foo() for _ in range(5)))
+            for _ in range(4)
+        ]
+        start = time.monotonic()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(20, len(times))
+        self.assertLessEqual(0.09, max(times) - start)
+
+    def test_async(self):
+        @rate_limit(rate=100, per=1.0, burst=1)
+        async def foo(): return 1
+
+        async def main():
+            start = time.monotonic()
+            await asyncio.gather(*[foo() for _ in range(6)])
+            return time.monotonic() - start
+
+        self.assertLessEqual(0.045, asyncio.run(main()))
+
+    def test_shared(self):
+        from concurrent.futures import ProcessPoolExecutor
+        name = "test-{}".format(testdata.get_ascii(8))
+        self.addCleanup(os.remove, SharedBucket(name, 1).path)
+
+        with ProcessPoolExecutor(2) as executor:
+            futures = [executor.submit(shared_calls, name, 5) for _ in range(2)]
+            times = sorted(t for f in futures for t in f.result())
+
+        # both processes took tokens from the same bucket so the 10 calls
+        # were spread over about 90ms
+        self.assertLessEqual(0.08, times[-1] - times[0])
+
+    def test_shared_reboot(self):
+        name = "test-{}".format(testdata.get_ascii(8))
+        bucket = SharedBucket(name, 1)
+        self.addCleanup(os.remove, bucket.path)
+
+        # a tat far in the future is honored while the clock is the same
+        bucket.store(time.monotonic() + 1000)
+        self.assertIsNone(bucket.reserve(0))
+
+        # but not when it was stored before a reboot
+        tat = time.monotonic() + 1000
+        bucket.struct.pack_into(bucket.map, 0, tat, bucket.get_boot() - 3600)
+        self.assertEqual(0.0, bucket.reserve(0))
+        self.assertIsNone(bucket.reserve(0))
@@ -5,6 +5,8 @@ from collections import Counter
 from decorators.compat import *
 from decorators.misc import (
     once,
+    scoped_once,
+    once_scope,
     deprecated,
 )
 
@@ -121,6 +123,270 @@ class OnceTest(TestCase):
             InBoo.bar_method()
         self.assertFalse("bar" in c)
 
+    def test_async(self):
+        import asyncio
+        import inspect
+
+        calls = []
+
+        @once
+        async def foo(v):
+            calls.append(v)
+            return v + 1
+
+        self.assertEqual(2, asyncio.run(foo(1)))
+        self.assertEqual(2, asyncio.run(foo(1)))
+        self.assertEqual([1], calls)
+
+        @once()
+        async def bar(v):
+            return v
+        self.assertTrue(inspect.iscoroutinefunction(bar))
+
+    def test_unhashable(self):
+        calls = []
+
+        @once
+        def foo(payload, options=None):
+            calls.append(payload)
+            return len(payload)
+
+        self.assertEqual(2, foo([1, 2], options={"a": [1]}))
+        self.assertEqual(2, foo([1, 2], options={"a": [1]}))
+        self.assertEqual(1, len(calls))
+
+        self.assertEqual(1, foo({"b": {1, 2}}))
+        self.assertEqual(1, foo({"b": {2, 1}}))
+        self.assertEqual(2, len(calls))
+
+        b = bytearray(b"foo")
+        foo(b)
+        foo(b)
+        self.assertEqual(3, len(calls))
+        b.extend(b"bar")
+        self.assertEqual(6, foo(b))
+        self.assertEqual(4, len(calls))
+
+    def test_key_parts(self):
+        @once
+        def foo(*args, **kwargs):
+            return args, kwargs
+
+        self.assertEqual(((1, 23), {}), foo(1, 23))
+        self.assertEqual(((12, 3), {}), foo(12, 3))
+        self.assertEqual(((1,), {"a": 23}), foo(1, a=23))
+        self.assertEqual(((), {"a": 1, "b": 2}), foo(a=1, b=2))
+        self.assertEqual(((), {"a": 1, "b": 2}), foo(b=2, a=1))
+
+    def test_identity(self):
+        calls = []
+
+        @once(key="identity")
+        def foo(payload):
+            calls.append(payload)
+            return len(payload)
+
+        l = [1, 2]
+        foo(l)
+        foo(l)
+        self.assertEqual(1, len(calls))
+
+        # an equal but different object isn't cached
+        foo([1, 2])
+        self.assertEqual(2, len(calls))
+
+    def test_many(self):
+        calls = []
+        bulks = []
+
+        @once
+        def foo(x, y=0):
+            calls.append(x)
+            return x + y
+
+        def bulk(args):
+            bulks.append(args)
+            return [x + y for x, y in args]
+
+        self.assertEqual(3, foo(1, 2))
+
+        r = foo.many([(1, 2), (3, 4), (5, 6), (3, 4)], bulk=bulk)
+        self.assertEqual([3, 7, 11, 7], r)
+        self.assertEqual([[(3, 4), (5, 6)]], bulks)
+        self.assertEqual([1], calls)
+
+        # everything is cached now
+        self.assertEqual(11, foo(5, 6))
+        self.assertEqual([3, 11], foo.many([(1, 2), (5, 6)], bulk=bulk))
+        self.assertEqual(1, len(bulks))
+
+        # without bulk each miss is called, a non-tuple is the only argument
+        self.assertEqual([10, 1], foo.many([10, 1]))
+        self.assertEqual([1, 10, 1], calls)
+
+        with self.assertRaises(ValueError):
+            foo.many([20, 21], bulk=lambda args: [1])
+
+    def test_many_backend(self):
+        """a backend doesn't need multi_get or multi_set for many()"""
+        class Backend(object):
+            def __init__(self):
+                self.values = {}
+
+            def get(self, key):
+                return self.values[key]
+
+            def set(self, key, value):
+                self.values[key] = value
+
+            def delete(self, key):
+                self.values.pop(key, None)
+
+        backend = Backend()
+
+        @once(backend=backend)
+        def foo(x):
+            return x + 1
+
+        self.assertEqual(2, foo(1))
+        self.assertEqual([2, 3, 4], foo.many([1, 2, 3], bulk=lambda args: [x + 1 for (x,) in args]))
+        self.assertEqual(3, len(backend.values))
+
+    def test_many_method(self):
+        calls = []
+
+        class Foo(object):
+            @once
+            def bar(self, x):
+                calls.append(x)
+                return x + 1
+
+        f = Foo()
+        self.assertEqual(2, f.bar(1))
+        self.assertEqual([2, 3], Foo.bar.many([(f, 1), (f, 2)]))
+        self.assertEqual(
+            [2, 3],
+            Foo.bar.many([(f, 1), (f, 2)], bulk=lambda args: [x + 10 for _, x in args]),
+        )
+        self.assertEqual(3, f.bar(2))
+        self.assertEqual([1, 2], calls)
+
+        # each instance has its own values
+        self.assertEqual([11], Foo.bar.many([(Foo(), 1)], bulk=lambda args: [11]))
+
+    def test_many_async(self):
+        import asyncio
+
+        calls = []
+
+        @once
+        async def foo(x):
+            calls.append(x)
+            return x * 2
+
+        async def bulk(args):
+            calls.extend(args)
+            return [x * 2 for (x,) in args]
+
+        async def main():
+            self.assertEqual(2, await foo(1))
+            self.assertEqual([2, 4, 6], await foo.many([1, 2, 3], bulk=bulk))
+            self.assertEqual([8, 2], await foo.many([4, 1]))
+
+        asyncio.run(main())
+        self.assertEqual([1, (2,), (3,), 4], calls)
+
+    def test_scope_context(self):
+        calls = []
+
+        @once(scope="context")
+        def foo(v):
+            calls.append(v)
+            return v + 1
+
+        # outside of a scope nothing is cached
+        self.assertEqual(2, foo(1))
+        self.assertEqual(2, foo(1))
+        self.assertEqual([1, 1], calls)
+
+        calls[:] = []
+        with once_scope():
+            self.assertEqual(2, foo(1))
+            self.assertEqual(2, foo(1))
+            self.assertEqual(3, foo(2))
+            self.assertEqual([1, 2], calls)
+
+            # a nested scope doesn't see the values of the outer scope
+            with once_scope():
+                foo(1)
+            self.assertEqual([1, 2, 1], calls)
+
+            foo(1)
+            self.assertEqual([1, 2, 1], calls)
+
+        # the values were released when the scope ended
+        with once_scope():
+            foo(1)
+        self.assertEqual([1, 2, 1, 1], calls)
+
+        with self.assertRaises(ValueError):
+            @once(scope="nope")
+            def bar(): pass
+
+    def test_scope_threads(self):
+        import contextvars
+        import threading
+
+        calls = []
+
+        @scoped_once
+        def foo(v):
+            calls.append(v)
+            return v
+
+        def request():
+            with once_scope():
+                foo(1)
+                foo(1)
+
+        threads = [threading.Thread(target=request) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual([1] * 4, calls)
+
+        # a thread running in a copy of the scope's context shares its values
+        calls[:] = []
+        with once_scope():
+            foo(1)
+            t = threading.Thread(target=contextvars.copy_context().run, args=(foo, 1))
+            t.start()
+            t.join()
+        self.assertEqual([1], calls)
+
+    def test_scope_async(self):
+        import asyncio
+
+        calls = []
+
+        @scoped_once
+        async def foo(v):
+            calls.append(v)
+            await asyncio.sleep(0)
+            return v + 1
+
+        async def request():
+            async with once_scope():
+                self.assertEqual(2, await foo(1))
+                self.assertEqual(2, await foo(1))
+
+        async def main():
+            await asyncio.gather(*[request() for _ in range(3)])
+
+        asyncio.run(main())
+        self.assertEqual([1] * 3, calls)
+
 
 class DeprecatedTest(TestCase):
     def test_deprecated_func(self):
@@ -197,3 +463,28 @@ class DeprecatedTest(TestCase):
         r2 = Che()
         self.assertEqual(type(r1), type(r2))
 
+    def test_deprecated_async(self):
+        import asyncio
+        import inspect
+
+        @deprecated()
+        async def foo():
+            return 1
+
+        self.assertTrue(inspect.iscoroutinefunction(foo))
+        self.assertEqual(1, asyncio.run(foo()))
+
+        @deprecated
+        async def bar():
+            return 2
+
+        self.assertTrue(inspect.iscoroutinefunction(bar))
+        self.assertEqual(2, asyncio.run(bar()))
+
+        class Foo(object):
+            @deprecated
+            async def che(self):
+                return 3
+
+        self.assertTrue(inspect.iscoroutinefunction(Foo().che))
+        self.assertEqual(3, asyncio.run(Foo().che()))
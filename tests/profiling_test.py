@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, division, print_function, absolute_import
+import asyncio
+import os
+import pstats
+import signal
+import threading
+
+from decorators.compat import *
+from decorators.base import Decorator, FuncDecorator
+from decorators.profiling import Profiler
+
+from . import TestCase, testdata
+
+
+class noop(FuncDecorator):
+    match_kinds = True
+
+    def decorate(self, func):
+        def wrapped(*args, **kwargs):
+            return func(*args, **kwargs)
+        return wrapped
+
+
+def get_functions(stats):
+    return set(funcname for _, _, funcname in stats.stats)
+
+
+class ProfilerTest(TestCase):
+    def get_profiler(self, **kwargs):
+        profiler = Profiler(directory=testdata.create_dir()).install(signum=None, **kwargs)
+        self.addCleanup(profiler.uninstall)
+        return profiler
+
+    def test_uninstalled(self):
+        self.assertIsNone(Decorator.profiler)
+
+        decorated = []
+        class dec(FuncDecorator):
+            def decorate(self, func):
+                def wrapped(): return func()
+                decorated.append(wrapped)
+                return wrapped
+
+        @dec()
+        def foo(): pass
+        self.assertIs(decorated[0], foo)
+
+    def test_calls(self):
+        profiler = self.get_profiler()
+
+        @noop
+        def inner_function(): return 1
+
+        @noop()
+        def foo_function():
+            return inner_function()
+
+        @noop()
+        def bar_function(): return 2
+
+        # nothing is profiled before a capture is started
+        self.assertEqual(1, foo_function())
+
+        capture = profiler.start("*.foo_function", calls=2)
+        for _ in range(5):
+            foo_function()
+            bar_function()
+
+        path = capture.wait(1)
+        self.assertTrue(os.path.isfile(path))
+        self.assertEqual(2, capture.calls)
+        self.assertIsNone(profiler.capture)
+
+        names = get_functions(pstats.Stats(path))
+        self.assertTrue("foo_function" in names)
+        self.assertTrue("inner_function" in names)
+        self.assertFalse("bar_function" in names)
+
+    def test_seconds(self):
+        profiler = self.get_profiler()
+
+        @noop()
+        def foo(): return 1
+
+        capture = profiler.start(seconds=0.1)
+        foo()
+        path = capture.wait(2)
+        self.assertTrue(os.path.isfile(path))
+
+        # a capture that didn't see any calls doesn't write a file
+        capture = profiler.start(seconds=0.1)
+        self.assertIsNone(capture.wait(2))
+        self.assertTrue(capture.finished.is_set())
+
+    def test_threads(self):
+        profiler = self.get_profiler()
+
+        @noop()
+        def foo(): return sum(range(100))
+
+        capture = profiler.start()
+        threads = [threading.Thread(target=foo) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        profiler.stop()
+
+        path = capture.wait(1)
+        self.assertEqual(4, capture.calls)
+        self.assertTrue("foo" in get_functions(pstats.Stats(path)))
+
+    def test_async(self):
+        profiler = self.get_profiler()
+
+        @noop()
+        async def foo():
+            await asyncio.sleep(0)
+            return 1
+
+        capture = profiler.start(calls=1)
+        self.assertEqual(1, asyncio.run(foo()))
+        path = capture.wait(1)
+        self.assertTrue("foo" in get_functions(pstats.Stats(path)))
+
+    def test_signal(self):
+        profiler = Profiler(directory=testdata.create_dir()).install(seconds=None)
+        self.addCleanup(profiler.uninstall)
+
+        @noop()
+        def foo(): return 1
+
+        os.kill(os.getpid(), signal.SIGUSR1)
+        for _ in range(100):
+            if profiler.capture:
+                break
+            threading.Event().wait(0.01)
+
+        capture = profiler.capture
+        foo()
+        os.kill(os.getpid(), signal.SIGUSR1)
+        self.assertTrue(os.path.isfile(capture.wait(1)))
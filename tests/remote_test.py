@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, division, print_function, absolute_import
+import os
+import threading
+
+from decorators.compat import *
+from decorators.remote import CacheServer, RemoteCache, pack
+from decorators.descriptor import property
+from decorators.misc import once
+from decorators.keys import get_key, UnstableKeyError
+
+from . import TestCase, testdata
+
+
+class RemoteCacheTest(TestCase):
+    def get_cache(self, address=None, **kwargs):
+        if address is None:
+            address = os.path.join(testdata.create_dir(), "cache.sock")
+
+        server = CacheServer(address).start()
+        self.addCleanup(server.stop)
+
+        kwargs.setdefault("secret", "foo")
+        cache = RemoteCache(server.address, **kwargs)
+        self.addCleanup(cache.close)
+        return cache
+
+    def test_get_set_delete(self):
+        for address in [None, ("127.0.0.1", 0)]:
+            cache = self.get_cache(address)
+
+            with self.assertRaises(KeyError):
+                cache.get("foo")
+
+            self.assertTrue(cache.set("foo", {"bar": [1, 2]}))
+            self.assertEqual({"bar": [1, 2]}, cache.get("foo"))
+
+            cache.delete("foo")
+            with self.assertRaises(KeyError):
+                cache.get("foo")
+
+            # the connection was reused for every request
+            self.assertEqual(1, len(cache.pool))
+
+    def test_secret(self):
+        cache = self.get_cache()
+        cache.set("foo", 1)
+        cache.multi_set({"bar": 2})
+
+        # a client with another secret doesn't unpickle the values
+        other = RemoteCache(cache.address, secret=b"bar")
+        self.addCleanup(other.close)
+        with self.assertLogs("decorators.remote", "WARNING") as c:
+            with self.assertRaises(KeyError):
+                other.get("foo")
+            self.assertEqual({}, other.multi_get(["foo", "bar"]))
+        self.assertTrue("bad signature" in c.output[0])
+
+        # a value that was moved to another key isn't unpickled either
+        with cache.connection() as connection:
+            value = connection.request(pack(b"G", b"foo"))[0][0]
+            connection.request(pack(b"S", b"che", value))
+        with self.assertLogs("decorators.remote", "WARNING"):
+            with self.assertRaises(KeyError):
+                cache.get("che")
+        self.assertEqual({"foo": 1, "bar": 2}, cache.multi_get(["foo", "bar"]))
+
+        environ = os.environ.pop("DECORATORS_CACHE_SECRET", None)
+        if environ is not None:
+            self.addCleanup(os.environ.__setitem__, "DECORATORS_CACHE_SECRET", environ)
+        with self.assertRaises(ValueError):
+            RemoteCache(cache.address)
+
+        os.environ["DECORATORS_CACHE_SECRET"] = "foo"
+        self.addCleanup(os.environ.pop, "DECORATORS_CACHE_SECRET", None)
+        self.assertEqual(1, RemoteCache(cache.address).get("foo"))
+
+    def test_multi_get(self):
+        cache = self.get_cache()
+        for i in range(0, 10, 2):
+            cache.set("k{}".format(i), i)
+
+        r = cache.multi_get("k{}".format(i) for i in range(10))
+        self.assertEqual({"k0": 0, "k2": 2, "k4": 4, "k6": 6, "k8": 8}, r)
+        self.assertEqual({}, cache.multi_get([]))
+
+    def test_multi_set(self):
+        cache = self.get_cache()
+        items = {"k{}".format(i): i for i in range(300)}
+        cache.multi_set(items)
+        self.assertEqual(items, cache.multi_get(items))
+
+    def test_once_many(self):
+        cache = self.get_cache()
+
+        @once(backend=cache)
+        def foo(x):
+            return x + 1
+
+        self.assertEqual(2, foo(1))
+        self.assertEqual([2, 3, 4], foo.many([1, 2, 3], bulk=lambda args: [x + 1 for (x,) in args]))
+        # the bulk results were cached on the server with stable keys
+        self.assertEqual(4, cache.get(get_key(foo.__wrapped__, (3,), {})))
+
+    def test_threads(self):
+        cache = self.get_cache(pool_size=2)
+
+        def run(n):
+            for i in range(20):
+                cache.set("{}-{}".format(n, i), i)
+                self.assertEqual(i, cache.get("{}-{}".format(n, i)))
+
+        threads = [threading.Thread(target=run, args=(n,)) for n in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(19, cache.get("3-19"))
+        self.assertTrue(len(cache.pool) <= 2)
+
+    def test_server_down(self):
+        cache = RemoteCache(os.path.join(testdata.create_dir(), "nope.sock"), secret="foo")
+
+        with self.assertLogs("decorators.remote", "WARNING"):
+            with self.assertRaises(KeyError):
+                cache.get("foo")
+            self.assertFalse(cache.set("foo", 1))
+            self.assertEqual({}, cache.multi_get(["foo"]))
+
+    def test_once(self):
+        cache = self.get_cache()
+        calls = []
+
+        @once(backend=cache)
+        def foo(v):
+            calls.append(v)
+            return v + 1
+
+        self.assertEqual(2, foo(1))
+        self.assertEqual(2, foo(1))
+        self.assertEqual([1], calls)
+
+        # objects without a stable key aren't cached in another process's name
+        with self.assertRaises(UnstableKeyError):
+            foo(object())
+
+    def test_property(self):
+        cache = self.get_cache()
+        calls = []
+
+        class Foo(object):
+            def __init__(self, pk):
+                self.pk = pk
+
+            @property(cached="_bar", backend=cache, key=lambda self: self.pk)
+            def bar(self):
+                calls.append(self.pk)
+                return self.pk * 10
+
+        self.assertEqual(10, Foo(1).bar)
+        # a different instance with the same key gets the value from the backend
+        f = Foo(1)
+        self.assertEqual(10, f.bar)
+        self.assertEqual(10, f._bar)
+        self.assertEqual([1], calls)
+
+        f.bar = 20
+        self.assertEqual(20, Foo(1).bar)
+
+        del f.bar
+        self.assertEqual(10, Foo(1).bar)
+        self.assertEqual([1, 1], calls)
+
+        # different instances get their own values
+        self.assertEqual([20, 30], [Foo(2).bar, Foo(3).bar])
+
+        with self.assertRaises(ValueError):
+            class Bar(object):
+                @property(cached="_che", backend=cache)
+                def che(self):
+                    return 1
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, division, print_function, absolute_import
+import asyncio
+import gc
+import inspect
+import subprocess
+import sys
+import time
+
+from decorators.compat import *
+from decorators.base import Decorator, FuncDecorator
+from decorators.stats import Registry
+
+from . import TestCase, testdata
+
+
+class RegistryTest(TestCase):
+    def get_registry(self):
+        registry = Registry().enable()
+        self.addCleanup(registry.disable)
+        return registry
+
+    def test_disabled(self):
+        self.assertIsNone(Decorator.registry)
+
+        decorated = []
+        class noop(FuncDecorator):
+            def decorate(self, func):
+                def wrapped(): return func()
+                decorated.append(wrapped)
+                return wrapped
+
+        @noop()
+        def foo(): pass
+        # with the registry off the decorated function isn't wrapped again
+        self.assertIs(decorated[0], foo)
+
+        registry = Registry()
+        self.assertFalse(registry.enabled)
+        registry.enable()
+        self.assertTrue(registry.enabled)
+        registry.disable()
+        self.assertIsNone(Decorator.registry)
+
+    def test_register(self):
+        registry = self.get_registry()
+
+        class noop(FuncDecorator):
+            def decorate(self, func, *args, **kwargs):
+                def wrapped(*args, **kwargs):
+                    return func(*args, **kwargs)
+                return wrapped
+
+        @noop(1, foo="bar")
+        def foo(v):
+            if v < 0:
+                raise ValueError()
+            return v
+
+        @noop
+        def bar(): pass
+
+        for i in range(5):
+            foo(i)
+        with self.assertRaises(ValueError):
+            foo(-1)
+        bar()
+
+        rows = {row["name"].rsplit(".", 1)[-1]: row for row in registry.rows()}
+        self.assertEqual(6, rows["foo"]["calls"])
+        self.assertEqual(1, rows["foo"]["errors"])
+        self.assertEqual("(1, foo='bar')", rows["foo"]["args"])
+        self.assertEqual("noop", rows["foo"]["decorator"])
+        self.assertEqual(1, rows["bar"]["calls"])
+
+        rows = registry.rows("calls")
+        self.assertTrue(rows[0]["name"].endswith("foo"))
+
+        table = registry.table(limit=1, sort="calls")
+        self.assertEqual(2, len(table.splitlines()))
+        self.assertTrue("noop(1, foo='bar')" in table)
+
+        with self.assertRaises(ValueError):
+            registry.rows("foo")
+
+    def test_weakref(self):
+        registry = self.get_registry()
+
+        class noop(FuncDecorator):
+            def decorate(self, func):
+                def wrapped(): return func()
+                return wrapped
+
+        @noop()
+        def foo(): pass
+        self.assertEqual(1, len(registry.entries))
+
+        del foo
+        gc.collect()
+        self.assertEqual(0, len(registry.entries))
+
+    def test_kinds(self):
+        registry = self.get_registry()
+
+        class noop(Decorator):
+            def decorate_func(self, func):
+                return func
+
+            def decorate_class(self, klass):
+                return klass
+
+        @noop()
+        async def foo():
+            await asyncio.sleep(0.01)
+            return 1
+
+        @noop()
+        def bar():
+            yield 1
+            yield 2
+
+        @noop()
+        class Che(object): pass
+
+        self.assertTrue(inspect.iscoroutinefunction(foo))
+        self.assertTrue(inspect.isgeneratorfunction(bar))
+        self.assertTrue(inspect.isclass(Che))
+
+        self.assertEqual(1, asyncio.run(foo()))
+        self.assertEqual([1, 2], list(bar()))
+
+        rows = {row["name"].rsplit(".", 1)[-1]: row for row in registry.rows()}
+        self.assertEqual(1, rows["foo"]["calls"])
+        self.assertLessEqual(0.01, rows["foo"]["total"])
+        self.assertEqual(1, rows["bar"]["calls"])
+        self.assertEqual("class", rows["Che"]["kind"])
+
+    def test_main(self):
+        path = testdata.create_file([
+            "from decorators import once",
+            "",
+            "@once",
+            "def foo(): return 1",
+            "",
+            "for _ in range(10):",
+            "    foo()",
+        ])
+
+        output = subprocess.check_output(
+            [sys.executable, "-m", "decorators.stats", "-n", "5", path],
+            stderr=subprocess.STDOUT,
+        ).decode("utf-8")
+        self.assertTrue("once()" in output)
+        self.assertTrue("foo" in output)
+        self.assertTrue(" 10 " in output)
+
+    def test_accounting(self):
+        call = Decorator.__call__
+        registry = Registry().enable(accounting=True)
+        self.addCleanup(registry.disable)
+        self.assertIsNot(call, Decorator.__call__)
+
+        class slow(FuncDecorator):
+            def decorate(self, func):
+                def wrapped(*args, **kwargs):
+                    time.sleep(0.01)
+                    return func(*args, **kwargs)
+                return wrapped
+
+        @slow
+        def foo():
+            time.sleep(0.01)
+
+        class Foo(object):
+            @slow
+            def bar(self):
+                time.sleep(0.01)
+
+        for _ in range(3):
+            foo()
+            Foo().bar()
+
+        rows = {row["name"].rsplit(".", 1)[-1]: row for row in registry.rows("overhead")}
+        for name in ["foo", "bar"]:
+            row = rows[name]
+            self.assertEqual(3, row["calls"])
+            self.assertLessEqual(0.03, row["callee"])
+            self.assertLessEqual(0.03, row["library"])
+            self.assertAlmostEqual(0.5, row["overhead"], delta=0.1)
+
+        self.assertTrue("overhead" in registry.table())
+
+        registry.disable()
+        self.assertIs(call, Decorator.__call__)
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, division, print_function, absolute_import
+import asyncio
+import json
+import os
+import time
+
+from decorators.compat import *
+from decorators.instrument import Counter
+from decorators.tracing import (
+    RingBuffer,
+    Tracer,
+    traced,
+)
+
+from . import TestCase, testdata
+
+
+class TracerTest(TestCase):
+    def get_tracer(self, **kwargs):
+        kwargs.setdefault("path", os.path.join(testdata.create_dir(), "spans.jsonl"))
+        tracer = Tracer(**kwargs)
+        self.addCleanup(tracer.close)
+        return tracer
+
+    def get_spans(self, tracer):
+        tracer.flush()
+        with open(tracer.path) as fp:
+            return {d["name"]: d for d in (json.loads(line) for line in fp)}
+
+    def test_tree(self):
+        tracer = self.get_tracer()
+
+        @traced(name="child", tracer=tracer)
+        def child():
+            tracer.get_current_span().set("foo", 1)
+
+        @traced(name="parent", attributes={"bar": 2}, tracer=tracer)
+        def parent():
+            child()
+
+        parent()
+        self.assertIsNone(tracer.get_current_span())
+
+        spans = self.get_spans(tracer)
+        self.assertIsNone(spans["parent"]["parent_id"])
+        self.assertEqual(spans["parent"]["span_id"], spans["child"]["parent_id"])
+        self.assertEqual(spans["parent"]["trace_id"], spans["child"]["trace_id"])
+        self.assertEqual({"foo": 1}, spans["child"]["attributes"])
+        self.assertEqual({"bar": 2}, spans["parent"]["attributes"])
+        self.assertLessEqual(spans["child"]["duration"], spans["parent"]["duration"])
+
+    def test_error(self):
+        tracer = self.get_tracer()
+
+        @traced(name="foo", tracer=tracer)
+        def foo():
+            raise ValueError("boom")
+
+        with self.assertRaises(ValueError):
+            foo()
+
+        spans = self.get_spans(tracer)
+        self.assertEqual("ValueError: boom", spans["foo"]["error"])
+
+    def test_async(self):
+        tracer = self.get_tracer()
+
+        @traced(name="child", tracer=tracer)
+        async def child():
+            await asyncio.sleep(0)
+
+        @traced(name="parent", tracer=tracer)
+        async def parent():
+            await asyncio.gather(child(), asyncio.create_task(child()))
+
+        asyncio.run(parent())
+
+        tracer.flush()
+        with open(tracer.path) as fp:
+            spans = [json.loads(line) for line in fp]
+        parent = [s for s in spans if s["name"] == "parent"][0]
+        children = [s for s in spans if s["name"] == "child"]
+        self.assertEqual(2, len(children))
+        for s in children:
+            self.assertEqual(parent["span_id"], s["parent_id"])
+
+    def test_rotate(self):
+        tracer = self.get_tracer(max_bytes=100, backups=2)
+
+        @traced(name="foo", tracer=tracer)
+        def foo(): pass
+
+        for _ in range(4):
+            foo()
+            tracer.flush()
+
+        self.assertTrue(os.path.isfile(tracer.path + ".1"))
+        self.assertTrue(os.path.isfile(tracer.path + ".2"))
+        self.assertFalse(os.path.isfile(tracer.path + ".3"))
+
+    def test_background(self):
+        tracer = self.get_tracer(interval=0.01)
+
+        @traced(name="foo", tracer=tracer)
+        def foo(): pass
+
+        foo()
+        for _ in range(100):
+            if os.path.isfile(tracer.path):
+                break
+            time.sleep(0.01)
+        self.assertTrue("foo" in self.get_spans(tracer))
+
+    def test_fork(self):
+        tracer = self.get_tracer(interval=0.01)
+
+        @traced(name="foo", tracer=tracer)
+        def foo():
+            pass
+
+        foo()
+        tracer.flush()
+        # the parent's writer thread is running when the child is forked
+        self.assertIsNotNone(tracer.thread)
+
+        r, w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                foo()
+                foo()
+                alive = tracer.thread.is_alive()
+                # the writer thread might have drained the buffer but not
+                # written it yet, close() waits for it
+                tracer.close()
+                os.write(w, "{}".format(alive and not len(tracer.buffer)).encode("utf-8"))
+            finally:
+                os._exit(0)
+
+        os.close(w)
+        os.waitpid(pid, 0)
+        with os.fdopen(r) as fp:
+            self.assertEqual("True", fp.read())
+
+        with open(tracer.path) as fp:
+            self.assertEqual(3, len(fp.readlines()))
+
+    def test_fork_default_path(self):
+        tracer = Tracer()
+        path = tracer.path
+        self.assertTrue(str(os.getpid()) in path)
+
+        r, w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                os.write(w, tracer.path.encode("utf-8"))
+            finally:
+                os._exit(0)
+
+        os.close(w)
+        os.waitpid(pid, 0)
+        with os.fdopen(r) as fp:
+            child_path = fp.read()
+
+        self.assertNotEqual(path, child_path)
+        self.assertTrue(str(pid) in child_path)
+
+
+class RingBufferTest(TestCase):
+    def test_overflow(self):
+        dropped = Counter("dropped")
+        b = RingBuffer(2, dropped)
+        self.assertTrue(b.put(1))
+        self.assertTrue(b.put(2))
+        self.assertFalse(b.put(3))
+        self.assertEqual(1, dropped.value)
+
+        self.assertEqual([1], b.drain(1))
+        self.assertTrue(b.put(4))
+        self.assertEqual([2, 4], b.drain())
+        self.assertEqual([], b.drain())